@@ -0,0 +1,118 @@
+""" Peak memory and time to fetch large gzipped JSON from a local stand-in
+for Oyez: a term listing of many cases, read whole and streamed keeping
+only the argued cases as recent_cases does, and a long transcript. Each is
+compared with reading the response whole, decompressing it and then
+decoding it, as the downloader used to.
+
+  python benchmarks/bench_downloads.py [cases] [turns]
+"""
+
+import os
+import sys
+import gzip
+import json
+import tracemalloc
+import http.server
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from puppyjustice import downloader
+from synthetic import synthetic_term_listing, synthetic_transcript
+from bench_subtitles import best_of
+
+
+def serve(payloads, ready):
+    """ Serve each payload, gzipped, at its path until killed """
+    bodies = {path: gzip.compress(json.dumps(payload).encode('utf-8'))
+              for path, payload in payloads.items()}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            body = bodies[self.path]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    ready.put((server.server_address[1],
+               {path: len(body) for path, body in bodies.items()}))
+    server.serve_forever()
+
+
+def buffered_json(fetcher, url):
+    """ The downloader's old path: three full copies of the response """
+    status, headers, body = fetcher.request(url)
+    return json.loads(gzip.decompress(body).decode('utf-8'))
+
+
+def was_argued(case):
+    return any(event["event"] == "Argued" for event in case["timeline"])
+
+
+def peak_memory(fn):
+    """ The peak memory allocated while running fn, and how much of it is
+    still held by what it returns
+    """
+    tracemalloc.start()
+    result = fn()
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak, kept
+
+
+def main(cases=20000, turns=20000):
+    payloads = {
+        "/cases": synthetic_term_listing(cases),
+        "/transcript": synthetic_transcript(turns),
+    }
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve, args=(payloads, ready),
+                                     daemon=True)
+    server.start()
+    port, sizes = ready.get()
+    text_sizes = {path: len(json.dumps(payload))
+                  for path, payload in payloads.items()}
+    del payloads
+
+    fetcher = downloader.Fetcher(max_workers=1)
+    base = "http://127.0.0.1:{}".format(port)
+    ways = [
+        ("cases", "buffered", lambda: buffered_json(fetcher, base + "/cases")),
+        ("cases", "fetch_json", lambda: fetcher.fetch_json(base + "/cases")),
+        ("cases", "argued only", lambda: fetcher.fetch_items(base + "/cases",
+                                                              was_argued)),
+        ("transcript", "buffered",
+         lambda: buffered_json(fetcher, base + "/transcript")),
+        ("transcript", "fetch_json",
+         lambda: fetcher.fetch_json(base + "/transcript")),
+    ]
+
+    results = []
+    try:
+        for name, way, fetch in ways:
+            path = "/" + name
+            seconds = best_of(fetch)
+            peak, kept = peak_memory(fetch)
+            print("{:10} ({:5.1f} MB, {:5.1f} MB gzipped) {:12} peak {:6.1f} MB,"
+                  " {:6.1f} MB over the result, in {:.2f}s".format(
+                      name, text_sizes[path] / 2**20, sizes[path] / 2**20,
+                      way, peak / 2**20, (peak - kept) / 2**20, seconds))
+            results.append({"payload": name, "way": way, "seconds": seconds,
+                            "peak_bytes": peak, "result_bytes": kept})
+    finally:
+        server.terminate()
+    return results
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,63 @@
+""" Plan synthetic arguments against the resource library and report how
+choppy the edit is: cuts (changes of clip) and trims (clips entered or left
+part way through, each a seek and a partial decode) per minute of video,
+along with the planning time. Run from the repository root.
+
+  python benchmarks/bench_planner.py [turns ...]
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from puppyjustice import planner
+from puppyjustice.catalog import load_resources
+from synthetic import synthetic_case, synthetic_transcript
+from bench_subtitles import best_of
+
+
+def edit_stats(speaker_turns, resources):
+    durations = {r.path: r.duration for clips in resources.values()
+                 for r in clips}
+    entries = [entry for turn in speaker_turns for entry in turn]
+    minutes = sum(planner.entry_duration(entry) for entry in entries) / 60
+    trims = sum(1 for entry in entries
+                if entry["in"] > 1e-6 or
+                entry["out"] < durations[entry["source"]] - 1e-6)
+    short = sum(1 for entry in entries
+                if planner.entry_duration(entry) < planner.MIN_CLIP_DURATION)
+    return {
+        "minutes": minutes,
+        "cuts_per_minute": (len(entries) - 1) / minutes,
+        "trims_per_minute": trims / minutes,
+        "short_clips": short,
+    }
+
+
+def main(*sizes):
+    resources = load_resources("resources")
+    case = synthetic_case()
+    results = []
+    for turns in sizes or (200, 2000):
+        transcript = synthetic_transcript(turns)
+
+        def plan():
+            return planner.plan_turns(case, resources, transcript,
+                                      random.Random(0))
+
+        seconds = best_of(plan)
+        stats = edit_stats(plan(), resources)
+        stats.update(turns=turns, plan_seconds=seconds)
+        print("{:6} turns, {:6.1f} minutes: {:5.2f} cuts/min, "
+              "{:5.2f} trims/min, {} clips under {}s, planned in {:.3f}s".format(
+                  turns, stats["minutes"], stats["cuts_per_minute"],
+                  stats["trims_per_minute"], stats["short_clips"],
+                  planner.MIN_CLIP_DURATION, seconds))
+        results.append(stats)
+    return results
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,47 @@
+""" Time subtitle generation for a synthetic 10,000 turn transcript, writing
+SBV alone and SBV, SRT and WebVTT in one pass.
+
+  python benchmarks/bench_subtitles.py [turns]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from puppyjustice import subtitles
+from synthetic import synthetic_transcript
+
+
+def best_of(fn, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(turns=10000):
+    transcript = synthetic_transcript(turns)
+    cue_count = sum(1 for _ in subtitles.cues(transcript))
+
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = {fmt: os.path.join(workdir, "subtitles." + fmt)
+                 for fmt in subtitles.WRITERS}
+
+        sbv = best_of(lambda: subtitles.write_subtitles(
+            transcript, {"sbv": paths["sbv"]}))
+        every = best_of(lambda: subtitles.write_subtitles(transcript, paths))
+
+    print("{} turns, {} cues".format(turns, cue_count))
+    print("  sbv only:      {:.3f}s ({:.0f} cues/s)".format(sbv, cue_count / sbv))
+    print("  sbv, srt, vtt: {:.3f}s ({:.0f} cues/s)".format(every, cue_count / every))
+    return {"turns": turns, "cues": cue_count, "sbv_seconds": sbv,
+            "all_formats_seconds": every}
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,131 @@
+""" Time producing frames from the clip tree for synthetic arguments of 5
+minutes to 2 hours, built with the timeline and with moviepy's compose
+concatenation. Resource clips are replaced by solid colours, so the time
+is that of finding and compositing clips rather than decoding them.
+
+  python benchmarks/bench_timeline.py [minutes ...]
+"""
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+from moviepy.editor import CompositeVideoClip, ImageClip, concatenate
+from puppyjustice import builder, planner
+from puppyjustice.catalog import Resource
+from puppyjustice.planner import entry_duration
+from synthetic import synthetic_case, synthetic_transcript
+
+RESOURCE_DIRS = sorted(planner.JUSTICE_MAPPING.values()) + \
+    ["lawyer0", "lawyer1", "misc"]
+
+# Roughly the average length of a synthetic turn
+SECONDS_PER_TURN = 18
+
+FRAMES = 300
+
+
+class ColorPool(object):
+    """ Stands in for catalog.ReaderPool, giving each path a solid colour """
+
+    def __init__(self):
+        self.clips = {}
+        self.durations = {}
+
+    def get(self, path):
+        if path not in self.clips:
+            width, height = planner.VIDEO_SIZE
+            frame = np.full((height, width, 3), random.randrange(256),
+                            dtype=np.uint8)
+            self.clips[path] = ImageClip(frame,
+                                         duration=self.durations[path])
+        return self.clips[path]
+
+
+def color_resources():
+    pool = ColorPool()
+    info = {"fps": 30, "width": planner.VIDEO_SIZE[0],
+            "height": planner.VIDEO_SIZE[1], "codec": "h264"}
+    resources = {}
+    for name in RESOURCE_DIRS:
+        resources[name] = []
+        for k in range(3):
+            path = "{}/{}.mp4".format(name, k)
+            pool.durations[path] = 60 - 10 * k
+            resources[name].append(Resource(path, dict(info, duration=60 - 10 * k),
+                                            pool))
+    return resources
+
+
+def compose_render_plan(plan, resources):
+    """ The clip tree builder.render_plan made before the timeline """
+    sources = {r.path: r for clips in resources.values() for r in clips}
+    speaker_videos = [concatenate([builder.render_entry(entry, sources)
+                                   for entry in entries])
+                      for entries in planner.plan_turn_groups(plan)]
+
+    intro = builder.generate_intro(plan["intro"]["title"])
+    crossfade = plan["intro"]["crossfade"]
+    first, *speaker_videos = speaker_videos
+    intro_and_first = CompositeVideoClip([
+        intro, first.set_start(intro.end - crossfade).crossfadein(crossfade)])
+    intro_and_first = intro_and_first.set_duration(
+        intro.duration + first.duration - crossfade)
+    return concatenate([intro_and_first] + speaker_videos, method="compose")
+
+
+def plain_times(plan, frames=FRAMES):
+    """ Times spread through the plan that fall in the middle of clips
+    without overlays, after the intro and the speaker crossfading from it,
+    so that each frame costs the same whatever the length of the video,
+    apart from finding its clip
+    """
+    groups = list(planner.plan_turn_groups(plan))[1:]
+    entries = [entry for entries in groups for entry in entries
+               if not entry["overlays"]]
+    return [entries[i * len(entries) // frames]["start"] +
+            entry_duration(entries[i * len(entries) // frames]) / 2
+            for i in range(frames)]
+
+
+def per_frame(clip, times):
+    """ Mean seconds per frame """
+    start = time.perf_counter()
+    for t in times:
+        clip.get_frame(t)
+    return (time.perf_counter() - start) / len(times)
+
+
+def main(*minutes):
+    minutes = minutes or (5, 30, 120)
+    results = []
+    for length in minutes:
+        random.seed(0)
+        resources = color_resources()
+        case = synthetic_case()
+        transcript = synthetic_transcript(int(length * 60 / SECONDS_PER_TURN))
+        plan = planner.plan_video(case["name"], case, resources, transcript)
+        # The ending is a real file; it isn't needed to time the rest
+        plan["ending"] = None
+
+        times = plain_times(plan)
+        timeline = per_frame(builder.render_plan(plan, resources), times)
+        compose = per_frame(compose_render_plan(plan, resources), times)
+
+        print("{:5.0f} minutes, {:5} clips: timeline {:6.2f}ms/frame, "
+              "compose {:6.2f}ms/frame".format(
+                  plan["duration"] / 60, len(plan["clips"]),
+                  1000 * timeline, 1000 * compose))
+        results.append({"minutes": plan["duration"] / 60,
+                        "clips": len(plan["clips"]),
+                        "timeline_seconds_per_frame": timeline,
+                        "compose_seconds_per_frame": compose})
+    return results
+
+
+if __name__ == "__main__":
+    main(*[float(arg) for arg in sys.argv[1:]])
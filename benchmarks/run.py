@@ -0,0 +1,215 @@
+"""
+Run the benchmark suite against tiny resource clips generated with ffmpeg
+and synthetic Oyez shaped cases, writing the results as JSON. Given a
+baseline from an earlier run, exits non-zero if any measurement is worse
+than the baseline by more than the threshold.
+
+USAGE:
+  run.py [options]
+
+OPTIONS:
+  --sizes=<turns>      Transcript sizes to plan and subtitle [default: 10,1000,10000]
+  --render-seconds=<s> Length of video to render [default: 20]
+  --backend=<name>     Render with 'moviepy' or 'ffmpeg' [default: moviepy]
+  --output=<path>      Where to write the results [default: benchmark.json]
+  --baseline=<path>    Results of an earlier run to compare against
+  --threshold=<frac>   Allowed slowdown relative to the baseline [default: 0.2]
+  --workdir=<path>     Keep the generated clips here between runs
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from docopt import docopt
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from puppyjustice import planner, subtitles, segments
+from puppyjustice.catalog import load_resources
+from puppyjustice.planner import entry_duration
+from synthetic import synthetic_case, synthetic_transcript
+from bench_subtitles import best_of
+
+RESOURCE_DIRS = sorted(planner.JUSTICE_MAPPING.values()) + \
+    ["lawyer0", "lawyer1", "misc"]
+CLIPS_PER_RESOURCE = 3
+
+# Measurements where a larger number is better; for the rest, smaller is
+LARGER_IS_BETTER = ("_fps",)
+
+
+def make_clip(path, duration, hue, size=planner.VIDEO_SIZE):
+    subprocess.check_call(["ffmpeg", "-v", "error", "-y",
+                           "-f", "lavfi",
+                           "-i", "testsrc=size={}x{}:rate=30:duration={}".format(
+                               size[0], size[1], duration),
+                           "-vf", "hue=h={}".format(hue),
+                           "-c:v", "libx264", "-preset", "ultrafast",
+                           "-pix_fmt", "yuv420p",
+                           path])
+
+
+def make_resources(workdir):
+    """ A resource library of test pattern clips, each longer than the
+    longest cut the planner makes from one (MAX_RELATED_TIME), laid
+    out as the runner expects, in workdir/resources
+    """
+    base = os.path.join(workdir, "resources")
+    for i, name in enumerate(RESOURCE_DIRS):
+        os.makedirs(os.path.join(base, name), exist_ok=True)
+        for k in range(CLIPS_PER_RESOURCE):
+            path = os.path.join(base, name, "{}{}.mp4".format(name, k))
+            if not os.path.exists(path):
+                make_clip(path, 4.5 + 3 * k, i * 30)
+
+    disclaimer = os.path.join(base, "disclaimer.mp4")
+    if not os.path.exists(disclaimer):
+        make_clip(disclaimer, 3, 0)
+    for background in ("speaker_background.png", "intro_background.png"):
+        shutil.copy(os.path.join(ROOT, "resources", background), base)
+
+
+def peak_rss():
+    """ Peak resident memory in MiB of this process and of its children """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own / 1024, children / 1024
+
+
+def head_plan(plan, seconds):
+    """ The first 'seconds' or so of a plan, without the ending
+    """
+    clips = []
+    for entry in plan["clips"]:
+        if clips and entry["start"] >= seconds:
+            break
+        clips.append(entry)
+    end = clips[-1]["start"] + entry_duration(clips[-1])
+    return dict(plan, clips=clips, ending=None, duration=end)
+
+
+def bench_planning(turns):
+    random.seed(0)
+    resources = load_resources("resources")
+    case = synthetic_case()
+    transcript = synthetic_transcript(turns)
+    seconds = best_of(lambda: planner.plan_video(case["name"], case, resources,
+                                                 transcript))
+    rss, _ = peak_rss()
+    return {"plan_seconds": seconds, "plan_peak_rss_mb": rss}
+
+
+def bench_subtitles(turns):
+    transcript = synthetic_transcript(turns)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {fmt: os.path.join(directory, "subtitles." + fmt)
+                 for fmt in subtitles.WRITERS}
+        seconds = best_of(lambda: subtitles.write_subtitles(transcript, paths))
+    rss, _ = peak_rss()
+    return {"subtitle_seconds": seconds, "subtitle_peak_rss_mb": rss}
+
+
+def bench_render(seconds, backend):
+    random.seed(0)
+    resources = load_resources("resources")
+    case = synthetic_case()
+    plan = planner.plan_video(case["name"], case, resources,
+                              synthetic_transcript(50))
+    plan = head_plan(plan, seconds)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        segments.render_segment(plan, os.path.join(directory, "render.mp4"),
+                                backend)
+        elapsed = time.perf_counter() - start
+
+    rss, children_rss = peak_rss()
+    return {
+        "render_seconds": elapsed,
+        "render_fps": plan["duration"] * segments.FPS / elapsed,
+        "render_peak_rss_mb": rss,
+        "render_encoder_peak_rss_mb": children_rss,
+    }
+
+
+def isolated(fn, *args):
+    """ Run a benchmark in a fresh process, so its peak memory is its own
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(fn, *args).result()
+
+
+def compare(results, baseline, threshold):
+    """ Returns a description of every measurement that regressed """
+    regressions = []
+    for name, value in sorted(results.items()):
+        before = baseline.get(name)
+        if not isinstance(value, (int, float)) or not before:
+            continue
+        if any(key in name for key in LARGER_IS_BETTER):
+            change = (before - value) / before
+        else:
+            change = (value - before) / before
+        if change > threshold:
+            regressions.append("{}: {:.4g} against a baseline of {:.4g} "
+                               "({:.0%} worse)".format(name, value, before, change))
+    return regressions
+
+
+def main(arguments):
+    workdir = arguments["--workdir"] or tempfile.mkdtemp(prefix="pjbench")
+    os.makedirs(workdir, exist_ok=True)
+    output = os.path.abspath(arguments["--output"])
+    baseline_path = arguments["--baseline"] and \
+        os.path.abspath(arguments["--baseline"])
+    os.chdir(workdir)
+    make_resources(workdir)
+
+    results = {}
+    for turns in [int(size) for size in arguments["--sizes"].split(",")]:
+        print("Planning and subtitling {} turns".format(turns))
+        for name, value in isolated(bench_planning, turns).items():
+            results["{}_{}".format(name, turns)] = value
+        for name, value in isolated(bench_subtitles, turns).items():
+            results["{}_{}".format(name, turns)] = value
+
+    backend = arguments["--backend"]
+    print("Rendering {}s with {}".format(arguments["--render-seconds"], backend))
+    for name, value in isolated(bench_render,
+                                float(arguments["--render-seconds"]),
+                                backend).items():
+        results["{}_{}".format(name, backend)] = value
+
+    for name, value in sorted(results.items()):
+        print("  {:40} {:.4g}".format(name, value))
+    with open(output, "w", encoding='utf-8') as file:
+        json.dump(results, file, indent=1, sort_keys=True)
+
+    if not arguments["--workdir"]:
+        shutil.rmtree(workdir)
+
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline,
+                              float(arguments["--threshold"]))
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(docopt(__doc__)))
@@ -0,0 +1,110 @@
+import random
+
+""" Synthetic Oyez shaped cases and transcripts for the benchmarks
+"""
+
+JUSTICES = [
+    (1, "John G. Roberts, Jr.", "Chief Justice"),
+    (2, "Antonin Scalia", "Associate Justice"),
+    (3, "Ruth Bader Ginsburg", "Associate Justice"),
+    (4, "Sonia Sotomayor", "Associate Justice"),
+    (5, "Elena Kagan", "Associate Justice"),
+    (6, "Stephen G. Breyer", "Associate Justice"),
+    (7, "Anthony M. Kennedy", "Associate Justice"),
+    (8, "Samuel A. Alito, Jr.", "Associate Justice"),
+    (9, "Clarence Thomas", "Associate Justice"),
+]
+
+ADVOCATES = [
+    (101, "Jane Q. Lawyer", "for the petitioner"),
+    (102, "John R. Counsel", "for the respondent"),
+]
+
+WORDS = ("the court statute question counsel argument justice whether "
+         "congress intended plain meaning text precedent first amendment "
+         "clause jurisdiction remedy standing petitioner respondent").split()
+
+
+def synthetic_case(case_id=1):
+    return {
+        "ID": case_id,
+        "name": "Petitioner v. Respondent",
+        "advocates": [{"advocate": {"ID": id, "name": name},
+                       "advocate_description": description}
+                      for id, name, description in ADVOCATES],
+        "heard_by": [{"members": [{"ID": id, "name": name,
+                                   "roles": [{"role_title": role}]}
+                                  for id, name, role in JUSTICES]}],
+    }
+
+
+def speaker(id, name, justice):
+    return {
+        "ID": id,
+        "name": name,
+        "last_name": name.replace(", Jr.", "").split()[-1],
+        "roles": [{}] if justice else None,
+    }
+
+
+def synthetic_transcript(turns, seed=0, sections=2):
+    rand = random.Random(seed)
+    speakers = [speaker(id, name, True) for id, name, _ in JUSTICES] + \
+        [speaker(id, name, False) for id, name, _ in ADVOCATES]
+
+    time = 0.0
+    transcript = {"sections": []}
+    per_section = max(1, turns // sections)
+    for section_num in range(sections):
+        count = per_section if section_num < sections - 1 else \
+            turns - per_section * (sections - 1)
+        section = {"start": time, "turns": []}
+        for _ in range(count):
+            # Advocates do most of the talking, in long turns
+            if rand.random() < 0.5:
+                who = rand.choice(speakers[-2:])
+                duration = rand.uniform(5, 60)
+            else:
+                who = rand.choice(speakers[:-2])
+                duration = rand.choice([0.5, 1.0, rand.uniform(2, 20)])
+
+            blocks = []
+            block_start = time
+            block_count = rand.randint(1, 3)
+            for i in range(block_count):
+                block_stop = time + duration * (i + 1) / block_count
+                text = " ".join(rand.choice(WORDS)
+                                for _ in range(int((block_stop - block_start) * 2.5) + 1))
+                blocks.append({"start": block_start, "stop": block_stop,
+                               "text": text})
+                block_start = block_stop
+
+            section["turns"].append({"start": time, "stop": time + duration,
+                                     "speaker": who, "text_blocks": blocks})
+            time += duration
+        transcript["sections"].append(section)
+    return transcript
+
+
+def synthetic_term_listing(cases, seed=0, term=2015):
+    """ A term listing as returned for per_page=0, where about two thirds of
+    the cases have been argued
+    """
+    rand = random.Random(seed)
+    listing = []
+    for i in range(cases):
+        case_id = term * 100000 + i
+        timeline = [{"event": "Granted", "dates": [rand.randint(0, 10**9)]}]
+        if rand.random() < 0.66:
+            timeline.append({"event": "Argued",
+                             "dates": [rand.randint(10**9, 2 * 10**9)]})
+        listing.append({
+            "ID": case_id,
+            "name": "Petitioner {} v. Respondent".format(i),
+            "href": "https://api.oyez.org/cases/{}/{}".format(term, case_id),
+            "docket_number": "{}-{}".format(term % 100, i),
+            "timeline": timeline,
+            "question": " ".join(rand.choice(WORDS) for _ in range(120)),
+            "citation": {"volume": None, "page": None, "year": None},
+        })
+    return listing
@@ -0,0 +1,201 @@
+import os
+import json
+import logging
+import subprocess
+from collections import OrderedDict
+from .mezzanine import MEZZANINE_DIR, load_manifest, preferred_path
+
+""" Where the probed metadata for the resource library is kept between runs
+"""
+CATALOG_PATH = "cache/resource_catalog.json"
+
+""" The default limit on the number of resource clips (and so ffmpeg reader
+subprocesses) that may be open at once
+"""
+MAX_OPEN_READERS = 16
+
+
+def probe(path):
+    output = subprocess.check_output(["ffprobe",
+                                      "-v", "error",
+                                      "-select_streams", "v:0",
+                                      "-show_entries",
+                                      "stream=codec_name,width,height,r_frame_rate"
+                                      ":format=duration",
+                                      "-of", "json",
+                                      path])
+    info = json.loads(output.decode('utf-8'))
+    stream = info["streams"][0]
+    num, den = stream["r_frame_rate"].split("/")
+    return {
+        "duration": float(info["format"]["duration"]),
+        "fps": float(num) / float(den),
+        "width": int(stream["width"]),
+        "height": int(stream["height"]),
+        "codec": stream["codec_name"],
+    }
+
+
+class Catalog(object):
+    """ On-disk cache of resource clip metadata, keyed by path and
+    invalidated when a file's mtime or size changes.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self.entries = {}
+        self.dirty = False
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as file:
+                    self.entries = json.load(file)
+            except ValueError:
+                logging.warning("Ignoring corrupt catalog {}".format(path))
+
+    def lookup(self, path):
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry["mtime"] == stat.st_mtime and \
+                entry["file_size"] == stat.st_size:
+            return entry
+
+        logging.debug("Probing resource {}".format(path))
+        entry = probe(path)
+        entry["mtime"] = stat.st_mtime
+        entry["file_size"] = stat.st_size
+        self.entries[path] = entry
+        self.dirty = True
+        return entry
+
+    def save(self):
+        if not self.dirty:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding='utf-8') as file:
+            json.dump(self.entries, file, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+
+class ReaderPool(object):
+    """ An LRU pool of open resource clips. At most max_open ffmpeg readers
+    are running at any time; evicted clips have their reader closed and are
+    transparently reopened the next time a frame is requested.
+
+    Given a size, clips are scaled to it as they are decoded. Given a
+    frame_cache.FrameCache, clips are decoded into it once and their frames
+    read from there, without keeping a reader open.
+    """
+
+    def __init__(self, max_open=MAX_OPEN_READERS, size=None,
+                 frame_cache=None):
+        self.max_open = max_open
+        self.size = size
+        self.frame_cache = frame_cache
+        self.clips = {}
+        self.cached = set()
+        self.open_readers = OrderedDict()
+
+    def get(self, path):
+        clip = self.clips.get(path)
+        if clip is None:
+            # Imported here so that planning from the catalog alone never
+            # needs moviepy
+            from moviepy.editor import VideoFileClip
+            target = None if self.size is None else \
+                (self.size[1], self.size[0])
+            clip = VideoFileClip(path, audio=False, target_resolution=target)
+            self.clips[path] = clip
+            if self._use_cached_frames(path, clip):
+                return clip
+            clip.make_frame = lambda t: self._read_frame(path, t)
+        if path in self.cached:
+            return clip
+        self._touch(path)
+        return clip
+
+    def _use_cached_frames(self, path, clip):
+        if self.frame_cache is None:
+            return False
+        frames = self.frame_cache.frames(path, clip.size, clip.reader.nframes)
+        if frames is None:
+            return False
+
+        from .frame_cache import frame_index
+        fps, count = clip.reader.fps, len(frames)
+        clip.reader.close()
+        clip.make_frame = lambda t: frames[frame_index(t, fps, count)]
+        self.cached.add(path)
+        return True
+
+    def _read_frame(self, path, t):
+        self._touch(path)
+        return self.clips[path].reader.get_frame(t)
+
+    def _touch(self, path):
+        if path in self.open_readers:
+            self.open_readers.move_to_end(path)
+            return
+
+        self.open_readers[path] = True
+        while len(self.open_readers) > self.max_open:
+            evicted, _ = self.open_readers.popitem(last=False)
+            self.clips[evicted].reader.close()
+
+    def close(self):
+        for clip in self.clips.values():
+            clip.close()
+        self.clips = {}
+        self.cached.clear()
+        self.open_readers.clear()
+
+
+class Resource(object):
+    """ A resource clip known only by its catalog metadata. The underlying
+    VideoFileClip is opened on first use of 'clip'.
+    """
+
+    def __init__(self, path, info, pool):
+        self.path = path
+        self.duration = info["duration"]
+        self.fps = info["fps"]
+        self.size = (info["width"], info["height"])
+        self.codec = info["codec"]
+        self.pool = pool
+
+    @property
+    def clip(self):
+        return self.pool.get(self.path)
+
+    def subclip(self, t_start, t_end):
+        return self.clip.subclip(t_start, t_end)
+
+    def __repr__(self):
+        return "Resource({!r}, duration={})".format(self.path, self.duration)
+
+
+def load_resources(base, catalog_path=CATALOG_PATH,
+                   max_open=MAX_OPEN_READERS, mezzanine_dir=MEZZANINE_DIR,
+                   size=None, frame_cache=None):
+    catalog = Catalog(catalog_path)
+    pool = ReaderPool(max_open, size, frame_cache)
+    manifest = load_manifest(mezzanine_dir)
+
+    resources_dirs = [d for d in os.listdir(base)
+                      if os.path.isdir(os.path.join(base, d))]
+
+    resources = {}
+    for resource in resources_dirs:
+        # Normalized copies from 'prepare-resources' are used when fresh
+        video_paths = [preferred_path(os.path.join(base, resource, v), manifest)
+                       for v in os.listdir(os.path.join(base, resource))]
+        clips = [Resource(path, catalog.lookup(path), pool)
+                 for path in video_paths]
+        clips.sort(key=lambda v: v.duration, reverse=True)
+        resources[resource] = clips
+
+    catalog.save()
+    return resources
@@ -0,0 +1,47 @@
+import os
+import logging
+
+""" Least recently used eviction for the caches kept as files on disk. A file
+counts as used when its mtime is bumped (with os.utime) on each read, so the
+oldest mtimes go first.
+"""
+
+
+def entries(directory, include=None):
+    """ (mtime, size, path) of every file under directory whose name passes
+    include, or of every file without it
+    """
+    entries = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if include is not None and not include(name):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Evicted by another process while we looked
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict(directory, max_bytes, include=None, keep=None):
+    """ Remove the least recently used files under directory whose names pass
+    include until they fit in max_bytes, other than 'keep'. Returns the bytes
+    left.
+    """
+    found = entries(directory, include)
+    total = sum(size for _, size, _ in found)
+    for _, size, path in sorted(found):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        logging.info("Evicting {}".format(path))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
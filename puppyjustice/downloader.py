@@ -1,35 +1,781 @@
+import re
 import json
+import zlib
+import codecs
 import urllib.request
+import urllib.error
+import urllib.parse
+import http.client
+import threading
 import logging
 import gzip
-from io import BytesIO
-from moviepy.editor import *
+import hashlib
+import os
+import subprocess
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from . import metrics, disk_cache
+
+""" The most requests that will be made to Oyez at once
+"""
+MAX_CONCURRENT_REQUESTS = 4
+
+""" How many cases ahead of the one being rendered to fetch
+"""
+PREFETCH_CASES = 2
+
+REQUEST_TIMEOUT = 60
+
+""" Where responses from Oyez are kept between runs
+"""
+HTTP_CACHE_DIR = "cache/http"
+
+""" Where downloaded audio is kept, named by media ID
+"""
+AUDIO_CACHE_DIR = "cache/audio"
+MAX_AUDIO_CACHE_BYTES = 10 * 1024 * 1024 * 1024
+
+AUDIO_CHUNK_SIZE = 1024 * 1024
+
+""" How much of a JSON response is read, decompressed and parsed at a time
+"""
+JSON_CHUNK_SIZE = 64 * 1024
+
+""" How many times a dropped audio download is resumed from the same href
+before the others are tried again
+"""
+MAX_AUDIO_RESUMES = 5
+
+
+class NotCached(Exception):
+    """ Raised in offline mode for a URL that has never been fetched
+    """
+
+
+class HTTPCache(object):
+    """ Responses kept on disk gzip compressed, alongside the validators
+    (ETag and Last-Modified) needed to revalidate them with a conditional
+    request.
+    """
+
+    def __init__(self, directory=HTTP_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def paths(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, key[:2], key)
+        return base + ".json", base + ".gz"
+
+    def lookup(self, url):
+        """ Returns the stored metadata for url and the path of its
+        compressed body, or None if it has not been cached
+        """
+        meta_path, body_path = self.paths(url)
+        try:
+            with open(meta_path, encoding='utf-8') as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(body_path):
+            return None
+        return meta, body_path
+
+    def begin(self, url, headers):
+        """ Returns a file to write the body of the response to url to as
+        it arrives, and the path to pass to finish() once it has all been
+        written
+        """
+        _, body_path = self.paths(url)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        tmp = "{}.{}.tmp".format(body_path, threading.get_ident())
+        if headers.get('Content-Encoding') != 'gzip':
+            return gzip.open(tmp, "wb"), tmp
+        return open(tmp, "wb"), tmp
+
+    def store(self, url, headers, body):
+        file, tmp = self.begin(url, headers)
+        with file:
+            file.write(body)
+        self.finish(url, headers, tmp)
+
+    def finish(self, url, headers, tmp):
+        meta = {
+            "url": url,
+            "etag": headers.get('ETag'),
+            "last_modified": headers.get('Last-Modified'),
+        }
+
+        meta_path, body_path = self.paths(url)
+        # The body goes first, so metadata never refers to a partial body
+        os.replace(tmp, body_path)
+        tmp = "{}.{}.tmp".format(meta_path, threading.get_ident())
+        with open(tmp, "w", encoding='utf-8') as file:
+            json.dump(meta, file)
+        os.replace(tmp, meta_path)
+
+
+class Fetcher(object):
+    """ Fetches JSON on a small pool of threads. Each thread keeps one
+    keep-alive connection per host, so consecutive requests to api.oyez.org
+    reuse a connection rather than opening a new one every time.
+    """
+
+    def __init__(self, max_workers=MAX_CONCURRENT_REQUESTS, cache=None,
+                 offline=False):
+        self.executor = ThreadPoolExecutor(max_workers)
+        self.local = threading.local()
+        self.cache = cache
+        self.offline = offline
+
+    def connection(self, scheme, host, fresh=False):
+        if not hasattr(self.local, "connections"):
+            self.local.connections = {}
+        key = (scheme, host)
+        if fresh and key in self.local.connections:
+            self.local.connections.pop(key).close()
+        if key not in self.local.connections:
+            if scheme == "https":
+                conn = http.client.HTTPSConnection(host, timeout=REQUEST_TIMEOUT)
+            else:
+                conn = http.client.HTTPConnection(host, timeout=REQUEST_TIMEOUT)
+            self.local.connections[key] = conn
+        return self.local.connections[key]
+
+    def request(self, url, headers=None, redirects=5):
+        """ Returns the response status, headers and (still encoded) body
+        """
+        status, response_headers, response, _ = self.open(url, headers,
+                                                          redirects)
+        return status, response_headers, response.read()
+
+    def open(self, url, headers=None, redirects=5):
+        """ Returns the response status and headers, the response to read
+        the (still encoded) body from and the connection it arrives on. The
+        body must be read to the end before the connection is used again,
+        or the connection closed.
+        """
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+
+        headers = dict(headers or {})
+        headers.setdefault('Accept-encoding', 'gzip')
+
+        # A kept-alive connection may have been closed by the server since
+        # its last use, in which case we reconnect once
+        for attempt in range(2):
+            conn = self.connection(parts.scheme, parts.netloc, fresh=attempt > 0)
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError,
+                    BrokenPipeError, http.client.CannotSendRequest):
+                conn.close()
+                if attempt > 0:
+                    raise
+
+        if response.status in (301, 302, 303, 307, 308) and redirects > 0:
+            response.read()
+            location = urllib.parse.urljoin(url, response.getheader("Location"))
+            return self.open(location, headers, redirects - 1)
+        return response.status, response.headers, response, conn
+
+    def fetch_json(self, url, revalidate=True):
+        """ Fetch and decode the JSON at url. A cached response is used as
+        is when offline or when revalidate is False, and otherwise only
+        downloaded again if the server says it has changed.
+        """
+        return load_json(self.stream_text(url, revalidate))
+
+    def stream_json(self, url, revalidate=True):
+        """ Yields the items of the JSON array at url as each arrives,
+        rather than once the whole response has been read, as for
+        fetch_json. The response must be an array.
+        """
+        return iter_json_array(self.stream_text(url, revalidate))
+
+    def fetch_items(self, url, keep, revalidate=True):
+        """ The items of the JSON array at url for which keep(item) is true
+        """
+        return [item for item in self.stream_json(url, revalidate)
+                if keep(item)]
+
+    def stream_text(self, url, revalidate=True):
+        """ Yields the text of the response from url a piece at a time, as
+        it's downloaded and decompressed (or read from the cache), while
+        storing the response in the cache
+        """
+        cached = self.cache.lookup(url) if self.cache else None
+        if cached is not None and (self.offline or not revalidate):
+            yield from read_cached(cached[1])
+            return
+        if self.offline:
+            raise NotCached(url)
+
+        headers = {}
+        if cached is not None:
+            meta = cached[0]
+            if meta["etag"]:
+                headers['If-None-Match'] = meta["etag"]
+            if meta["last_modified"]:
+                headers['If-Modified-Since'] = meta["last_modified"]
+
+        print("Downloading URL: {}".format(url))
+        status, response_headers, response, conn = self.open(url, headers)
+        if status == 304 and cached is not None:
+            response.read()
+            logging.debug("Not modified: {}".format(url))
+            yield from read_cached(cached[1])
+            return
+        if status >= 400:
+            response.read()
+            raise urllib.error.HTTPError(url, status, "HTTP error",
+                                         response_headers, None)
+
+        body, tmp = None, None
+        if self.cache:
+            body, tmp = self.cache.begin(url, response_headers)
+        # 16 + MAX_WBITS has zlib expect a gzip header
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) \
+            if response_headers.get('Content-Encoding') == 'gzip' else None
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        complete = False
+        try:
+            while True:
+                chunk = response.read(JSON_CHUNK_SIZE)
+                if not chunk:
+                    break
+                metrics.count("bytes_total", len(chunk), direction="download")
+                if body is not None:
+                    body.write(chunk)
+                if decompressor is not None:
+                    chunk = decompressor.decompress(chunk)
+                yield decoder.decode(chunk)
+            yield decoder.decode(b"", final=True)
+            complete = True
+        finally:
+            if body is not None:
+                body.close()
+                if complete:
+                    self.cache.finish(url, response_headers, tmp)
+                else:
+                    os.remove(tmp)
+            if not complete:
+                # Whatever is left of the body is still on the connection
+                conn.close()
+
+    def submit(self, url, revalidate=True, keep=None):
+        """ Fetch the JSON at url in the background. Given 'keep', the
+        response must be an array, and only the items for which keep(item)
+        is true are kept, as they arrive.
+        """
+        if keep is not None:
+            return self.executor.submit(self.fetch_items, url, keep,
+                                        revalidate)
+        return self.executor.submit(self.fetch_json, url, revalidate)
+
+
+def read_cached(path):
+    """ Yields the text of a cached response a piece at a time """
+    with gzip.open(path, "rt", encoding='utf-8') as file:
+        while True:
+            text = file.read(JSON_CHUNK_SIZE)
+            if not text:
+                return
+            yield text
+
+
+WHITESPACE = re.compile(r"\s*")
+NUMBER_START = "-0123456789"
+NUMBER_CONTINUES = ".eE+-"
+
+
+class JSONStream(object):
+    """ Parses JSON whose text arrives a piece at a time. Values that have
+    all arrived are decoded whole by the json module, and only containers
+    still arriving are built up here a value at a time, so the text is never
+    held all at once. With items set, the top level value must be an array,
+    and its items are returned as they complete instead of kept in it.
+    """
+
+    def __init__(self, items=False):
+        self.items = items
+        # json.loads shares one copy of each key between all the objects it
+        # decodes, but only within one call, so the keys of values decoded
+        # separately here are shared explicitly
+        self.keys = {}
+        self.decoder = json.JSONDecoder(object_pairs_hook=self.make_object)
+        self.buffer = ""
+        self.position = 0
+        self.pending = []
+        self.waiting = 0
+        # A value split over many pieces is parsed again only once the text
+        # waiting has doubled, which keeps a large value linear in its size
+        self.wait = 0
+        # The container, state and current key of each container that is
+        # still arriving, outermost first
+        self.stack = []
+        self.done = False
+        self.value = None
+        self.completed = []
+
+    def feed(self, text):
+        """ Add the next piece of text, returning any items completed """
+        self.pending.append(text)
+        self.waiting += len(text)
+        if len(self.buffer) - self.position + self.waiting >= self.wait:
+            self.parse(final=False)
+        return self.take()
+
+    def close(self):
+        """ Finish parsing once all of the text has been fed, returning any
+        items completed
+        """
+        self.parse(final=True)
+        if not self.done:
+            raise ValueError("Truncated JSON")
+        return self.take()
+
+    def make_object(self, pairs):
+        keys = self.keys
+        return {keys.setdefault(key, key): value for key, value in pairs}
+
+    def take(self):
+        completed, self.completed = self.completed, []
+        return completed
+
+    def parse(self, final):
+        self.buffer = self.buffer[self.position:] + "".join(self.pending)
+        self.position = 0
+        self.pending = []
+        self.waiting = 0
+
+        buffer = self.buffer
+        while True:
+            self.position = WHITESPACE.match(buffer, self.position).end()
+            if self.position == len(buffer):
+                return
+            if self.done:
+                raise ValueError("Extra data after JSON")
+
+            char = buffer[self.position]
+            frame = self.stack[-1] if self.stack else None
+            state = frame[1] if frame else "value"
+            if frame is not None and state in ("first", "separator") and \
+                    char == ("]" if isinstance(frame[0], list) else "}"):
+                self.position += 1
+                self.complete(self.stack.pop()[0])
+            elif state == "separator":
+                self.expect(",")
+                frame[1] = "value" if isinstance(frame[0], list) else "key"
+            elif state == "colon":
+                self.expect(":")
+                frame[1] = "value"
+            elif state == "key" or (state == "first" and
+                                    isinstance(frame[0], dict)):
+                if char != '"':
+                    self.expect('"')
+                key = self.decode(final)
+                if key is None:
+                    return
+                frame[1] = "colon"
+                frame[2] = self.keys.setdefault(key, key)
+            elif self.items and frame is None:
+                # The top level array is always taken apart, for its items
+                self.expect("[")
+                self.stack.append([[], "first", None])
+            elif char in "[{":
+                try:
+                    value, end = self.decoder.raw_decode(buffer, self.position)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    # Not all here yet, so it's parsed as it arrives
+                    self.position += 1
+                    self.stack.append([[] if char == "[" else {}, "first",
+                                       None])
+                    continue
+                self.position = end
+                self.complete(value)
+            else:
+                value = self.decode(final)
+                if value is None and self.wait:
+                    return
+                self.complete(value)
+
+    def expect(self, char):
+        if self.buffer[self.position] != char:
+            raise ValueError("Expected {!r} at {!r}".format(
+                char, self.buffer[self.position:self.position + 20]))
+        self.position += 1
+
+    def decode(self, final):
+        """ Decode the string, number or literal at the current position.
+        Returns None and sets wait if it may not have all arrived.
+        """
+        buffer = self.buffer
+        try:
+            value, end = self.decoder.raw_decode(buffer, self.position)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            self.wait = 2 * (len(buffer) - self.position)
+            return None
+        # A number at the end of the text may be cut short
+        if not final and buffer[self.position] in NUMBER_START and \
+                (end == len(buffer) or buffer[end] in NUMBER_CONTINUES):
+            self.wait = 2 * (len(buffer) - self.position)
+            return None
+        self.wait = 0
+        self.position = end
+        return value
+
+    def complete(self, value):
+        if not self.stack:
+            self.done = True
+            self.value = value
+            return
+        frame = self.stack[-1]
+        container = frame[0]
+        if isinstance(container, dict):
+            container[frame[2]] = value
+        elif self.items and len(self.stack) == 1:
+            self.completed.append(value)
+        else:
+            container.append(value)
+        frame[1] = "separator"
+
+
+def iter_json_array(chunks):
+    """ Yields the items of the JSON array whose text arrives in 'chunks',
+    each as soon as all of its text has arrived
+    """
+    stream = JSONStream(items=True)
+    for chunk in chunks:
+        yield from stream.feed(chunk)
+    yield from stream.close()
+
+
+def load_json(chunks):
+    """ Decode the JSON whose text arrives in 'chunks', parsing it as it
+    arrives rather than once it is all here
+    """
+    stream = JSONStream()
+    for chunk in chunks:
+        stream.feed(chunk)
+    stream.close()
+    return stream.value
+
+
+_fetcher = None
+
+
+def default_fetcher():
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher(cache=HTTPCache())
+    return _fetcher
+
+
+def set_offline(offline=True):
+    """ Serve every request from the HTTP cache, without touching the
+    network
+    """
+    default_fetcher().offline = offline
 
 
 def download_json(url):
-    print("Downloading URL: {}".format(url))
+    return default_fetcher().fetch_json(url)
+
+
+def stream_json(url):
+    return default_fetcher().stream_json(url)
+
+
+def download_all_json(urls, fetcher=None, keep=None):
+    """ Fetch several URLs concurrently, returning the results in order.
+    Given 'keep', each response must be an array, and only its items for
+    which keep(item) is true are kept, as they arrive.
+    """
+    fetcher = fetcher or default_fetcher()
+    return [future.result()
+            for future in [fetcher.submit(u, keep=keep) for u in urls]]
+
+
+class CaseFetch(object):
+    """ A case's JSON and, once that arrives, the media JSON of each of its
+    oral argument parts, all fetched in the background
+    """
+
+    def __init__(self, fetcher, short_case, revalidate=True):
+        self.short_case = short_case
+        self.case = fetcher.submit(short_case["href"], revalidate)
+        self.media = Future()
+
+        def fetch_media(future):
+            try:
+                parts = future.result()["oral_argument_audio"] or []
+                self.media.set_result([fetcher.submit(part["href"], revalidate)
+                                       for part in parts])
+            except Exception as e:
+                self.media.set_exception(e)
+        self.case.add_done_callback(fetch_media)
+
+    def media_json(self):
+        for future in self.media.result():
+            yield future.result()
+
+
+class SyncState(object):
+    """ The sync watermark: a digest of each case's entry in the term
+    listings as of the last time its JSON was fetched. A case whose entry
+    has not changed since is served from the cache without a request.
+    """
+
+    def __init__(self, path=os.path.join(HTTP_CACHE_DIR, "sync.json")):
+        self.path = path
+        self.cases = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as file:
+                    self.cases = json.load(file)
+            except ValueError:
+                logging.warning("Ignoring corrupt sync state {}".format(path))
+
+    @staticmethod
+    def digest(short_case):
+        text = json.dumps(short_case, sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def changed(self, short_case):
+        with self.lock:
+            seen = self.cases.get(short_case["href"])
+        return seen != self.digest(short_case)
+
+    def mark(self, short_case):
+        with self.lock:
+            self.cases[short_case["href"]] = self.digest(short_case)
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding='utf-8') as file:
+                json.dump(self.cases, file, sort_keys=True)
+            os.replace(self.path + ".tmp", self.path)
+
 
+def prefetch_cases(short_cases, fetcher=None, lookahead=PREFETCH_CASES,
+                   sync=None):
+    """ Yields a CaseFetch for each case in turn, while the next 'lookahead'
+    cases are already being fetched. With a SyncState, cases that have not
+    changed since they were last fetched are read from the cache.
+    """
+    fetcher = fetcher or default_fetcher()
+    short_cases = iter(short_cases)
+    pending = deque()
+
+    def fill():
+        while len(pending) < lookahead:
+            short_case = next(short_cases, None)
+            if short_case is None:
+                return
+            revalidate = sync is None or sync.changed(short_case)
+            pending.append(CaseFetch(fetcher, short_case, revalidate))
+
+    fill()
+    while pending:
+        fetch = pending.popleft()
+        fill()
+        yield fetch
+
+
+def open_media(url, offset=0):
     request = urllib.request.Request(url)
-    request.add_header('Accept-encoding', 'gzip')
-    response = urllib.request.urlopen(request)
-    if response.info().get('Content-Encoding') == 'gzip':
-      buf = BytesIO(response.read())
-      f = gzip.GzipFile(fileobj=buf)
-      data = f.read()
-    else:
-      data = response.read()
-    text = data.decode('utf-8')
-    return json.loads(text)
+    if offset:
+        request.add_header('Range', 'bytes={}-'.format(offset))
+    try:
+        return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT)
+    except urllib.error.HTTPError as e:
+        # Asking for the bytes after the end of the file is refused, but
+        # the refusal says how big the file is, so is returned like a
+        # response
+        if offset and e.code == 416:
+            return e
+        raise
+
+
+def race(urls, offset=0):
+    """ Request every url at once and return the (url, response) of the
+    first to answer. The others are closed as they come in.
+    """
+    executor = ThreadPoolExecutor(len(urls))
+    futures = {executor.submit(open_media, url, offset): url for url in urls}
+    executor.shutdown(wait=False)
+
+    winner = None
+    for future in as_completed(futures):
+        try:
+            response = future.result()
+        except Exception as e:
+            logging.warning("Failed to open {}: {}".format(futures[future], e))
+            continue
+        winner = futures[future], response
+        break
+
+    def close(future):
+        if not future.exception() and future.result() is not winner[1]:
+            future.result().close()
+    if winner is not None:
+        for future in futures:
+            future.add_done_callback(close)
+    return winner
+
+
+def expected_size(response, offset):
+    """ The full size of the file being downloaded, if the server said """
+    content_range = response.headers.get('Content-Range')
+    if response.status in (206, 416) and content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        if total != "*":
+            return int(total)
+    length = response.headers.get('Content-Length')
+    if length is None or response.status == 416:
+        return None
+    return int(length) + (offset if response.status == 206 else 0)
+
+
+def stream_to(response, part_path, offset):
+    """ Write the response to part_path, appending if the server honoured
+    the range request. Returns the size of part_path afterwards.
+    """
+    if response.status != 206:
+        offset = 0
+    with open(part_path, "ab" if offset else "wb") as file:
+        try:
+            while True:
+                chunk = response.read(AUDIO_CHUNK_SIZE)
+                if not chunk:
+                    break
+                file.write(chunk)
+                metrics.count("bytes_total", len(chunk), direction="download")
+        finally:
+            response.close()
+    return os.path.getsize(part_path)
+
+
+def audio_duration(path):
+    output = subprocess.check_output(["ffprobe", "-v", "error",
+                                      "-show_entries", "format=duration",
+                                      "-of", "default=noprint_wrappers=1:nokey=1",
+                                      path])
+    return float(output.decode('utf-8').strip())
+
+
+def is_complete(path, size):
+    """ The integrity check for a finished download: the size must match
+    what the server reported, and ffprobe must be able to read a duration
+    """
+    if size is not None and os.path.getsize(path) != size:
+        return False
+    try:
+        return audio_duration(path) > 0
+    except (subprocess.CalledProcessError, ValueError):
+        return False
+
+
+def audio_cache_path(media_json, directory=AUDIO_CACHE_DIR):
+    hrefs = [media["href"] for media in media_json["media_file"] or []]
+    ext = os.path.splitext(urllib.parse.urlsplit(hrefs[0]).path)[1] \
+        if hrefs else ""
+    return os.path.join(directory, "{}{}".format(media_json["id"],
+                                                 ext or ".mp3"))
+
+
+def fetch_audio(media_json, directory=AUDIO_CACHE_DIR,
+                max_bytes=MAX_AUDIO_CACHE_BYTES):
+    """ Returns the path to the audio for media_json, downloading it into the
+    audio cache if it is not already there. Every href is tried at once and
+    the first to answer is used. A dropped download is resumed with a range
+    request, including one left behind by an earlier run. The least recently
+    used audio is evicted once the cache is over max_bytes.
+    """
+    path = audio_cache_path(media_json, directory)
+    if os.path.exists(path):
+        # Using the audio counts as a use for eviction purposes
+        os.utime(path)
+        return path
+    if default_fetcher().offline:
+        raise NotCached(path)
+
+    os.makedirs(directory, exist_ok=True)
+    part_path = path + ".part"
+    candidates = [media["href"] for media in media_json["media_file"] or []]
+    while candidates:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        winner = race(candidates, offset)
+        if winner is None:
+            break
+        url, response = winner
+
+        size = expected_size(response, offset)
+        if response.status == 416:
+            # Nothing after the end of what we have, so the download
+            # finished but wasn't moved into place
+            response.close()
+            logging.info("Audio from {} was already downloaded".format(url))
+        else:
+            logging.info("Downloading audio from: {}".format(url))
+            download_from(url, response, part_path, offset, size)
+
+        if is_complete(part_path, size):
+            os.replace(part_path, path)
+            disk_cache.evict(directory, max_bytes, keep=path,
+                             include=lambda name: not name.endswith(".part"))
+            return path
+
+        logging.warning("Audio from {} failed its integrity check".format(url))
+        os.remove(part_path)
+        if response.status != 416:
+            candidates.remove(url)
+    return None
+
+
+def download_from(url, response, part_path, offset, size):
+    """ Write the response into part_path from offset, resuming from url
+    when the download drops before 'size' bytes (if known)
+    """
+    for attempt in range(MAX_AUDIO_RESUMES + 1):
+        if response.status == 416:
+            # It all arrived after all
+            response.close()
+            return
+        try:
+            offset = stream_to(response, part_path, offset)
+            if size is None or offset >= size:
+                return
+        except (OSError, http.client.HTTPException) as e:
+            offset = os.path.getsize(part_path)
+            logging.warning("Download of {} interrupted at {} bytes: {}".format(
+                url, offset, e))
+        if attempt == MAX_AUDIO_RESUMES:
+            return
+        try:
+            response = open_media(url, offset)
+        except (OSError, http.client.HTTPException) as e:
+            logging.warning("Failed to resume {}: {}".format(url, e))
+            return
 
 
 def download_audio(media_json):
-   for media in media_json["media_file"]:
-     try:
-       url = media["href"]
-       logging.info("Downloading audio from: {}".format(url))
-
-       audio_path = urllib.request.urlretrieve(url)[0]
-       audio = VideoFileClip(audio_path)
-       return audio
-     except:
-       continue
+    """ The path to the audio for media_json, or None if it can't be
+    downloaded
+    """
+    try:
+        return fetch_audio(media_json)
+    except Exception as e:
+        logging.warning("Audio download failed: {}".format(e))
+        return None
@@ -0,0 +1,101 @@
+import os
+import json
+import fcntl
+import logging
+import hashlib
+import subprocess
+import numpy as np
+from . import overlays, metrics, disk_cache
+
+""" Resource clips decoded once to raw RGB frames on disk. The frames are
+read through a read-only memory map, so a frame is an array slice rather than
+a seek and decode, and the render worker processes all share the one copy in
+the page cache. Whole clips are evicted, least recently used first, once the
+cache is over its byte budget.
+"""
+
+FRAME_CACHE_DIR = "cache/frames"
+MAX_FRAME_CACHE_BYTES = 8 * 1024 * 1024 * 1024
+
+
+def frame_index(t, fps, count):
+    """ The index of the frame shown at time t, as chosen by moviepy's
+    ffmpeg reader, clamped to the last frame
+    """
+    return min(int(fps * t + 0.00001), count - 1)
+
+
+class FrameCache(object):
+    """ Decoded resource clips in 'directory', in at most max_bytes """
+
+    def __init__(self, directory=FRAME_CACHE_DIR,
+                 max_bytes=MAX_FRAME_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, source, size):
+        key = json.dumps({"source": overlays.file_key(source),
+                          "size": list(size)}, sort_keys=True)
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + ".rgb")
+
+    def frames(self, source, size, nframes):
+        """ The frames of 'source' scaled to size, as a read-only array of
+        shape (frames, height, width, 3). 'nframes' is an estimate of the
+        frame count, used to skip clips that could never fit in the cache,
+        for which None is returned.
+        """
+        width, height = size
+        frame_bytes = width * height * 3
+        if nframes * frame_bytes > self.max_bytes:
+            logging.debug("{} is too large to cache decoded".format(source))
+            return None
+
+        path = self.path(source, size)
+        if os.path.exists(path):
+            os.utime(path)
+            metrics.count("frame_cache_total", result="hit")
+        else:
+            metrics.count("frame_cache_total", result="miss")
+            self.decode(source, size, path)
+
+        count = os.path.getsize(path) // frame_bytes
+        if count == 0:
+            return None
+        return np.memmap(path, dtype=np.uint8, mode="r",
+                         shape=(count, height, width, 3))
+
+    def decode(self, source, size, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Workers wanting the same clip wait for the first to decode it
+        # rather than decoding it again
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(path):
+                return
+
+            logging.debug("Decoding {} to {}".format(source, path))
+            tmp_path = path + ".tmp"
+            # The same command moviepy reads frames with, so the cached
+            # frames are the ones it would have decoded
+            subprocess.check_call(["ffmpeg", "-y", "-i", source,
+                                   "-loglevel", "error",
+                                   "-f", "image2pipe",
+                                   "-vf", "scale={}:{}".format(*size),
+                                   "-sws_flags", "bicubic",
+                                   "-pix_fmt", "rgb24",
+                                   "-vcodec", "rawvideo", tmp_path])
+            os.replace(tmp_path, path)
+        os.remove(path + ".lock")
+        self.evict(keep=path)
+
+    def evict(self, keep=None):
+        """ Remove the least recently used clips until the cache fits in
+        max_bytes. Clips still mapped by a reader stay readable until it's
+        done with them.
+        """
+        total = disk_cache.evict(self.directory, self.max_bytes,
+                                 include=lambda name: name.endswith(".rgb"),
+                                 keep=keep)
+        metrics.gauge("frame_cache_bytes", total)
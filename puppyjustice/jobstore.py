@@ -0,0 +1,256 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from .pipeline import Job
+
+""" The state of every case and every video (case part) made from it, kept
+in SQLite so that a crash part way through a case loses nothing, and so that
+several runner processes on one host can share a queue. A job moves through
+'queued', then one state per finished stage ('fetched', 'planned',
+'rendered', 'uploaded'), or to 'skipped' or 'failed'. A case is handled once
+every one of its parts is uploaded or skipped.
+"""
+
+JOB_STORE_PATH = "jobs.sqlite"
+
+""" A claimed job whose worker hasn't finished a stage in this long is
+assumed to have died with it, and may be claimed again
+"""
+CLAIM_TIMEOUT = 6 * 60 * 60
+
+""" How many times a job is tried before it's left as failed
+"""
+MAX_ATTEMPTS = 3
+
+QUEUED = "queued"
+SKIPPED = "skipped"
+FAILED = "failed"
+UPLOADED = "uploaded"
+
+# The state a job is in once each stage has finished
+STAGE_STATES = {
+    "fetch": "fetched",
+    "plan": "planned",
+    "render": "rendered",
+    "upload": UPLOADED,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cases (
+    id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    -- Set once the last part of the case has been queued
+    parts_known INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    case_id INTEGER NOT NULL REFERENCES cases(id),
+    title TEXT NOT NULL,
+    sub_title TEXT NOT NULL,
+    description TEXT NOT NULL,
+    case_json TEXT NOT NULL,
+    media_json TEXT NOT NULL,
+    finished INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    stage TEXT,
+    subtitles TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    claimed REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, created);
+CREATE INDEX IF NOT EXISTS jobs_by_case ON jobs (case_id);
+CREATE TABLE IF NOT EXISTS stage_times (
+    job_id INTEGER NOT NULL REFERENCES jobs(id),
+    stage TEXT NOT NULL,
+    attempt INTEGER NOT NULL,
+    seconds REAL,
+    finished REAL NOT NULL
+);
+"""
+
+
+class JobStore(object):
+    """ Case and job state in the SQLite database at 'path'. One store may
+    be used from several threads, and several processes may open the same
+    database.
+    """
+
+    def __init__(self, path=JOB_STORE_PATH, claim_timeout=CLAIM_TIMEOUT,
+                 max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # Autocommit, with transactions begun explicitly where a read and
+        # a write must happen together
+        self.connection = sqlite3.connect(path, timeout=60,
+                                          isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def is_empty(self):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT count(*) FROM cases").fetchone()
+        return row[0] == 0
+
+    def handled_cases(self):
+        """ The IDs of the cases that need no more work """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM cases WHERE state IN ('handled', 'skipped')")
+            return {row["id"] for row in rows}
+
+    def queued_cases(self):
+        """ The IDs of the cases with every part in the store """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM cases WHERE parts_known = 1")
+            return {row["id"] for row in rows}
+
+    def mark_case(self, case_id, state="handled"):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO cases (id, state, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET state = excluded.state, "
+                "updated = excluded.updated",
+                (case_id, state, time.time()))
+
+    def import_handled(self, path):
+        """ Mark every case listed in a handled_cases.txt as handled.
+        Returns how many there were.
+        """
+        with open(path, encoding='utf-8') as file:
+            ids = [int(line) for line in file if line.strip()]
+        for id in ids:
+            self.mark_case(id)
+        return len(ids)
+
+    def add(self, job):
+        """ Queue a pipeline.Job, unless it is already in the store """
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "INSERT INTO cases (id, state, updated) VALUES (?, 'pending', ?) "
+                "ON CONFLICT (id) DO NOTHING", (job.case["ID"], now))
+            self.connection.execute(
+                "INSERT INTO jobs (id, case_id, title, sub_title, description, "
+                "case_json, media_json, finished, state, created, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO NOTHING",
+                (job.id, job.case["ID"], job.title, job.sub_title,
+                 job.description, json.dumps(job.case),
+                 json.dumps(job.media_json), int(job.finished), QUEUED, now,
+                 now))
+            if job.finished:
+                self.connection.execute(
+                    "UPDATE cases SET parts_known = 1 WHERE id = ?",
+                    (job.case["ID"],))
+
+    def is_done(self, job):
+        """ Whether a job has already been uploaded or skipped """
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT state FROM jobs WHERE id = ?", (job.id,)).fetchone()
+        return row is not None and row["state"] in (UPLOADED, SKIPPED)
+
+    def claim(self, worker, job=None):
+        """ Atomically take the oldest job that needs work and isn't being
+        worked on, for 'worker'. Returns it as a pipeline.Job with 'stage' set
+        to the last stage it finished, or None if there's nothing to do.
+        Given a job already in the store, only that job is taken, and it is
+        returned as it is.
+        """
+        now = time.time()
+        query = "SELECT * FROM jobs WHERE state NOT IN (?, ?) " \
+            "AND (state != ? OR attempts < ?) " \
+            "AND (worker IS NULL OR claimed < ?) "
+        parameters = (UPLOADED, SKIPPED, FAILED, self.max_attempts,
+                      now - self.claim_timeout)
+        if job is not None:
+            query += "AND id = ? "
+            parameters += (job.id,)
+        with self.lock, self.connection:
+            # Taking the write lock up front means no other process can
+            # claim the same job between the select and the update
+            self.connection.execute("BEGIN IMMEDIATE")
+            row = self.connection.execute(
+                query + "ORDER BY created, id LIMIT 1", parameters).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE jobs SET worker = ?, claimed = ?, attempts = attempts + 1, "
+                "error = NULL, updated = ? WHERE id = ?",
+                (worker, now, now, row["id"]))
+
+        logging.info("{} claimed job {} (attempt {}, last finished {})".format(
+            worker, row["id"], row["attempts"] + 1, row["stage"]))
+        if job is not None:
+            return job
+        job = Job(json.loads(row["case_json"]), row["title"], row["sub_title"],
+                  row["description"], json.loads(row["media_json"]),
+                  bool(row["finished"]))
+        job.stage = row["stage"]
+        job.subtitles = row["subtitles"]
+        return job
+
+    def finish_stage(self, job, stage, seconds=None):
+        """ Record that a job has finished a stage, taking 'seconds' """
+        now = time.time()
+        state = SKIPPED if job.skipped else STAGE_STATES[stage]
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute(
+                "UPDATE jobs SET state = ?, stage = ?, subtitles = ?, "
+                "claimed = ?, updated = ? WHERE id = ?",
+                (state, stage, job.subtitles, now, now, job.id))
+            self.connection.execute(
+                "INSERT INTO stage_times (job_id, stage, attempt, seconds, finished) "
+                "SELECT id, ?, attempts, ?, ? FROM jobs WHERE id = ?",
+                (stage, seconds, now, job.id))
+            if state in (UPLOADED, SKIPPED):
+                self._complete_case(job.case["ID"], now)
+
+    def _complete_case(self, case_id, now):
+        # Handled once the last part is known and every part is done
+        self.connection.execute(
+            "UPDATE cases SET state = 'handled', updated = ? "
+            "WHERE id = ? AND parts_known = 1 AND NOT EXISTS ("
+            "SELECT 1 FROM jobs WHERE case_id = ? AND state NOT IN (?, ?))",
+            (now, case_id, case_id, UPLOADED, SKIPPED))
+
+    def fail(self, job, stage, error):
+        """ Record that a job failed in a stage, and give up its claim """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET state = ?, error = ?, worker = NULL, "
+                "updated = ? WHERE id = ?",
+                (FAILED, "{}: {}".format(stage, error), time.time(), job.id))
+
+    def release(self, job):
+        """ Give up the claim on a job, leaving its state as it is """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET worker = NULL, updated = ? WHERE id = ?",
+                (time.time(), job.id))
+
+    def counts(self):
+        """ The number of jobs in each state """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT state, count(*) AS jobs FROM jobs GROUP BY state")
+            return {row["state"]: row["jobs"] for row in rows}
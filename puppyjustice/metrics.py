@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import atexit
+import logging
+import resource
+import threading
+import multiprocessing
+from contextlib import contextmanager
+
+""" Timings and counters for each stage of making a video. Every span and
+measurement is appended to a JSON-lines file as it happens, and running
+totals are kept in a Prometheus text-format file (for node_exporter's
+textfile collector, say). Counters may go up for every chunk of a download,
+so their totals are only written out every FLUSH_INTERVAL seconds, at the end
+of each span and at exit. Worker processes keep their own counters and never
+write them out, as they would overwrite the main process's totals with
+their own.
+"""
+
+METRICS_PATH = "metrics.jsonl"
+PROMETHEUS_PATH = "metrics.prom"
+PREFIX = "puppyjustice_"
+
+# The longest counter totals go without being written out
+FLUSH_INTERVAL = 10
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, str(value).replace('"', '\\"'))
+                          for key, value in sorted(labels.items())) + "}"
+
+
+class Metrics(object):
+    """ Counters (which only go up) and gauges (the last value set), each
+    named and optionally labelled, plus timing spans. Each span adds to the
+    stage_seconds_total and stage_total counters for its name.
+    """
+
+    def __init__(self, path=METRICS_PATH, prometheus_path=PROMETHEUS_PATH):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.labels = {}
+        self.gauges = {}
+        self.flushed = time.monotonic()
+
+    def write(self, record):
+        record["time"] = time.time()
+        line = json.dumps(record, sort_keys=True)
+        with self.lock:
+            if self.path:
+                with open(self.path, "a", encoding='utf-8') as file:
+                    file.write(line + "\n")
+
+    def count(self, name, value=1, **labels):
+        key = (name, label_text(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+            self.labels[key] = labels
+            due = time.monotonic() - self.flushed >= FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """ Append the total of every counter to the JSON-lines file and
+        rewrite the Prometheus file, unless this is a worker process
+        """
+        if multiprocessing.parent_process() is not None:
+            return
+        with self.lock:
+            self.flushed = time.monotonic()
+            totals = [(name, value, self.labels.get((name, text), {}))
+                      for (name, text), value in sorted(self.counters.items())]
+        for name, value, labels in totals:
+            self.write({"type": "counter", "name": name, "value": value,
+                        "labels": labels})
+        self.write_prometheus()
+
+    def gauge(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, label_text(labels))] = value
+        self.write({"type": "gauge", "name": name, "value": value,
+                    "labels": labels})
+        self.write_prometheus()
+
+    @contextmanager
+    def span(self, name, **labels):
+        """ Time the body of a with statement. Yields a dictionary whose
+        contents are saved with the span, and which holds the span's
+        'seconds' afterwards.
+        """
+        fields = {}
+        start = time.perf_counter()
+        try:
+            yield fields
+        finally:
+            seconds = time.perf_counter() - start
+            fields["seconds"] = seconds
+            logging.info("{} took {:.2f}s".format(name, seconds))
+            self.write({"type": "span", "name": name, "labels": labels,
+                        "fields": fields})
+            with self.lock:
+                for suffix, value in (("_seconds_total", seconds),
+                                      ("_total", 1)):
+                    key = ("stage" + suffix, label_text(dict(stage=name)))
+                    self.counters[key] = self.counters.get(key, 0) + value
+                    self.labels[key] = dict(stage=name)
+            self.flush()
+
+    def write_prometheus(self):
+        if not self.prometheus_path or \
+                multiprocessing.parent_process() is not None:
+            return
+        with self.lock:
+            lines = []
+            for kind, values in (("counter", self.counters),
+                                 ("gauge", self.gauges)):
+                names = sorted(set(name for name, _ in values))
+                for name in names:
+                    lines.append("# TYPE {}{} {}".format(PREFIX, name, kind))
+                    for (other, labels), value in sorted(values.items()):
+                        if other == name:
+                            lines.append("{}{}{} {}".format(PREFIX, name,
+                                                            labels, value))
+            tmp = self.prometheus_path + ".tmp"
+            with open(tmp, "w", encoding='utf-8') as file:
+                file.write("\n".join(lines) + "\n")
+            os.replace(tmp, self.prometheus_path)
+
+
+def record_peak_memory(metrics, **labels):
+    """ Peak resident memory so far, of this process and of the ffmpeg
+    processes it has waited for
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    metrics.gauge("peak_rss_bytes", own, process="self", **labels)
+    metrics.gauge("peak_rss_bytes", children, process="children", **labels)
+
+
+_metrics = None
+
+
+def default_metrics():
+    global _metrics
+    if _metrics is None:
+        _metrics = Metrics()
+        atexit.register(_metrics.flush)
+    return _metrics
+
+
+def span(name, **labels):
+    return default_metrics().span(name, **labels)
+
+
+def count(name, value=1, **labels):
+    default_metrics().count(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    default_metrics().gauge(name, value, **labels)
+
+
+class FrameProfiler(object):
+    """ Attributes the time moviepy spends producing each frame to decoding
+    resource clips, compositing, and drawing the title and speaker cards,
+    with whatever is left (concatenation, effects) as 'other'. Time is
+    exclusive: a composite's time doesn't include that of the clips
+    composited into it.
+
+    It works by wrapping moviepy methods, so is only enabled on request.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.totals = {}
+        self.frames = 0
+        self.frame_seconds = 0.0
+        self.patched = []
+
+    def timed(self, category, fn):
+        profiler = self
+
+        def wrapper(*args, **kwargs):
+            stack = getattr(profiler.local, "stack", None)
+            if stack is None:
+                stack = profiler.local.stack = []
+            # Each entry is the time spent so far in nested calls
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                nested = stack.pop()
+                name = category(args[0]) if callable(category) else category
+                profiler.totals[name] = profiler.totals.get(name, 0.0) + \
+                    elapsed - nested
+                if stack:
+                    stack[-1] += elapsed
+        return wrapper
+
+    def patch(self, owner, name, category):
+        original = getattr(owner, name)
+        self.patched.append((owner, name, original))
+        setattr(owner, name, self.timed(category, original))
+
+    def enable(self):
+        from moviepy.video.VideoClip import VideoClip, ImageClip
+        from moviepy.video.io.ffmpeg_reader import FFMPEG_VideoReader
+
+        def blit_category(clip):
+            return "overlay" if isinstance(clip, ImageClip) else "composite"
+
+        self.patch(FFMPEG_VideoReader, "get_frame", "decode")
+        self.patch(VideoClip, "blit_on", blit_category)
+
+    def disable(self):
+        for owner, name, original in reversed(self.patched):
+            setattr(owner, name, original)
+        self.patched = []
+
+    def attach(self, clip):
+        """ Count every frame of clip, the clip being written out
+        """
+        make_frame = clip.make_frame
+
+        def profiled_frame(t):
+            start = time.perf_counter()
+            try:
+                return make_frame(t)
+            finally:
+                self.frames += 1
+                self.frame_seconds += time.perf_counter() - start
+        clip.make_frame = profiled_frame
+        return clip
+
+    def report(self, metrics=None, **labels):
+        """ Log, and optionally record, where the frame time went """
+        parts = dict(self.totals)
+        parts["other"] = max(0.0, self.frame_seconds - sum(parts.values()))
+        for part, seconds in sorted(parts.items()):
+            share = seconds / self.frame_seconds if self.frame_seconds else 0
+            logging.info("  {:10} {:8.2f}s {:5.1%} {:7.2f}ms/frame".format(
+                part, seconds, share, 1000 * seconds / max(1, self.frames)))
+            if metrics is not None:
+                metrics.count("frame_seconds_total", seconds, part=part,
+                              **labels)
+        if metrics is not None:
+            metrics.count("frames_total", self.frames, **labels)
+        return parts
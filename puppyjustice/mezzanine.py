@@ -0,0 +1,115 @@
+import os
+import json
+import logging
+import subprocess
+
+""" The resource clips come in whatever codec settings they were recorded
+with. 'prepare-resources' transcodes them once into a normalized mezzanine
+copy (fixed size, short GOP, no audio) so that seeking to an arbitrary in
+point only decodes a few frames. The frame rate is not fixed: each clip
+keeps its own, as converting the 25 fps clips to the 30 fps output here
+would only duplicate frames that the renderer duplicates anyway, and would
+blur which source frame a planned in point lands on.
+
+Clips that aren't 16:9 are stretched to MEZZANINE_SIZE rather than padded,
+just as both backends stretch a clip without a mezzanine copy to the video
+size, so that preparing the resources never changes how a video looks.
+"""
+
+MEZZANINE_DIR = "cache/mezzanine"
+MEZZANINE_SIZE = (1280, 720)
+
+# Frames between keyframes. A GOP of 1 makes every frame a keyframe, which
+# saves decoding up to GOP - 1 frames on each seek (about 20ms at 720p) but
+# makes every frame after it slower to decode and the files about six times
+# the size, so that a render, which reads seconds of each clip it seeks to,
+# is slower overall.
+MEZZANINE_GOP = 15
+
+
+def manifest_path(dest):
+    return os.path.join(dest, "manifest.json")
+
+
+def load_manifest(dest=MEZZANINE_DIR):
+    path = manifest_path(dest)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+
+def save_manifest(manifest, dest=MEZZANINE_DIR):
+    path = manifest_path(dest)
+    with open(path + ".tmp", "w", encoding='utf-8') as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def settings(gop=MEZZANINE_GOP):
+    return {"size": list(MEZZANINE_SIZE), "fps": "source", "gop": gop}
+
+
+def is_fresh(source, entry, gop=None):
+    if entry is None or not os.path.exists(entry["path"]):
+        return False
+    if gop is not None and entry["settings"] != settings(gop):
+        return False
+    stat = os.stat(source)
+    return entry["mtime"] == stat.st_mtime and \
+        entry["file_size"] == stat.st_size
+
+
+def preferred_path(source, manifest):
+    """ The mezzanine copy of source when there is an up to date one,
+    otherwise source itself
+    """
+    entry = manifest.get(source)
+    if is_fresh(source, entry):
+        return entry["path"]
+    return source
+
+
+def transcode(source, destination, gop=MEZZANINE_GOP):
+    width, height = MEZZANINE_SIZE
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    subprocess.check_call(["ffmpeg", "-y", "-v", "error",
+                           "-i", source,
+                           "-vf", "scale={}:{},setsar=1".format(width, height),
+                           "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                           "-g", str(gop), "-keyint_min", str(gop),
+                           "-sc_threshold", "0",
+                           "-an",
+                           destination + ".tmp.mp4"])
+    os.replace(destination + ".tmp.mp4", destination)
+
+
+def resource_files(base):
+    for root, _, files in os.walk(base):
+        for name in sorted(files):
+            if name.endswith(".mp4"):
+                yield os.path.join(root, name)
+
+
+def prepare_resources(base, dest=MEZZANINE_DIR, gop=MEZZANINE_GOP):
+    os.makedirs(dest, exist_ok=True)
+    manifest = load_manifest(dest)
+
+    for source in resource_files(base):
+        if is_fresh(source, manifest.get(source), gop):
+            continue
+
+        destination = os.path.join(dest, os.path.relpath(source, base))
+        logging.info("Transcoding {} to {}".format(source, destination))
+        transcode(source, destination, gop)
+
+        stat = os.stat(source)
+        manifest[source] = {
+            "path": destination,
+            "mtime": stat.st_mtime,
+            "file_size": stat.st_size,
+            "settings": settings(gop),
+        }
+        # Saved as we go so an interrupted run keeps what it finished
+        save_manifest(manifest, dest)
+    return manifest
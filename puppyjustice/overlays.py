@@ -0,0 +1,232 @@
+import os
+import json
+import logging
+import time
+import hashlib
+import functools
+import threading
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from . import disk_cache
+from .planner import VIDEO_SIZE, split_title
+
+""" Text overlays (the title card and speaker name cards) are rasterized in
+process with PIL and kept in a content-addressed cache on disk, so a card
+that has been drawn before, by this or any earlier run, is just a PNG read.
+"""
+
+CACHE_DIR = "cache/overlays"
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Seconds between evictions, as each walks the whole cache and a video draws
+# a card for every speaker
+EVICT_INTERVAL = 60
+_last_evicted = None
+
+INTRO_BACKGROUND = "resources/intro_background.png"
+SPEAKER_BACKGROUND = "resources/speaker_background.png"
+
+""" Candidate font files for the ImageMagick font names used by the cards
+"""
+FONTS = {
+    "Bookman-URW-Demi-Bold": ["URWBookman-Demi.otf", "URWBookman-Demi.t1",
+                              "URWBookmanL-DemiBold.ttf", "b018015l.pfb"],
+    "Bookman-URW-Light-Italic": ["URWBookman-LightItalic.otf",
+                                 "URWBookman-LightItalic.t1",
+                                 "URWBookmanL-LighItal.ttf", "b018032l.pfb"],
+}
+FONT_DIRS = ["/usr/share/fonts", "/usr/local/share/fonts",
+             os.path.expanduser("~/.fonts")]
+
+TITLE_FONT = "Bookman-URW-Demi-Bold"
+DESCRIPTION_FONT = "Bookman-URW-Light-Italic"
+
+# Where the card is placed in the frame, and where its text sits on it
+SPEAKER_CARD_POSITION = (60, 540)
+SPEAKER_NAME_OFFSET = (20, 10)
+SPEAKER_DESCRIPTION_OFFSET = (20, 60)
+TITLE_WIDTH = 900
+
+
+@functools.lru_cache(maxsize=None)
+def find_font(name):
+    candidates = FONTS.get(name, [name])
+    for directory in FONT_DIRS:
+        for root, _, files in os.walk(directory):
+            for candidate in candidates:
+                if candidate in files:
+                    return os.path.join(root, candidate)
+    logging.warning("No font file found for {}".format(name))
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(name, size):
+    path = find_font(name)
+    if path is None:
+        return ImageFont.load_default(size)
+    return ImageFont.truetype(path, size)
+
+
+@functools.lru_cache(maxsize=None)
+def load_background(path):
+    return Image.open(path).convert("RGBA")
+
+
+def cache_path(kind, **params):
+    params["kind"] = kind
+    params["fonts"] = {name: find_font(name) for name in FONTS}
+    key = json.dumps(params, sort_keys=True).encode('utf-8')
+    digest = hashlib.sha256(key).hexdigest()
+    return os.path.join(CACHE_DIR, digest[:2], digest + ".png")
+
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    """ Remove the least recently used cards until the cache fits in max_bytes
+    """
+    disk_cache.evict(CACHE_DIR, max_bytes,
+                     include=lambda name: name.endswith(".png"))
+
+
+def cached_image(path, draw):
+    if os.path.exists(path):
+        # Reading a card counts as using it for eviction purposes
+        os.utime(path)
+        return path
+
+    global _last_evicted
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Other threads and processes (render workers, other runs) may be
+    # drawing the same card at the same time
+    tmp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    draw().save(tmp_path, format="PNG")
+    os.replace(tmp_path, path)
+
+    now = time.monotonic()
+    if _last_evicted is None or now - _last_evicted >= EVICT_INTERVAL:
+        _last_evicted = now
+        evict()
+    return path
+
+
+def draw_text(image, position, text, font, fill="white", stroke_width=0,
+              align="left"):
+    ImageDraw.Draw(image).multiline_text(position, text, font=font,
+                                         fill=fill, align=align,
+                                         stroke_width=stroke_width,
+                                         stroke_fill="black")
+
+
+def text_size(text, font, stroke_width=0):
+    draw = ImageDraw.Draw(Image.new("RGBA", (1, 1)))
+    left, top, right, bottom = draw.multiline_textbbox(
+        (0, 0), text, font=font, stroke_width=stroke_width, align="center")
+    return right, bottom
+
+
+def wrap(text, font, width):
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split():
+            candidate = (line + " " + word).strip()
+            if line and font.getlength(candidate) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def scale_of(size):
+    return size[0] / VIDEO_SIZE[0]
+
+
+def scaled(image, size):
+    """ An image drawn for a VIDEO_SIZE frame, resized for a frame of 'size'
+    """
+    scale = scale_of(size)
+    if scale == 1:
+        return image
+    return image.resize((max(1, round(image.width * scale)),
+                         max(1, round(image.height * scale))),
+                        Image.LANCZOS)
+
+
+def speaker_card_position(size=VIDEO_SIZE):
+    scale = scale_of(size)
+    return tuple(round(v * scale) for v in SPEAKER_CARD_POSITION)
+
+
+def speaker_card_file(name, description=None, size=VIDEO_SIZE):
+    """ The lower third shown when a speaker is introduced, as an RGBA PNG
+    meant to be placed at speaker_card_position(size) in a frame of 'size'
+    """
+    def draw():
+        background = load_background(SPEAKER_BACKGROUND)
+        name_font = load_font(TITLE_FONT, 40)
+        description_font = load_font(DESCRIPTION_FONT, 20)
+
+        width, height = background.size
+        name_width, name_height = text_size(name, name_font, 2)
+        width = max(width, SPEAKER_NAME_OFFSET[0] + name_width)
+        height = max(height, SPEAKER_NAME_OFFSET[1] + name_height)
+        if description:
+            desc_width, desc_height = text_size(description, description_font)
+            width = max(width, SPEAKER_DESCRIPTION_OFFSET[0] + desc_width)
+            height = max(height, SPEAKER_DESCRIPTION_OFFSET[1] + desc_height)
+
+        card = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+        card.alpha_composite(background)
+        draw_text(card, SPEAKER_NAME_OFFSET, name, name_font, stroke_width=2)
+        if description:
+            draw_text(card, SPEAKER_DESCRIPTION_OFFSET, description,
+                      description_font)
+        return scaled(card, size)
+
+    return cached_image(cache_path("speaker", name=name,
+                                   description=description,
+                                   name_size=40, description_size=20,
+                                   stroke=2, frame_size=list(size),
+                                   background=file_key(SPEAKER_BACKGROUND)),
+                        draw)
+
+
+def title_card_file(title, size=VIDEO_SIZE):
+    """ The full frame title card shown at the start of each video
+    """
+    def draw():
+        frame = Image.new("RGBA", VIDEO_SIZE, (0, 0, 0, 255))
+        frame.alpha_composite(load_background(INTRO_BACKGROUND))
+
+        font = load_font(TITLE_FONT, 65)
+        text = wrap(split_title(title), font, TITLE_WIDTH)
+        width, height = text_size(text, font, 2)
+        position = ((VIDEO_SIZE[0] - width) // 2,
+                    (VIDEO_SIZE[1] - height) // 2)
+        draw_text(frame, position, text, font, stroke_width=2,
+                  align="center")
+        return scaled(frame.convert("RGB"), size)
+
+    return cached_image(cache_path("title", title=title, size=65, stroke=2,
+                                   width=TITLE_WIDTH, frame_size=list(size),
+                                   background=file_key(INTRO_BACKGROUND)),
+                        draw)
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return [path, stat.st_mtime, stat.st_size]
+
+
+def load_image(path):
+    return np.asarray(Image.open(path))
+
+
+def speaker_card(name, description=None, size=VIDEO_SIZE):
+    return load_image(speaker_card_file(name, description, size))
+
+
+def title_card(title, size=VIDEO_SIZE):
+    return load_image(title_card_file(title, size))
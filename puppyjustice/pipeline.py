@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import queue
+import shutil
+import logging
+import threading
+
+""" Videos are made in stages (fetching audio, rendering, uploading), each
+running on its own thread. The stages are joined by bounded queues, so one
+case can render while the one before it uploads, without rendered videos
+piling up on disk faster than they can be uploaded.
+"""
+
+BUILD_DIR = "build"
+
+""" How many jobs may wait between one stage and the next
+"""
+QUEUE_SIZE = 1
+
+STOP = None
+
+
+class Job(object):
+    """ One video: a single oral argument part of a case. Everything made
+    for it goes into its own build directory, with the job's details in
+    job.json.
+    """
+
+    def __init__(self, case, title, sub_title, description, media_json,
+                 finished=True, build_dir=BUILD_DIR):
+        self.id = media_json["id"]
+        self.case = case
+        self.title = title
+        self.sub_title = sub_title
+        self.description = description
+        self.media_json = media_json
+        self.finished = finished
+        self.directory = os.path.join(build_dir, str(self.id))
+
+        self.stage = None
+        self.skipped = False
+        self.error = None
+        self.audio = None
+        self.plan = None
+        self.subtitles = None
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    @property
+    def video(self):
+        return self.path("{}.mp4".format(self.id))
+
+    @property
+    def thumbnail(self):
+        return self.path("thumbnail.png")
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        info = {
+            "id": self.id,
+            "case": self.case["ID"],
+            "title": self.title,
+            "sub_title": self.sub_title,
+            "description": self.description,
+            "subtitles": self.subtitles,
+            "finished": self.finished,
+            "stage": self.stage,
+            "skipped": self.skipped,
+            "error": self.error,
+        }
+        with open(self.path("job.json.tmp"), "w", encoding='utf-8') as file:
+            json.dump(info, file, indent=1, sort_keys=True)
+        os.replace(self.path("job.json.tmp"), self.path("job.json"))
+
+    @classmethod
+    def load(cls, directory):
+        """ Recreate a job from the job.json in its build directory. Only
+        what was saved is available; the case and media JSON are reduced to
+        their IDs.
+        """
+        with open(os.path.join(directory, "job.json"), encoding='utf-8') as file:
+            info = json.load(file)
+        job = cls({"ID": info["case"]}, info["title"], info["sub_title"],
+                  info["description"], {"id": info["id"]}, info["finished"],
+                  os.path.dirname(os.path.normpath(directory)))
+        job.directory = directory
+        job.subtitles = info["subtitles"]
+        job.stage = info["stage"]
+        job.skipped = info["skipped"]
+        job.error = info["error"]
+        return job
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def pending_uploads(build_dir=BUILD_DIR, after="render"):
+    """ The jobs in build_dir that have finished the 'after' stage, but
+    not yet been uploaded
+    """
+    jobs = []
+    for name in sorted(os.listdir(build_dir)):
+        directory = os.path.join(build_dir, name)
+        if not os.path.exists(os.path.join(directory, "job.json")):
+            continue
+        job = Job.load(directory)
+        if job.stage == after and not job.skipped and \
+                os.path.exists(job.video):
+            jobs.append(job)
+    return jobs
+
+
+class CaseProgress(object):
+    """ Tracks the parts of each case as they finish out of order, calling
+    'record' with a case's ID once its last part has been submitted and
+    every part has finished without error.
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.lock = threading.Lock()
+        self.outstanding = {}
+        self.complete = set()
+        self.failed = set()
+
+    def add(self, job):
+        with self.lock:
+            id = job.case["ID"]
+            self.outstanding[id] = self.outstanding.get(id, 0) + 1
+            if job.finished:
+                self.complete.add(id)
+
+    def finish(self, job, failed=False):
+        with self.lock:
+            id = job.case["ID"]
+            self.outstanding[id] -= 1
+            if failed:
+                self.failed.add(id)
+            done = self.outstanding[id] == 0 and id in self.complete
+            if done:
+                del self.outstanding[id]
+                self.complete.discard(id)
+            record = done and id not in self.failed
+        if record:
+            self.record(id)
+
+
+def run_stages(job, stages, store=None):
+    """ Run a job through every stage in turn on the calling thread. Given a
+    jobstore.JobStore, each stage is recorded in it as it finishes or fails.
+    """
+    for name, stage in stages:
+        if job.skipped:
+            break
+        started = time.monotonic()
+        try:
+            stage(job)
+        except (Exception, SystemExit) as e:
+            if store is not None:
+                store.fail(job, name, e)
+            raise
+        job.stage = name
+        job.save()
+        if store is not None:
+            store.finish_stage(job, name, time.monotonic() - started)
+
+
+class Pipeline(object):
+    """ Runs each of 'stages', a list of (name, function) pairs, on its own
+    thread. A job that raises is logged, left in its build directory and
+    dropped; one marked as skipped passes straight through. Every job that
+    makes it out of the last stage is given to 'done'. Given a
+    jobstore.JobStore, each stage is recorded in it as it finishes or fails.
+    """
+
+    def __init__(self, stages, done=None, failed=None, queue_size=QUEUE_SIZE,
+                 store=None):
+        self.done = done
+        self.failed = failed
+        self.store = store
+        self.queues = [queue.Queue(queue_size) for _ in stages]
+        self.threads = []
+        for i, (name, stage) in enumerate(stages):
+            outbox = self.queues[i + 1] if i + 1 < len(stages) else None
+            thread = threading.Thread(target=self.work, name=name,
+                                      args=(name, stage, self.queues[i],
+                                            outbox))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self, name, stage, inbox, outbox):
+        while True:
+            job = inbox.get()
+            if job is STOP:
+                if outbox is not None:
+                    outbox.put(STOP)
+                return
+
+            if not job.skipped:
+                try:
+                    logging.info("Job {}: {}".format(job.id, name))
+                    started = time.monotonic()
+                    stage(job)
+                    job.stage = name
+                    job.save()
+                except (Exception, SystemExit) as e:
+                    logging.exception("Job {} failed in {}".format(job.id, name))
+                    job.error = "{}: {}".format(name, e)
+                    job.save()
+                    if self.store is not None:
+                        self.store.fail(job, name, e)
+                    if self.failed is not None:
+                        self.failed(job)
+                    continue
+                if self.store is not None:
+                    self.store.finish_stage(job, name,
+                                            time.monotonic() - started)
+
+            if outbox is not None:
+                outbox.put(job)
+            elif self.done is not None:
+                self.done(job)
+
+    def submit(self, job):
+        """ Queue a job, waiting for room if the first stage is backed up
+        """
+        self.queues[0].put(job)
+
+    def close(self):
+        """ Wait for every submitted job to finish
+        """
+        self.queues[0].put(STOP)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,469 @@
+import json
+import math
+import random
+from bisect import bisect_left, bisect_right
+from .catalog import Catalog, CATALOG_PATH
+from .mezzanine import load_manifest, preferred_path
+from .transcript import Transcript, SpeakerIndex, RecentSpeakers
+
+""" A mapping of Justices' real names to their 'resource' name
+"""
+JUSTICE_MAPPING = {
+    "John G. Roberts, Jr.": "roberts",
+    "Antonin Scalia": "scalia",
+    "Ruth Bader Ginsburg": "ginsburg",
+    "Sonia Sotomayor": "sotomayor",
+    "Elena Kagan": "kagan",
+    "Stephen G. Breyer": "breyer",
+    "Anthony M. Kennedy": "kennedy",
+    "Samuel A. Alito, Jr.": "alito",
+    "Clarence Thomas": "thomas"
+}
+
+MAX_MISC_TIME = 4
+MAX_RELATED_TIME = 7
+MIN_CLIP_DURATION = 1.8
+INTRO_DURATION = 6
+CROSSFADE_DURATION = 1
+MIN_SPEAKER_INTRO_DURATION = 3
+MAX_SPEAKER_TITLE = 65
+VIDEO_SIZE = (1280, 720)
+DISCLAIMER_PATH = "resources/disclaimer.mp4"
+
+
+def get_speaker_info_by_id(case, speaker_id):
+    return SpeakerIndex(case).get(speaker_id)
+
+
+def split_title(title):
+    """ Breaks a case name over three lines around the 'v.'
+    """
+    if title.count(" v. ") == 1:
+        return title.replace(" v. ", "\nv.\n")
+    elif title.count (" v ") == 1:
+        return title.replace(" v ", "\nv\n")
+    else:
+        assert(False)
+
+
+def plan_entry(resource, t_in=None, t_out=None, overlays=None):
+    """ A single cut in the timeline: the section [t_in, t_out) of a
+    resource file. The start time is filled in once the timeline is laid out.
+    """
+    if t_in is None:
+        t_in, t_out = 0, resource.duration
+    return {
+        "source": resource.path,
+        "in": t_in,
+        "out": t_out,
+        "overlays": overlays or [],
+    }
+
+
+def entry_duration(entry):
+    return entry["out"] - entry["in"]
+
+
+def random_entry(resource, duration, overlays=None, rand=random):
+    assert(duration < resource.duration)
+    start = rand.uniform(0, resource.duration - duration)
+    return plan_entry(resource, start, start+duration, overlays)
+
+
+def speaker_overlay(speaker_id, speakers):
+    info = speakers.get(speaker_id)
+    if info is None:
+        return []
+    name, description = info
+
+    if description is not None and len(description) > MAX_SPEAKER_TITLE:
+        description = None
+
+    return [{"type": "speaker", "name": name, "description": description}]
+
+
+SPEAKER = "speaker"
+MISC = "misc"
+
+# The most whole clips tried together when looking for a set that exactly
+# finishes a turn
+FINISH_DEPTH = 3
+
+
+class ClipScheduler(object):
+    """ Fills turns with as few cuts as possible. Each resource's clips are
+    kept sorted by duration, so the clips that would finish what is left of a
+    turn (alone, or followed by a cutaway and another clip) are found by
+    bisection, and only when none fit is a clip trimmed. Speaker clips
+    alternate with misc cutaways of at most MAX_MISC_TIME, and no clip is
+    shorter than MIN_CLIP_DURATION, other than what a resource with only
+    shorter clips forces.
+
+    One scheduler plans every turn of an argument, remembering the last
+    clip taken from each resource so that none is used twice in a row. All
+    choices come from 'rand', a random.Random, so a plan is reproducible
+    from its seed.
+    """
+
+    def __init__(self, resources, rand=None):
+        self.random = rand or random.Random()
+        self.clips = {}
+        self.durations = {}
+        for name, clips in resources.items():
+            usable = [c for c in clips if c.duration >= MIN_CLIP_DURATION]
+            usable = sorted(usable or clips, key=lambda c: c.duration)
+            self.clips[name] = usable
+            self.durations[name] = [c.duration for c in usable]
+        self.last = {}
+
+    def between(self, resource, low, high):
+        """ The clips of 'resource' lasting from low to high seconds, other
+        than the last one used
+        """
+        durations = self.durations[resource]
+        clips = self.clips[resource][bisect_left(durations, low):
+                                     bisect_right(durations, high)]
+        return [c for c in clips if c is not self.last.get(resource)]
+
+    def longer_than(self, resource, duration):
+        durations = self.durations[resource]
+        clips = self.clips[resource][bisect_right(durations, duration):]
+        return [c for c in clips if c is not self.last.get(resource)]
+
+    def random_entry(self, resource, duration, overlays=None):
+        return random_entry(resource, duration, overlays, self.random)
+
+    def use(self, resource, clip):
+        self.last[resource] = clip
+        return clip
+
+    def finish(self, resource_id, remaining, kind, depth=FINISH_DEPTH):
+        """ Whole clips, alternating between kinds starting with 'kind',
+        that fill 'remaining' to within MIN_CLIP_DURATION, or None
+        """
+        resource = resource_id if kind == SPEAKER else MISC
+        longest = MAX_MISC_TIME if kind == MISC else remaining
+
+        ends = self.between(resource,
+                            max(remaining - MIN_CLIP_DURATION, MIN_CLIP_DURATION),
+                            min(remaining, longest))
+        if ends:
+            return [(resource, self.random.choice(ends))]
+        if depth == 1:
+            return None
+
+        candidates = self.between(resource, MIN_CLIP_DURATION,
+                                  min(remaining - MIN_CLIP_DURATION, longest))
+        self.random.shuffle(candidates)
+        following = MISC if kind == SPEAKER else SPEAKER
+        for clip in candidates:
+            previous = self.last.get(resource)
+            self.last[resource] = clip
+            rest = self.finish(resource_id, remaining - clip.duration,
+                               following, depth - 1)
+            self.last[resource] = previous
+            if rest is not None:
+                return [(resource, clip)] + rest
+        return None
+
+    def plan_turn(self, resource_id, duration, introduction=False,
+                  overlays=None):
+        """ Returns the entries for a turn (None if it is too short for a
+        clip of its own) and the time left over, to be carried into the
+        next turn
+        """
+        if duration <= MIN_CLIP_DURATION and not introduction:
+            return None, duration
+
+        entries = []
+        remaining = duration
+        kind = SPEAKER
+        if introduction:
+            # The speaker's card goes over their longest clip
+            clip = self.use(resource_id, self.clips[resource_id][-1])
+            if clip.duration <= remaining:
+                entries.append(plan_entry(clip, overlays=overlays))
+                remaining -= clip.duration
+            else:
+                length = max(remaining, MIN_SPEAKER_INTRO_DURATION)
+                entries.append(self.random_entry(clip, length, overlays))
+                remaining -= length
+            kind = MISC
+
+        while remaining > MIN_CLIP_DURATION:
+            clips = self.finish(resource_id, remaining, kind)
+            if clips is not None:
+                for resource, clip in clips:
+                    entries.append(plan_entry(self.use(resource, clip)))
+                    remaining -= clip.duration
+                break
+
+            if kind == SPEAKER:
+                longer = self.longer_than(resource_id, remaining)
+                if longer:
+                    clip = self.use(resource_id, self.random.choice(longer))
+                    entries.append(self.random_entry(clip, remaining))
+                    remaining = 0
+                    break
+                shorter = self.between(resource_id, 0, remaining)
+                if not shorter:
+                    # Nothing but the clip just used will do
+                    clip = self.last[resource_id]
+                    if clip.duration > remaining:
+                        entries.append(self.random_entry(clip, remaining))
+                        remaining = 0
+                        break
+                    shorter = [clip]
+                # Longer clips make for fewer cuts
+                clip = self.use(resource_id,
+                                self.random.choice(shorter[len(shorter) // 2:]))
+                entries.append(plan_entry(clip))
+                remaining -= clip.duration
+                kind = MISC
+                continue
+
+            # There must be a little time after a cutaway but before the
+            # end of the turn, or the cutaway ends it
+            if remaining <= MAX_MISC_TIME + MIN_CLIP_DURATION:
+                longer = self.longer_than(MISC, remaining)
+                if longer:
+                    clip = self.use(MISC, self.random.choice(longer))
+                    entries.append(self.random_entry(clip, remaining))
+                    remaining = 0
+                    break
+            else:
+                whole = self.between(MISC, MIN_CLIP_DURATION, MAX_MISC_TIME)
+                if whole:
+                    clip = self.use(MISC, self.random.choice(whole))
+                    entries.append(plan_entry(clip))
+                    remaining -= clip.duration
+                else:
+                    # Trim a longer cutaway, even the one just used, or
+                    # failing that use the longest whole
+                    longer = self.clips[MISC][
+                        bisect_right(self.durations[MISC], MAX_MISC_TIME):]
+                    if longer:
+                        clip = self.use(MISC, self.random.choice(longer))
+                        entries.append(self.random_entry(clip, MAX_MISC_TIME))
+                        remaining -= MAX_MISC_TIME
+                    else:
+                        clip = self.use(MISC, self.clips[MISC][-1])
+                        entries.append(plan_entry(clip))
+                        remaining -= clip.duration
+            kind = SPEAKER
+
+        planned = sum(entry_duration(e) for e in entries)
+        assert(math.isclose(planned + remaining, duration))
+        return entries, remaining
+
+
+def plan_speaker_turn(resource_id, duration, resources, introduction=False,
+                      speakers=None, speaker_id=None, scheduler=None):
+    if scheduler is None:
+        scheduler = ClipScheduler(resources)
+    overlays = speaker_overlay(speaker_id, speakers) if introduction else []
+    return scheduler.plan_turn(resource_id, duration, introduction, overlays)
+
+
+def plan_turns(case, resources, transcript, rand=None):
+    """ Returns a list of turns, each a list of timeline entries, covering
+    the whole transcript, with every choice made by 'rand'.
+    """
+    transcript = Transcript(transcript)
+    speakers = SpeakerIndex(case)
+    scheduler = ClipScheduler(resources, rand)
+
+    current_remainder = 0
+    unknown_mapping = {}
+    has_been_introduced = set()
+    speaker_turns = []
+    for section in transcript.sections:
+        turn_speakers = section.speakers
+        durations = section.durations
+        recent = RecentSpeakers(turn_speakers)
+        turn_count = len(section)
+        turn_num = 0
+        while turn_num < turn_count:
+            speaker = turn_speakers[turn_num]
+            name = transcript.name(speaker)
+
+            if name is None:
+                current_remainder += durations[turn_num]
+                turn_num += 1
+                continue
+
+            if name not in JUSTICE_MAPPING:
+                assert(transcript.roles[speaker] is None)
+                if name not in unknown_mapping.keys():
+                    n = len(unknown_mapping.keys()) % 2
+                    resource = "lawyer" + str(n)
+                    unknown_mapping[name] = resource
+                else:
+                    resource = unknown_mapping[name]
+            else:
+                resource = JUSTICE_MAPPING[name]
+
+            speaker_id = section.speaker_ids[turn_num]
+            duration = durations[turn_num]
+
+            # Just skip very short turns
+            if duration < 0.001:
+                turn_num += 1
+                continue
+
+            # Fold a short interjection from someone who has spoken recently
+            # into the surrounding turns of the current speaker
+            recent.advance(turn_num+1)
+            if turn_count > turn_num+2 and \
+                    durations[turn_num+1] < MIN_CLIP_DURATION and \
+                    turn_speakers[turn_num+1] in recent and \
+                    turn_speakers[turn_num+2] == speaker:
+                duration += durations[turn_num+1]
+                duration += durations[turn_num+2]
+                turn_num += 2
+
+            if duration > 2 and speaker_id not in has_been_introduced:
+                entries, remainder = plan_speaker_turn(resource,
+                                                       duration + current_remainder,
+                                                       resources,
+                                                       introduction=True,
+                                                       speakers=speakers,
+                                                       speaker_id=speaker_id,
+                                                       scheduler=scheduler)
+                has_been_introduced.add(speaker_id)
+            else:
+                entries, remainder = plan_speaker_turn(resource,
+                                                       duration + current_remainder,
+                                                       resources,
+                                                       scheduler=scheduler)
+
+            # The duration we got plus the remainder should be equal
+            # to the duration we requested
+            planned = 0 if entries is None else \
+                sum(entry_duration(e) for e in entries)
+            assert(math.isclose(planned + remainder,
+                                duration + current_remainder))
+
+            if entries is None and remainder is None:
+                current_remainder = duration
+                turn_num += 1
+                continue
+            elif entries is None:
+                current_remainder = remainder
+            else:
+                current_remainder = remainder
+                speaker_turns.append(entries)
+            turn_num += 1
+    return speaker_turns
+
+
+def plan_video(title, case, resources, transcript,
+               ending=DISCLAIMER_PATH, catalog_path=CATALOG_PATH, seed=None):
+    """ Plan the edit of a whole video without opening any clips. The result
+    is a plain dictionary that can be saved with save_plan and rendered
+    later by builder.render_plan. Every random choice is made by a
+    random.Random of its own, seeded with 'seed' (or one drawn from the
+    random module), and the seed is kept in the plan so that anything else
+    chosen at random for the video can be reproduced too.
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    speaker_turns = plan_turns(case, resources, transcript,
+                               random.Random(seed))
+
+    ending = preferred_path(ending, load_manifest())
+    catalog = Catalog(catalog_path)
+    ending_info = catalog.lookup(ending)
+    catalog.save()
+
+    # The first turn fades in over the end of the title card, everything
+    # after that follows back to back.
+    clips = []
+    time = INTRO_DURATION - CROSSFADE_DURATION
+    for turn_num, entries in enumerate(speaker_turns):
+        for entry in entries:
+            entry["start"] = time
+            entry["turn"] = turn_num
+            time += entry_duration(entry)
+            clips.append(entry)
+
+    return {
+        "title": title,
+        "seed": seed,
+        "size": list(VIDEO_SIZE),
+        "intro": {
+            "title": title,
+            "duration": INTRO_DURATION,
+            "crossfade": CROSSFADE_DURATION,
+        },
+        "clips": clips,
+        "ending": {
+            "source": ending,
+            "in": 0,
+            "out": ending_info["duration"],
+            "overlays": [],
+            "start": time,
+        },
+        "audio_offset": INTRO_DURATION - CROSSFADE_DURATION,
+        "duration": time + ending_info["duration"],
+    }
+
+
+def plan_turn_groups(plan):
+    """ Yields the clips of a plan grouped by turn, in order
+    """
+    group = []
+    for entry in plan["clips"]:
+        if group and group[-1]["turn"] != entry["turn"]:
+            yield group
+            group = []
+        group.append(entry)
+    if group:
+        yield group
+
+
+def trim_plan(plan, start=0, end=None):
+    """ The part of a plan between 'start' and 'end' seconds, with times
+    relative to 'start'. Clips cut by either end are shortened. The title
+    card is only kept when the part begins at the start of the video,
+    otherwise the part begins no earlier than the first clip.
+    """
+    end = plan["duration"] if end is None else min(end, plan["duration"])
+    intro = plan["intro"]
+    if start > 0 or intro is None:
+        intro = None
+        if plan["clips"]:
+            start = max(start, plan["clips"][0]["start"])
+
+    def cut(entry):
+        entry_start = entry["start"]
+        entry_end = entry_start + entry_duration(entry)
+        if entry_end <= start or entry_start >= end:
+            return None
+        return dict(entry,
+                    start=max(entry_start, start) - start,
+                    **{"in": entry["in"] + max(0, start - entry_start),
+                       "out": entry["out"] - max(0, entry_end - end)})
+
+    clips = [clip for clip in map(cut, plan["clips"]) if clip is not None]
+    if not clips:
+        raise ValueError("The plan has no clips between {}s and {}s".format(
+            start, end))
+    ending = cut(plan["ending"]) if plan["ending"] is not None else None
+
+    return dict(plan,
+                intro=intro,
+                clips=clips,
+                ending=ending,
+                audio_offset=plan["audio_offset"] - start,
+                duration=end - start)
+
+
+def save_plan(plan, destination):
+    with open(destination, "w", encoding='utf-8') as file:
+        json.dump(plan, file, indent=1)
+
+
+def load_plan(source):
+    with open(source, encoding='utf-8') as file:
+        return json.load(file)
@@ -0,0 +1,82 @@
+import os
+import logging
+import tempfile
+from moviepy.editor import VideoFileClip
+from . import builder, renderer
+from .catalog import MAX_OPEN_READERS
+from .planner import trim_plan
+
+""" Quick, rough renders for checking an edit. The plan is rendered at a
+fraction of its size and frame rate, with the resources scaled down as they
+are decoded, the cards scaled to match, and the fastest x264 preset encoding
+on every core.
+"""
+
+PREVIEW_SCALE = 0.5
+PREVIEW_FPS = 15
+PREVIEW_PRESET = "ultrafast"
+
+
+def parse_time(text):
+    """ Seconds from '[[hours:]minutes:]seconds' """
+    seconds = 0.0
+    for part in text.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_range(text):
+    """ (start, end) in seconds from 'start-end', where either may be left
+    out to mean the start or end of the video. The end is None if so.
+    """
+    start, _, end = text.partition("-")
+    return (parse_time(start) if start.strip() else 0,
+            parse_time(end) if end.strip() else None)
+
+
+def preview_plan(plan, scale=PREVIEW_SCALE, fps=PREVIEW_FPS, start=0,
+                 end=None):
+    """ The part of plan between start and end, resized by 'scale' and at
+    'fps' frames per second
+    """
+    if start or end is not None:
+        plan = trim_plan(plan, start, end)
+    width, height = plan["size"]
+    # x264 needs even dimensions for yuv420p
+    size = [int(width * scale) // 2 * 2, int(height * scale) // 2 * 2]
+    return dict(plan, size=size, fps=fps)
+
+
+def render_preview(plan, audio_path, output, backend="moviepy",
+                   max_open=MAX_OPEN_READERS, frame_cache=None, mux=False):
+    """ Render a plan made by preview_plan, with the argument audio at
+    audio_path. Given mux, moviepy renders the video silent and the audio
+    is muxed in by ffmpeg.
+    """
+    threads = os.cpu_count() or 1
+    logging.info("Rendering a {}x{} preview at {}fps".format(
+        plan["size"][0], plan["size"][1], plan["fps"]))
+
+    if backend == "ffmpeg":
+        renderer.render_plan(plan, audio_path, output, threads,
+                             PREVIEW_PRESET)
+        return
+
+    resources = builder.generate_resource_mapping(
+        "resources", max_open=max_open, size=tuple(plan["size"]),
+        frame_cache=frame_cache)
+    if mux:
+        with tempfile.TemporaryDirectory(prefix="puppyjustice") as workdir:
+            silent = os.path.join(workdir, "silent.mp4")
+            video = builder.render_plan(plan, resources)
+            video.write_videofile(silent, fps=plan["fps"], audio=False,
+                                  preset=PREVIEW_PRESET, threads=threads)
+            renderer.mux_audio(["-i", silent], audio_path,
+                               plan["audio_offset"], plan["duration"], output)
+        return
+
+    audio = VideoFileClip(audio_path)
+    video = builder.render_plan(plan, resources, audio)
+    video.write_videofile(output, fps=plan["fps"], preset=PREVIEW_PRESET,
+                          threads=threads)
+    audio.close()
@@ -0,0 +1,197 @@
+import os
+import logging
+import subprocess
+import tempfile
+from . import overlays
+
+""" The ffmpeg render backend. Rather than producing every frame in Python as
+moviepy does, a plan is compiled into a single ffmpeg invocation: each clip is
+seeked to and cut to its exact frame count, the title and speaker card images
+are crossfaded and overlaid by the filter graph, and the audio is delayed and
+muxed in the same pass.
+"""
+
+FPS = 30
+
+VIDEO_CODEC_ARGS = ["-c:v", "libx264", "-pix_fmt", "yuv420p"]
+AUDIO_CODEC_ARGS = ["-c:a", "aac"]
+
+# Audio codecs that go into an mp4 as they are, without transcoding
+MP4_AUDIO_CODECS = ("aac", "mp3", "alac", "ac3")
+
+
+def quote_path(path):
+    return "'" + path.replace("'", "'\\''") + "'"
+
+
+def clip_frames(timeline, fps):
+    """ The number of frames each entry of the timeline is shown for. Each
+    is cut on the frame boundaries nearest its start and end, so that the
+    frames add up to those of the whole timeline and no clip drifts.
+    """
+    origin = timeline[0]["start"]
+    frames = []
+    for entry in timeline:
+        start = entry["start"] - origin
+        end = start + entry["out"] - entry["in"]
+        frames.append(round(end * fps) - round(start * fps))
+    return frames
+
+
+def compile_plan(plan, audio_path, output, workdir, threads=None,
+                 preset=None):
+    """ Returns the ffmpeg command line that renders plan to output. Any
+    files the command needs are written into workdir. A plan without an
+    intro or ending (a segment of a larger plan) renders just its clips, and
+    with no audio_path the output is silent.
+    """
+    width, height = plan["size"]
+    fps = plan.get("fps", FPS)
+    intro = plan["intro"]
+    timeline = list(plan["clips"])
+    if plan["ending"] is not None:
+        timeline.append(plan["ending"])
+
+    inputs = []
+
+    def add_input(*args):
+        inputs.extend(args)
+        return inputs.count("-i") - 1
+
+    scale = "scale={}:{},setsar=1,format=yuv420p,settb=AVTB".format(
+        width, height)
+    normalize = "fps={},{}".format(fps, scale)
+
+    # Each clip is its own input, seeked to its in point (accurately, as
+    # ffmpeg decodes and drops the frames before it) and cut to its frame
+    # count after resampling, which the concat demuxer's inpoint and
+    # outpoint can't do on sources with long GOPs. Resampling from time 0
+    # rather than from the first frame kept shows, like moviepy, the source
+    # frame at or before each output frame. The last frame is repeated in
+    # case a clip ends a little short of its out point.
+    graph = []
+    for i, (entry, frames) in enumerate(zip(timeline,
+                                            clip_frames(timeline, fps))):
+        clip = add_input("-ss", "{:.6f}".format(entry["in"]),
+                         "-t", "{:.6f}".format(entry["out"] - entry["in"] + 1),
+                         "-i", entry["source"])
+        graph.append("[{}:v]fps={}:start_time=0,{},tpad=stop_mode=clone:"
+                     "stop=2,trim=end_frame={}[clip{}]".format(
+                         clip, fps, scale, frames, i))
+    graph.append("{}concat=n={}:v=1:a=0,settb=AVTB[main]".format(
+        "".join("[clip{}]".format(i) for i in range(len(timeline))),
+        len(timeline)))
+    last = "main"
+
+    if intro is not None:
+        title = add_input("-loop", "1", "-framerate", str(fps),
+                          "-t", str(intro["duration"]),
+                          "-i", overlays.title_card_file(intro["title"],
+                                                         plan["size"]))
+        crossfade = intro["crossfade"]
+        graph += [
+            "[{}:v]{}[intro]".format(title, normalize),
+            "[intro][main]xfade=transition=fade:duration={}:offset={}[v0]".format(
+                crossfade, intro["duration"] - crossfade),
+        ]
+        last = "v0"
+
+    cards = [(entry, overlay) for entry in plan["clips"]
+             for overlay in entry["overlays"] if overlay["type"] == "speaker"]
+    x, y = overlays.speaker_card_position(plan["size"])
+    for i, (entry, overlay) in enumerate(cards):
+        card = add_input("-loop", "1", "-framerate", str(fps),
+                         "-i", overlays.speaker_card_file(
+                             overlay["name"], overlay["description"],
+                             plan["size"]))
+        end = entry["start"] + entry["out"] - entry["in"]
+        graph.append(
+            "[{}][{}:v]overlay={}:{}:enable='between(t,{:.6f},{:.6f})'"
+            "[card{}]".format(last, card, x, y, entry["start"], end, i))
+        last = "card{}".format(i)
+
+    if audio_path is not None:
+        if plan["audio_offset"] < 0:
+            # The plan was trimmed to start partway through the argument
+            audio = add_input("-ss", "{:.6f}".format(-plan["audio_offset"]),
+                              "-i", audio_path)
+        else:
+            audio = add_input("-i", audio_path)
+        delay = int(max(0, plan["audio_offset"]) * 1000)
+        graph.append("[{}:a]adelay={}:all=1[aout]".format(audio, delay))
+
+    graph_path = os.path.join(workdir, "graph.txt")
+    with open(graph_path, "w", encoding='utf-8') as file:
+        file.write(";\n".join(graph))
+
+    command = ["ffmpeg", "-y"] + inputs
+    command += ["-filter_complex_script", graph_path, "-map", "[{}]".format(last)]
+    if audio_path is not None:
+        command += ["-map", "[aout]"] + AUDIO_CODEC_ARGS
+    command += VIDEO_CODEC_ARGS
+    if preset is not None:
+        command += ["-preset", preset]
+    if threads is not None:
+        command += ["-threads", str(threads)]
+    command += ["-r", str(fps), "-frames:v", str(round(plan["duration"] * fps)),
+                "-t", "{:.6f}".format(plan["duration"]), output]
+    return command
+
+
+def frame_count(path):
+    """ The number of frames in the video stream of path """
+    output = subprocess.check_output(["ffprobe", "-v", "error",
+                                      "-select_streams", "v:0",
+                                      "-count_packets",
+                                      "-show_entries", "stream=nb_read_packets",
+                                      "-of", "default=noprint_wrappers=1:nokey=1",
+                                      path])
+    return int(output.decode('utf-8').strip())
+
+
+def audio_codec(path):
+    output = subprocess.check_output(["ffprobe", "-v", "error",
+                                      "-select_streams", "a:0",
+                                      "-show_entries", "stream=codec_name",
+                                      "-of", "default=noprint_wrappers=1:nokey=1",
+                                      path])
+    return output.decode('utf-8').strip()
+
+
+def mux_audio(video_input, audio_path, audio_offset, duration, output):
+    """ Mux the argument audio, starting audio_offset seconds into the
+    video, with the video read by the ffmpeg input options video_input and
+    copied as it is. The audio is copied too when the codec allows and
+    encoded with AUDIO_CODEC_ARGS otherwise.
+    """
+    copy = audio_codec(audio_path) in MP4_AUDIO_CODECS
+    if audio_offset < 0:
+        # The plan was trimmed to start partway through the argument
+        audio_input = ["-ss", "{:.6f}".format(-audio_offset), "-i", audio_path]
+    elif copy:
+        audio_input = ["-itsoffset", "{:.6f}".format(audio_offset),
+                       "-i", audio_path]
+    else:
+        audio_input = ["-i", audio_path]
+
+    if copy:
+        audio_args = ["-map", "1:a", "-c:a", "copy"]
+    else:
+        audio_args = ["-filter_complex",
+                      "[1:a]adelay={}:all=1[aout]".format(
+                          int(max(0, audio_offset) * 1000)),
+                      "-map", "[aout]"] + AUDIO_CODEC_ARGS
+
+    command = ["ffmpeg", "-y"] + video_input + audio_input + \
+        ["-map", "0:v", "-c:v", "copy"] + audio_args + \
+        ["-t", "{:.6f}".format(duration), output]
+    logging.debug("Running: {}".format(" ".join(command)))
+    subprocess.check_call(command)
+
+
+def render_plan(plan, audio_path, output, threads=None, preset=None):
+    with tempfile.TemporaryDirectory(prefix="puppyjustice") as workdir:
+        command = compile_plan(plan, audio_path, output, workdir, threads,
+                               preset)
+        logging.debug("Running: {}".format(" ".join(command)))
+        subprocess.check_call(command)
@@ -0,0 +1,110 @@
+import os
+import json
+import logging
+import hashlib
+from . import overlays, metrics, disk_cache
+from .renderer import FPS, VIDEO_CODEC_ARGS
+
+""" Rendered segments of a video (the title and first turn, each later turn,
+the ending) are kept in a cache keyed by a hash of everything that goes into
+them: the planned clips and their source files, the overlay text and the
+encoder settings. A re-run, after a crash or a change to part of the edit,
+then only renders the segments that are missing and joins the rest.
+"""
+
+SEGMENT_CACHE_DIR = "cache/segments"
+MAX_SEGMENT_CACHE_BYTES = 20 * 1024 * 1024 * 1024
+
+# Bumped whenever a change to rendering would change a segment rendered
+# from the same inputs
+SEGMENT_FORMAT = 1
+
+
+def source_key(path):
+    return overlays.file_key(path) if os.path.exists(path) else [path]
+
+
+def segment_key(plan, backend):
+    """ The hash of a segment sub-plan and the settings it is rendered with
+    """
+    def entry_key(entry):
+        key = {name: entry[name]
+               for name in ("in", "out", "start", "overlays")}
+        key["source"] = source_key(entry["source"])
+        return key
+
+    key = {
+        "format": SEGMENT_FORMAT,
+        "backend": backend,
+        "fps": plan.get("fps", FPS),
+        "codec": VIDEO_CODEC_ARGS,
+        "size": list(plan["size"]),
+        "duration": plan["duration"],
+        "intro": plan["intro"],
+        "clips": [entry_key(entry) for entry in plan["clips"]],
+        "ending": plan["ending"] and entry_key(plan["ending"]),
+        "fonts": {name: overlays.find_font(name) for name in overlays.FONTS},
+    }
+    if plan["intro"] is not None:
+        key["intro_background"] = source_key(overlays.INTRO_BACKGROUND)
+    if any(entry["overlays"] for entry in plan["clips"]):
+        key["speaker_background"] = source_key(overlays.SPEAKER_BACKGROUND)
+
+    text = json.dumps(key, sort_keys=True).encode('utf-8')
+    return hashlib.sha256(text).hexdigest()
+
+
+def is_segment(name):
+    """ Whether a file in the cache is a stored segment, rather than one
+    still being rendered
+    """
+    return name.endswith(".mp4") and not name.endswith(".tmp.mp4")
+
+
+class SegmentCache(object):
+    """ Rendered segments on disk, named by their key. Once the cache is
+    over max_bytes the least recently used segments are removed.
+    """
+
+    def __init__(self, directory=SEGMENT_CACHE_DIR,
+                 max_bytes=MAX_SEGMENT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".mp4")
+
+    def lookup(self, key):
+        """ The path of the segment with this key, or None if it hasn't
+        been rendered
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            metrics.count("segment_cache_total", result="miss")
+            return None
+        # Using a segment counts as a use for eviction purposes
+        os.utime(path)
+        metrics.count("segment_cache_total", result="hit")
+        return path
+
+    def temporary_path(self, key):
+        """ Where to render the segment with this key, before it is stored
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path + ".tmp.mp4"
+
+    def store(self, key):
+        """ Move a segment rendered to temporary_path(key) into the cache
+        """
+        path = self.path(key)
+        os.replace(self.temporary_path(key), path)
+        return path
+
+    def evict(self):
+        """ Remove the least recently used segments until the cache fits in
+        max_bytes
+        """
+        total = disk_cache.evict(self.directory, self.max_bytes,
+                                 include=is_segment)
+        metrics.gauge("segment_cache_bytes", total)
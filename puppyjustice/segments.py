@@ -0,0 +1,253 @@
+import os
+import logging
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from .catalog import MAX_OPEN_READERS
+from .planner import entry_duration, plan_turn_groups
+from .renderer import FPS, frame_count, quote_path, mux_audio, render_plan
+from .segment_cache import SegmentCache, segment_key
+
+""" Parallel rendering. A plan is cut at turn boundaries into segments which
+are rendered silently by a pool of worker processes, joined without
+re-encoding and then muxed with the argument audio once. Segments cut a turn
+at a time can be kept in a SegmentCache and reused by later runs.
+"""
+
+# Cut more segments than there are workers so a few long turns don't leave
+# most of the pool idle at the end
+SEGMENTS_PER_WORKER = 4
+
+# Resources loaded by a worker process for the moviepy backend, with the
+# (max_open, size) they were loaded for
+_worker_resources = None
+
+# The most resource clips a worker keeps open, as set by init_worker
+_worker_max_open = MAX_OPEN_READERS
+
+
+def split_plan(plan, count, fps=FPS):
+    """ Split a plan into at most count sub-plans at turn boundaries. The
+    first keeps the intro, the last keeps the ending, and the clip start
+    times of each are relative to the start of that segment.
+    """
+    groups = list(plan_turn_groups(plan))
+    count = max(1, min(count, len(groups)))
+
+    clips_start = plan["clips"][0]["start"]
+    clips_end = plan["duration"] if plan["ending"] is None else \
+        plan["ending"]["start"]
+    target = (clips_end - clips_start) / count
+
+    segments = []
+    current = []
+    for group in groups:
+        current.extend(group)
+        group_end = group[-1]["start"] + entry_duration(group[-1])
+        boundary = clips_start + target * (len(segments) + 1)
+        if group_end >= boundary and len(segments) < count - 1:
+            segments.append(current)
+            current = []
+    if current:
+        segments.append(current)
+
+    parts = []
+    start = 0
+    for i, clips in enumerate(segments):
+        last = i == len(segments) - 1
+        end = plan["duration"] if last else \
+            clips[-1]["start"] + entry_duration(clips[-1])
+        parts.append((start, end, plan["intro"] if i == 0 else None, clips,
+                      plan["ending"] if last else None))
+        start = end
+    return cut_plan(plan, parts, fps)
+
+
+def turn_segments(plan, fps=FPS):
+    """ Split a plan into a sub-plan for the intro and the first turn (which
+    fades in over it), one for each later turn and one for the ending.
+    """
+    parts = []
+    start = 0
+    for i, group in enumerate(plan_turn_groups(plan)):
+        end = group[-1]["start"] + entry_duration(group[-1])
+        parts.append((start, end, plan["intro"] if i == 0 else None, group,
+                      None))
+        start = end
+    if plan["ending"] is not None:
+        parts.append((start, plan["duration"], None, [], plan["ending"]))
+    else:
+        start, _, intro, group, ending = parts[-1]
+        parts[-1] = (start, plan["duration"], intro, group, ending)
+    return cut_plan(plan, parts, fps)
+
+
+def cut_plan(plan, parts, fps=FPS):
+    """ The sub-plans for consecutive parts of a plan, each given as (start,
+    end, intro, clips, ending). Each is cut on a frame boundary, so that the
+    frames of the sub-plans add up to those of the whole plan, however many
+    there are, and joining them keeps the video in sync with the audio.
+    """
+    plans = []
+    for start, end, intro, clips, ending in parts:
+        frames = round(end * fps) - round(start * fps)
+        if frames <= 0:
+            continue
+        plans.append(dict(plan,
+                          intro=intro,
+                          clips=[dict(entry, start=entry["start"] - start)
+                                 for entry in clips],
+                          ending=ending and dict(ending,
+                                                 start=ending["start"] - start),
+                          duration=frames / fps))
+    return plans
+
+
+def worker_pool(workers, max_open=MAX_OPEN_READERS):
+    """ A pool of worker processes started by a fork server. Forking this
+    process instead would copy whatever locks its pipeline and upload threads
+    hold at that moment, which can leave a worker deadlocked.
+    """
+    root = logging.getLogger()
+    log_files = [handler.baseFilename for handler in root.handlers
+                 if isinstance(handler, logging.FileHandler)]
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=init_worker, initargs=(log_files, root.level, max_open))
+
+
+def init_worker(log_files, level, max_open):
+    global _worker_max_open
+    _worker_max_open = max_open
+    # Workers no longer inherit the logging set up by the runner
+    if log_files:
+        logging.basicConfig(level=level, handlers=[
+            logging.FileHandler(path) for path in log_files])
+
+
+def render_segment(plan, output, backend="moviepy", threads=None,
+                   frame_cache=None, max_open=None):
+    """ Render a sub-plan to output, silently, with exactly the number of
+    frames its duration covers, so that joined segments keep the audio in
+    sync with the whole plan. The moviepy backend keeps at most max_open
+    resource clips open, or as many as the pool's init_worker said.
+    """
+    frames = round(plan["duration"] * FPS)
+    if backend == "ffmpeg":
+        render_plan(plan, None, output, threads)
+    else:
+        render_segment_moviepy(plan, output, frames, threads, frame_cache,
+                               max_open or _worker_max_open)
+
+    encoded = frame_count(output)
+    if encoded != frames:
+        raise ValueError("{} has {} frames rather than {}".format(
+            output, encoded, frames))
+    return output
+
+
+def render_segment_moviepy(plan, output, frames, threads, frame_cache,
+                           max_open):
+    # Imported here so the ffmpeg backend workers never load moviepy
+    global _worker_resources
+    from . import builder
+    options = (max_open, tuple(plan["size"]))
+    if _worker_resources is None or _worker_resources[0] != options:
+        _worker_resources = (options, builder.generate_resource_mapping(
+            "resources", max_open=max_open, size=options[1],
+            frame_cache=frame_cache))
+
+    video = builder.render_plan(plan, _worker_resources[1])
+    # moviepy writes a frame for every multiple of 1/fps below the duration,
+    # which for a whole number of frames is sometimes one too many after
+    # rounding. Half a frame short of the end always gives exactly 'frames'.
+    video = video.set_duration((frames - 0.5) / FPS)
+    video.write_videofile(output, fps=FPS, codec="libx264", audio=False,
+                          threads=threads, logger=None)
+
+
+def join_segments(paths, audio_path, audio_offset, duration, output,
+                  workdir):
+    concat_list = os.path.join(workdir, "segments.ffconcat")
+    with open(concat_list, "w", encoding='utf-8') as file:
+        file.write("ffconcat version 1.0\n")
+        for path in paths:
+            file.write("file {}\n".format(quote_path(os.path.abspath(path))))
+
+    mux_audio(["-f", "concat", "-safe", "0", "-i", concat_list], audio_path,
+              audio_offset, duration, output)
+
+
+def render_segmented(plan, audio_path, output, workers,
+                     backend="moviepy", frame_cache=None,
+                     max_open=MAX_OPEN_READERS):
+    plans = split_plan(plan, workers * SEGMENTS_PER_WORKER)
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    logging.info("Rendering {} segments with {} workers".format(
+        len(plans), workers))
+
+    with tempfile.TemporaryDirectory(prefix="puppyjustice") as workdir:
+        paths = [os.path.join(workdir, "segment{:04d}.mp4".format(i))
+                 for i in range(len(plans))]
+        with worker_pool(workers, max_open) as pool:
+            futures = [pool.submit(render_segment, segment, path,
+                                   backend, threads, frame_cache)
+                       for segment, path in zip(plans, paths)]
+            for future in futures:
+                future.result()
+
+        join_segments(paths, audio_path, plan["audio_offset"],
+                      plan["duration"], output, workdir)
+
+
+def render_cached(plan, audio_path, output, workers, backend="moviepy",
+                  cache=None, frame_cache=None, max_open=MAX_OPEN_READERS):
+    """ Render a plan a turn at a time, reusing the segments already in the
+    cache and rendering the rest with a pool of worker processes, or in this
+    process for a single worker. The workers share decoded resource frames
+    through frame_cache, if given.
+    """
+    cache = cache or SegmentCache()
+    plans = turn_segments(plan)
+    keys = [segment_key(segment, backend) for segment in plans]
+
+    missing = {}
+    for segment, key in zip(plans, keys):
+        if key not in missing and cache.lookup(key) is None:
+            missing[key] = segment
+    logging.info("Rendering {} of {} segments with {} workers".format(
+        len(missing), len(plans), workers))
+
+    if missing and workers == 1:
+        # No pool to share the work with, so render in this process
+        for key, segment in missing.items():
+            render_segment(segment, cache.temporary_path(key), backend,
+                           None, frame_cache, max_open)
+            cache.store(key)
+    elif missing:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        with worker_pool(workers, max_open) as pool:
+            futures = {pool.submit(render_segment, segment,
+                                   cache.temporary_path(key), backend,
+                                   threads, frame_cache): key
+                       for key, segment in missing.items()}
+            # Each segment is stored as soon as it's done, so that a run
+            # that dies part way through keeps what it finished
+            failed = None
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.exception("Rendering a segment failed")
+                    failed = failed or e
+                    continue
+                cache.store(futures[future])
+            if failed is not None:
+                raise failed
+
+    with tempfile.TemporaryDirectory(prefix="puppyjustice") as workdir:
+        join_segments([cache.path(key) for key in keys], audio_path,
+                      plan["audio_offset"], plan["duration"], output,
+                      workdir)
+    cache.evict()
@@ -0,0 +1,137 @@
+import os
+from .planner import INTRO_DURATION, CROSSFADE_DURATION
+
+""" Subtitles are generated as a stream of cues from a single walk over the
+transcript, and any number of writers (one per output format) consume the
+stream at the same time.
+"""
+
+MAX_CHARACTERS_PER_SUBTITLE = 85
+
+# Timecodes must take into account the intro, but minus the crossfade
+TIMECODE_OFFSET_MS = (INTRO_DURATION - CROSSFADE_DURATION) * 1000
+
+
+def block_parts(text, start, end):
+    duration = end - start
+    words = text.split()
+
+    # A block shorter than half the limit can never reach it
+    if 2*len(text) + 1 < MAX_CHARACTERS_PER_SUBTITLE:
+        yield " ".join(words), start, end
+        return
+
+    # The length of the text so far is tracked as if the words were joined
+    # with a leading space each, which is how the limit was first defined
+    first_word = 0
+    length = 0
+
+    prior_time = start
+    for i, word_length in enumerate(map(len, words)):
+        length += 1 + word_length
+        if length + word_length >= MAX_CHARACTERS_PER_SUBTITLE:
+            sub_end = prior_time + duration*length/len(text)
+            yield " ".join(words[first_word:i+1]), prior_time, sub_end
+            prior_time = sub_end
+            first_word = i + 1
+            length = 0
+    yield " ".join(words[first_word:]), prior_time, end
+
+
+def cues(transcript):
+    """ Yields (start_ms, end_ms, text) for every subtitle in the transcript
+    """
+    for section in transcript["sections"]:
+        for turn in section["turns"]:
+            for block_num, block in enumerate(turn["text_blocks"]):
+                start_time = float(block["start"]) * 1000
+                end_time = float(block["stop"]) * 1000
+                block_text = block["text"]
+
+                if turn["speaker"] and block_num == 0:
+                    sub_name = turn["speaker"]["last_name"].split()[-1]
+                    block_text = sub_name + ": " + block_text
+
+                for sub, sub_start, sub_end in block_parts(block_text,
+                                                           start_time,
+                                                           end_time):
+                    if sub == "":
+                        continue
+                    yield sub_start, sub_end, sub
+
+
+def split_timecode(ms):
+    ms = int(ms + TIMECODE_OFFSET_MS)
+    seconds, milli = divmod(ms, 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return hours % 24, minutes, seconds, milli
+
+
+def milli_to_timecode(ms, short=False):
+    if short:
+        return "{0:02d}:{1:02d}:{2:02d}".format(*split_timecode(ms)[:3])
+    return "{0:02d}:{1:02d}:{2:02d}.{3:03d}".format(*split_timecode(ms))
+
+
+class SBVWriter(object):
+    header = ""
+
+    def cue(self, index, start, end, text):
+        return "%02d:%02d:%02d.%03d,%02d:%02d:%02d.%03d\n%s\n\n" % (
+            split_timecode(start) + split_timecode(end) + (text,))
+
+
+class SRTWriter(object):
+    header = ""
+
+    def cue(self, index, start, end, text):
+        return "%d\n%02d:%02d:%02d,%03d --> %02d:%02d:%02d,%03d\n%s\n\n" % (
+            (index,) + split_timecode(start) + split_timecode(end) + (text,))
+
+
+class WebVTTWriter(object):
+    header = "WEBVTT\n\n"
+
+    def cue(self, index, start, end, text):
+        return "%02d:%02d:%02d.%03d --> %02d:%02d:%02d.%03d\n%s\n\n" % (
+            split_timecode(start) + split_timecode(end) + (text,))
+
+
+WRITERS = {
+    "sbv": SBVWriter,
+    "srt": SRTWriter,
+    "vtt": WebVTTWriter,
+}
+
+
+def write_subtitles(transcript, destinations):
+    """ Write the transcript's subtitles in every format at once.
+    destinations maps a format name in WRITERS to the path to write.
+    """
+    outputs = []
+    try:
+        for fmt, path in destinations.items():
+            file = open(path, "w", encoding='utf-8')
+            writer = WRITERS[fmt]()
+            file.write(writer.header)
+            outputs.append((writer, file))
+
+        for index, (start, end, text) in enumerate(cues(transcript), 1):
+            for writer, file in outputs:
+                file.write(writer.cue(index, start, end, text))
+    finally:
+        for _, file in outputs:
+            file.close()
+
+
+def build_subtitles(transcript, id, directory="build"):
+    path = os.path.join(directory, str(id))
+    os.makedirs(directory, exist_ok=True)
+    # The SBV file is what gets uploaded, the others are kept alongside it
+    write_subtitles(transcript, {
+        "sbv": path + ".txt",
+        "srt": path + ".srt",
+        "vtt": path + ".vtt",
+    })
+    return path + ".txt"
@@ -0,0 +1,86 @@
+import random
+import subprocess
+import numpy as np
+from PIL import Image
+from .planner import VIDEO_SIZE
+
+""" Thumbnails are taken from the planned source clips rather than the
+finished video. Several candidate frames are decoded by one ffmpeg process,
+scored for sharpness and contrast, and the best is kept.
+"""
+
+THUMBNAIL_CANDIDATES = 8
+
+# Clips shorter than this are more likely to be mid-cut, so are passed over
+MIN_CANDIDATE_DURATION = 0.5
+
+
+def candidate_points(plan, count=THUMBNAIL_CANDIDATES, start=5, end_margin=15,
+                     rand=None):
+    """ Choose up to 'count' (source, time) pairs from the clips that play
+    between 'start' and 'end_margin' seconds before the end of the video.
+    The choices are made by 'rand', by default a random.Random seeded with
+    the plan's seed.
+    """
+    rand = rand or random.Random(plan.get("seed"))
+    end = plan["duration"] - end_margin
+    clips = [clip for clip in plan["clips"]
+             if clip["out"] - clip["in"] >= MIN_CANDIDATE_DURATION]
+    in_range = [clip for clip in clips if start <= clip["start"] < end]
+    clips = in_range or clips
+
+    chosen = rand.sample(clips, min(count, len(clips)))
+    # Away from either end of the clip, where the cuts are
+    return [(clip["source"],
+             clip["in"] + (clip["out"] - clip["in"]) * rand.uniform(0.25, 0.75))
+            for clip in chosen]
+
+
+def extract_frames(points, size=VIDEO_SIZE):
+    """ Decode one frame at each (source, time), returned as an array of
+    RGB frames of the given size
+    """
+    width, height = size
+    command = ["ffmpeg", "-v", "error"]
+    branches = []
+    for i, (source, time) in enumerate(points):
+        command += ["-ss", "{:.3f}".format(time), "-i", source]
+        branches.append("[{}:v]trim=end_frame=1,setpts=PTS-STARTPTS,"
+                        "scale={}:{},setsar=1,format=rgb24[f{}]".format(
+                            i, width, height, i))
+
+    graph = ";".join(branches) + ";" + \
+        "".join("[f{}]".format(i) for i in range(len(points))) + \
+        "concat=n={}:v=1:a=0[out]".format(len(points))
+    # Without -vsync 0 frames this close together would be dropped
+    command += ["-filter_complex", graph, "-map", "[out]", "-vsync", "0",
+                "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+
+    data = subprocess.check_output(command)
+    return np.frombuffer(data, np.uint8).reshape(-1, height, width, 3)
+
+
+def score_frames(frames):
+    """ Higher is better: the variance of the Laplacian (sharpness) plus the
+    standard deviation of the luma (contrast), each relative to the best
+    of the candidates. Measured at half resolution, which is plenty to tell
+    a blurred frame from a sharp one.
+    """
+    rgb = frames[:, ::2, ::2].astype(np.float32)
+    gray = rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114
+
+    laplacian = gray[:, :-2, 1:-1] + gray[:, 2:, 1:-1] + \
+        gray[:, 1:-1, :-2] + gray[:, 1:-1, 2:] - 4 * gray[:, 1:-1, 1:-1]
+    sharpness = laplacian.reshape(len(frames), -1).var(axis=1)
+    contrast = gray.reshape(len(frames), -1).std(axis=1)
+
+    return sharpness / max(sharpness.max(), 1e-6) + \
+        contrast / max(contrast.max(), 1e-6)
+
+
+def write_thumbnail(plan, path, count=THUMBNAIL_CANDIDATES, rand=None):
+    points = candidate_points(plan, count, rand=rand)
+    frames = extract_frames(points, tuple(plan["size"]))
+    scores = score_frames(frames)
+    Image.fromarray(frames[int(np.argmax(scores))]).save(path)
+    return points[int(np.argmax(scores))]
@@ -0,0 +1,87 @@
+import numpy as np
+from bisect import bisect_right
+from moviepy.audio.AudioClip import CompositeAudioClip
+from moviepy.video.VideoClip import VideoClip
+
+""" moviepy's concatenate(method="compose") builds a CompositeVideoClip,
+which tests every one of its clips on every frame to see which are
+playing. Over the hundreds of clips in a long argument that makes the cost
+of a frame grow with the length of the video. A TimelineClip keeps its
+clips sorted by start time and finds the ones playing with a bisect.
+"""
+
+
+class TimelineClip(VideoClip):
+    """ Plays each clip from its start time, on a black background of the
+    given size. Where clips overlap, later ones are drawn over earlier
+    ones, as in a CompositeVideoClip.
+    """
+
+    def __init__(self, clips, size):
+        VideoClip.__init__(self)
+        self.clips = sorted(clips, key=lambda clip: clip.start)
+        self.size = size
+        self.starts = [clip.start for clip in self.clips]
+
+        # The latest end of any clip up to and including each index. Since
+        # it never decreases, the search for playing clips can stop at the
+        # first one that ends too soon.
+        self.max_ends = []
+        max_end = 0
+        for clip in self.clips:
+            max_end = max(max_end, clip.end)
+            self.max_ends.append(max_end)
+
+        self.duration = self.end = max_end
+        self.background = None
+
+        fpss = [clip.fps for clip in self.clips
+                if getattr(clip, 'fps', None) is not None]
+        self.fps = max(fpss) if fpss else None
+
+        audio = [clip.audio.set_start(clip.start) for clip in self.clips
+                 if clip.audio is not None]
+        if audio:
+            self.audio = CompositeAudioClip(audio)
+
+        self.make_frame = self.frame_at
+
+    def playing(self, t):
+        """ The clips playing at time t, in the order they are drawn """
+        i = bisect_right(self.starts, t) - 1
+        found = []
+        while i >= 0 and self.max_ends[i] > t:
+            if self.clips[i].end > t:
+                found.append(self.clips[i])
+            i -= 1
+        found.reverse()
+        return found
+
+    def frame_at(self, t):
+        playing = self.playing(t)
+
+        # A lone opaque clip covering the whole frame would simply replace
+        # the background
+        if len(playing) == 1 and playing[0].mask is None and \
+                tuple(playing[0].size) == tuple(self.size):
+            return playing[0].get_frame(t - playing[0].start)
+
+        if self.background is None:
+            width, height = self.size
+            self.background = np.zeros((height, width, 3), dtype=np.uint8)
+        frame = self.background
+        for clip in playing:
+            frame = clip.blit_on(frame, t)
+        return frame
+
+
+def sequence(clips, size):
+    """ Play clips one after another, centered, like moviepy's
+    concatenate(clips, method="compose")
+    """
+    placed = []
+    start = 0
+    for clip in clips:
+        placed.append(clip.set_start(start).set_position("center"))
+        start += clip.duration
+    return TimelineClip(placed, size)
@@ -0,0 +1,128 @@
+from array import array
+
+""" A compact, indexed view of an Oyez transcript. The raw JSON is walked once
+and each section's turns become parallel arrays of start, stop and duration
+times and speaker numbers, so the planner never re-parses a turn or scans the
+case for speaker details.
+"""
+
+RECENT_SPEAKER_THRESHOLD = 6
+
+# The speaker number used for turns with no speaker
+NO_SPEAKER = -1
+
+
+class SpeakerIndex(object):
+    """ Maps a speaker ID to their (name, description) as shown in the
+    speaker's introduction. Advocates take precedence over justices, as in
+    the original lookup.
+    """
+
+    def __init__(self, case):
+        self.info = {}
+        if case["advocates"] is None:
+            return
+        for advocate in case["advocates"]:
+            if advocate["advocate"] is None:
+                continue
+            self.info.setdefault(advocate["advocate"]["ID"],
+                                 (advocate["advocate"]["name"],
+                                  advocate["advocate_description"]))
+
+        if case["heard_by"] is None:
+            return
+
+        for court in case["heard_by"]:
+            for justice in court["members"]:
+                self.info.setdefault(justice["ID"],
+                                     (justice["name"],
+                                      justice["roles"][0]["role_title"]))
+
+    def get(self, speaker_id):
+        return self.info.get(speaker_id)
+
+
+class Section(object):
+    def __init__(self, turns, speaker_numbers):
+        self.starts = array('d')
+        self.stops = array('d')
+        self.durations = array('d')
+        self.speakers = array('l')
+        self.speaker_ids = array('l')
+
+        for turn in turns:
+            start = float(turn["start"])
+            stop = float(turn["stop"])
+            self.starts.append(start)
+            self.stops.append(stop)
+            self.durations.append(stop - start)
+
+            speaker = turn["speaker"]
+            if speaker:
+                self.speakers.append(speaker_numbers(speaker))
+                self.speaker_ids.append(speaker["ID"])
+            else:
+                self.speakers.append(NO_SPEAKER)
+                self.speaker_ids.append(NO_SPEAKER)
+
+    def __len__(self):
+        return len(self.starts)
+
+
+class Transcript(object):
+    """ Turns are grouped by section as in the JSON. Speakers are numbered
+    by name in order of appearance; 'names' and 'roles' give the name and
+    roles recorded for each number.
+    """
+
+    def __init__(self, transcript):
+        self.names = []
+        self.roles = []
+        self.numbers = {}
+        self.sections = [Section(section["turns"], self.speaker_number)
+                         for section in transcript["sections"]]
+
+    def speaker_number(self, speaker):
+        number = self.numbers.get(speaker["name"])
+        if number is None:
+            number = len(self.names)
+            self.numbers[speaker["name"]] = number
+            self.names.append(speaker["name"])
+            self.roles.append(speaker["roles"])
+        return number
+
+    def name(self, number):
+        if number == NO_SPEAKER:
+            return None
+        return self.names[number]
+
+
+class RecentSpeakers(object):
+    """ The set of speakers in a sliding window over a section's turns.
+    Moving the window forward only adds and removes the turns that enter and
+    leave it.
+    """
+
+    def __init__(self, speakers, size=RECENT_SPEAKER_THRESHOLD):
+        self.speakers = speakers
+        self.size = size
+        self.counts = {}
+        self.begin = 0
+        self.end = 0
+
+    def advance(self, end):
+        """ Move the window so it holds the turns up to, but not including,
+        end
+        """
+        while self.end < end:
+            speaker = self.speakers[self.end]
+            self.counts[speaker] = self.counts.get(speaker, 0) + 1
+            self.end += 1
+
+        while self.end - self.begin > self.size:
+            speaker = self.speakers[self.begin]
+            self.counts[speaker] -= 1
+            self.begin += 1
+
+    def __contains__(self, speaker):
+        return self.counts.get(speaker, 0) > 0
@@ -2,18 +2,25 @@
 
 import http.client
 import httplib2
+import hashlib
+import json
 import os
 import random
 import sys
+import queue
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from apiclient.discovery import build
 from apiclient.errors import HttpError
-from apiclient.http import MediaFileUpload
+from apiclient.http import MediaFileUpload, build_http
 from oauth2client.client import flow_from_clientsecrets
 from oauth2client.file import Storage
 from oauth2client.tools import argparser, run_flow
 
+from . import metrics
+
 
 # Explicitly tell the underlying HTTP transport library not to retry, since
 # we are handling retry logic ourselves.
@@ -22,6 +29,21 @@ httplib2.RETRIES = 1
 # Maximum number of times to retry before giving up.
 MAX_RETRIES = 10
 
+# Bytes sent per request of a resumable upload. Must be a multiple of 256KiB.
+# Progress is saved after every chunk, so this is also the most that is sent
+# again after a crash.
+DEFAULT_CHUNKSIZE = 16 * 1024 * 1024
+
+# Where the state of unfinished uploads is kept, so they can be resumed
+UPLOAD_STATE_DIR = "cache/uploads"
+
+# How many videos an UploadQueue uploads at once
+MAX_CONCURRENT_UPLOADS = 2
+
+# The limit on YouTube API requests (each chunk of an upload is one) across
+# every upload in the process
+API_CALLS_PER_SECOND = 2
+
 # Always retry when these exceptions are raised.
 RETRIABLE_EXCEPTIONS = (httplib2.HttpLib2Error, IOError, http.client.NotConnected,
                         http.client.IncompleteRead, http.client.ImproperConnectionState,
@@ -30,7 +52,7 @@ RETRIABLE_EXCEPTIONS = (httplib2.HttpLib2Error, IOError, http.client.NotConnecte
 
 # Always retry when an apiclient.errors.HttpError with one of these status
 # codes is raised.
-RETRIABLE_STATUS_CODES = [500, 502, 503, 504]
+RETRIABLE_STATUS_CODES = [429, 500, 502, 503, 504]
 
 # The CLIENT_SECRETS_FILE variable specifies the name of a file that contains
 # the OAuth 2.0 information for this application, including its client_id and
@@ -71,7 +93,7 @@ https://developers.google.com/api-client-library/python/guide/aaa_client_secrets
 VALID_PRIVACY_STATUSES = ("public", "private", "unlisted")
 
 
-def get_authenticated_service(args):
+def get_credentials(args):
     flow = flow_from_clientsecrets(CLIENT_SECRETS_FILE,
     scope=YOUTUBE_UPLOAD_SCOPE,
     message=MISSING_CLIENT_SECRETS_MESSAGE)
@@ -81,12 +103,183 @@ def get_authenticated_service(args):
 
     if credentials is None or credentials.invalid:
         credentials = run_flow(flow, storage, args)
-
-    return build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION,
-                 http=credentials.authorize(httplib2.Http()))
+    return credentials
 
 
-def initialize_upload(youtube, options):
+def get_authenticated_service(args):
+    credentials = get_credentials(args)
+    return build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION,
+                 http=credentials.authorize(build_http()))
+
+
+class TokenBucket(object):
+    """ Allows 'rate' units per second on average, in bursts of up to
+    'capacity'. Taking more than is available borrows against the future,
+    so one large chunk waits for its share rather than forever.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount=1):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class RateLimiter(object):
+    """ Token buckets for API calls and, optionally, upload bandwidth
+    """
+
+    def __init__(self, calls_per_second=API_CALLS_PER_SECOND,
+                 bytes_per_second=None):
+        self.calls = TokenBucket(calls_per_second)
+        self.bytes = None
+        if bytes_per_second:
+            self.bytes = TokenBucket(bytes_per_second)
+
+    def call(self, size=0):
+        self.calls.take()
+        if self.bytes is not None and size > 0:
+            self.bytes.take(size)
+
+
+class Backoff(object):
+    """ Exponential backoff that can be shared between uploads. A retriable
+    error in any of them holds them all off, since its cause (quota, the
+    network) is usually shared too; a success resets the delay. Each upload
+    counts its own errors in a row, so one that keeps failing gives up even
+    while others succeed.
+    """
+
+    def __init__(self, max_retries=MAX_RETRIES):
+        self.max_retries = max_retries
+        self.failures = 0
+        self.resume_at = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def failure(self, attempts):
+        """ Record an error in an upload that has now failed 'attempts'
+        times in a row, returning False once that's too many to keep trying
+        """
+        with self.lock:
+            if attempts > self.max_retries:
+                return False
+            self.failures = min(self.failures + 1, self.max_retries)
+            max_sleep = 2 ** self.failures
+            sleep_seconds = random.random() * max_sleep
+            print(("Sleeping %f seconds and then retrying..." % sleep_seconds))
+            self.resume_at = max(self.resume_at,
+                                 time.monotonic() + sleep_seconds)
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+
+
+class UploadSession(object):
+    """ The on-disk record of one video's upload: the resumable session URI
+    and how much has been sent, then the video ID once the insert is done
+    and which of the follow up calls have completed. Keyed by the video's
+    path, size and mtime, so a re-rendered file starts a new session.
+    """
+
+    def __init__(self, video_path, state_dir=UPLOAD_STATE_DIR):
+        stat = os.stat(video_path)
+        key = "{}:{}:{}".format(os.path.abspath(video_path), stat.st_size,
+                                stat.st_mtime)
+        self.path = os.path.join(state_dir,
+                                 hashlib.sha256(key.encode('utf-8')).hexdigest()
+                                 + ".json")
+        self.lock = threading.Lock()
+        self.state = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding='utf-8') as file:
+                    self.state = json.load(file)
+            except ValueError:
+                pass
+
+    def get(self, key):
+        with self.lock:
+            return self.state.get(key)
+
+    def update(self, **values):
+        with self.lock:
+            self.state.update(values)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding='utf-8') as file:
+                json.dump(self.state, file)
+            os.replace(tmp, self.path)
+
+    def restore(self, request, http):
+        """ Point a new insert request at the saved session, after asking
+        the server over 'http' how much of the video it already has.
+        Returns the insert's response if the server has all of it, and
+        otherwise None. A session the server no longer knows is dropped, and
+        the upload starts again from the beginning.
+        """
+        uri = self.get("uri")
+        if uri is None:
+            return None
+
+        # The status query of the resumable upload protocol: an empty PUT
+        # that the server answers with the range of bytes it has
+        size = request.resumable.size()
+        response, content = http.request(uri, "PUT", headers={
+            "Content-Range": "bytes */%d" % size, "Content-Length": "0"})
+        if response.status in (200, 201):
+            print("Upload session had already finished")
+            return json.loads(content.decode('utf-8'))
+        if response.status != 308:
+            print("Upload session is gone (HTTP %d), starting again"
+                  % response.status)
+            self.update(uri=None, progress=None)
+            return None
+
+        progress = 0
+        if "range" in response:
+            progress = int(response["range"].rsplit("-", 1)[1]) + 1
+        print("Resuming upload session from byte %d" % progress)
+        request.resumable_uri = uri
+        request.resumable_progress = progress
+        return None
+
+    def save_progress(self, request):
+        if request.resumable_uri is not None:
+            self.update(uri=request.resumable_uri,
+                        progress=request.resumable_progress)
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def initialize_upload(youtube, options, chunksize=-1, session=None,
+                      http_factory=None, limiter=None, backoff=None):
+    """ Upload the video, then its captions and thumbnail. With a session,
+    progress is saved as it goes and any earlier progress is picked up.
+    http_factory gives each concurrent call its own HTTP transport; without
+    one the calls run one after another on the service's own.
+    """
     tags = None
     if options.keywords:
         tags = options.keywords.split(",")
@@ -103,26 +296,33 @@ def initialize_upload(youtube, options):
         )
     )
 
-    # Call the API's videos.insert method to create and upload the video.
-    insert_request = youtube.videos().insert(
-        part=",".join(list(body.keys())),
-        body=body,
-        # The chunksize parameter specifies the size of each chunk of data, in
-        # bytes, that will be uploaded at a time. Set a higher value for
-        # reliable connections as fewer chunks lead to faster uploads. Set a lower
-        # value for better recovery on less reliable connections.
-        #
-        # Setting "chunksize" equal to -1 in the code below means that the entire
-        # file will be uploaded in a single HTTP request. (If the upload fails,
-        # it will still be retried where it left off.) This is usually a best
-        # practice, but if you're using Python older than 2.6 or if you're
-        # running on App Engine, you should set the chunksize to something like
-        # 1024 * 1024 (1 megabyte).
-        media_body=MediaFileUpload(options.file, chunksize=-1, resumable=True)
-    )
-
-    response = resumable_upload(insert_request)
-    id = response["id"]
+    id = session.get("video_id") if session else None
+    if id is None:
+        # Call the API's videos.insert method to create and upload the video.
+        insert_request = youtube.videos().insert(
+            part=",".join(list(body.keys())),
+            body=body,
+            # The chunksize parameter specifies the size of each chunk of
+            # data, in bytes, that will be uploaded at a time. Setting
+            # "chunksize" equal to -1 means that the entire file will be
+            # uploaded in a single HTTP request, leaving nothing to resume
+            # from if the process dies part way through.
+            media_body=MediaFileUpload(options.file, chunksize=chunksize,
+                                       resumable=True)
+        )
+        http = http_factory() if http_factory else None
+        response = None
+        if session:
+            response = session.restore(insert_request,
+                                       http or insert_request.http)
+        if response is None:
+            response = resumable_upload(insert_request, session, http,
+                                        limiter, backoff)
+        id = response["id"]
+        if session:
+            session.update(video_id=id)
+    else:
+        print("Video id '%s' was already uploaded." % id)
 
     body = dict(
         snippet=dict(
@@ -133,27 +333,70 @@ def initialize_upload(youtube, options):
         )
     )
 
-    youtube.captions().insert(
-        part=",".join(list(body.keys())),
-        body=body,
-        media_body=options.caption
-    ).execute()
+    calls = {}
+    if options.caption:
+        calls["caption"] = youtube.captions().insert(
+            part=",".join(list(body.keys())),
+            body=body,
+            media_body=options.caption
+        )
+    if options.thumbnail:
+        calls["thumbnail"] = youtube.thumbnails().set(
+            videoId=id,
+            media_body=options.thumbnail
+        )
+
+    def execute(name):
+        if session and session.get(name):
+            return
+        if limiter:
+            limiter.call()
+        calls[name].execute(http=http_factory() if http_factory else None)
+        if session:
+            session.update(**{name: True})
+
+    # Captions and thumbnail only need the video ID, so they go at once
+    with ThreadPoolExecutor(len(calls) if http_factory and calls else 1) as pool:
+        for future in [pool.submit(execute, name) for name in calls]:
+            future.result()
+
+    if session:
+        session.finish()
+    return id
 
-    youtube.thumbnails().set(
-        videoId=id,
-        media_body=options.thumbnail
-    ).execute()
+
+def chunk_size(insert_request):
+    """ The number of bytes the next call to next_chunk will send
+    """
+    media = insert_request.resumable
+    remaining = media.size() - insert_request.resumable_progress
+    if media.chunksize() == -1:
+        return remaining
+    return min(media.chunksize(), remaining)
 
 
 # This method implements an exponential backoff strategy to resume a
 # failed upload.
-def resumable_upload(insert_request):
+def resumable_upload(insert_request, session=None, http=None, limiter=None,
+                     backoff=None):
+    backoff = backoff or Backoff()
+    # Errors in a row in this upload, whatever the others sharing the
+    # backoff are doing
+    attempts = 0
     response = None
-    error = None
-    retry = 0
     while response is None:
+        error = None
+        backoff.wait()
         try:
-            status, response = insert_request.next_chunk()
+            size = chunk_size(insert_request)
+            if limiter:
+                limiter.call(size)
+            status, response = insert_request.next_chunk(http=http)
+            backoff.success()
+            attempts = 0
+            metrics.count("bytes_total", size, direction="upload")
+            if session:
+                session.save_progress(insert_request)
             if response is not None:
                 if 'id' in response:
                     print(("Video id '%s' was successfully uploaded." % response['id']))
@@ -170,18 +413,13 @@ def resumable_upload(insert_request):
 
         if error is not None:
             print(error)
-            retry += 1
-            if retry > MAX_RETRIES:
+            attempts += 1
+            if not backoff.failure(attempts):
                 exit("No longer attempting to retry.")
-
-            max_sleep = 2 ** retry
-            sleep_seconds = random.random() * max_sleep
-            print(("Sleeping %f seconds and then retrying..." % sleep_seconds))
-            time.sleep(sleep_seconds)
     return response
 
 # Module scope so we only run this once
-argparser.add_argument("--file", required=True, help="Video file to upload")
+argparser.add_argument("--file", help="Video file to upload")
 argparser.add_argument("--caption", help="Captions for video")
 argparser.add_argument("--title", help="Video title", default="Test Title")
 argparser.add_argument("--thumbnail", help="Add a thumbnail")
@@ -196,14 +434,109 @@ argparser.add_argument("--privacyStatus", choices=VALID_PRIVACY_STATUSES,
                        default=VALID_PRIVACY_STATUSES[0], help="Video privacy status.")
 
 
-def upload_video(title, video_path, caption_path, keywords,
-                 description, thumbnail, public=False):
+class Uploader(object):
+    """ An authenticated YouTube client that lives for the whole run, so
+    the credentials, discovery client and connections are set up once
+    rather than for every video. Each thread gets its own authorized
+    transport, since httplib2 connections can't be shared between threads.
+    """
+
+    def __init__(self, chunksize=DEFAULT_CHUNKSIZE, state_dir=UPLOAD_STATE_DIR,
+                 credentials=None, youtube=None, limiter=None, backoff=None):
+        self.chunksize = chunksize
+        self.state_dir = state_dir
+        self.limiter = limiter or RateLimiter()
+        self.backoff = backoff or Backoff()
+        self.local = threading.local()
+        if credentials is None and youtube is None:
+            credentials = get_credentials(argparser.parse_args([]))
+        self.credentials = credentials
+        if youtube is None:
+            youtube = build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION,
+                            http=self.http())
+        self.youtube = youtube
+
+    def http(self):
+        """ The calling thread's transport, kept for the thread's lifetime
+        """
+        if not hasattr(self.local, "http"):
+            # build_http, unlike a bare httplib2.Http, does not follow the
+            # 308 responses of an unfinished resumable upload
+            http = build_http()
+            if self.credentials is not None:
+                http = self.credentials.authorize(http)
+            self.local.http = http
+        return self.local.http
+
+    def upload(self, options, chunksize=None):
+        session = UploadSession(options.file, self.state_dir)
+        with metrics.span("upload", file=options.file) as span:
+            span["bytes"] = os.path.getsize(options.file)
+            return initialize_upload(self.youtube, options,
+                                     chunksize or self.chunksize,
+                                     session, self.http, self.limiter,
+                                     self.backoff)
+
+
+class UploadQueue(object):
+    """ Uploads videos on 'workers' threads through one Uploader, so they
+    share its credentials, rate limits and backoff. 'done' is called with
+    the tag and video ID of each upload that finishes, and 'failed' with
+    the tag of each that doesn't.
+    """
+
+    def __init__(self, uploader, workers=MAX_CONCURRENT_UPLOADS, done=None,
+                 failed=None):
+        self.uploader = uploader
+        self.done = done
+        self.failed = failed
+        # Bounded, so whatever is producing videos waits for uploads to
+        # catch up rather than filling the disk
+        self.pending = queue.Queue(workers)
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.work,
+                                      name="upload-{}".format(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            options, tag = item
+            try:
+                id = self.uploader.upload(options)
+            except (Exception, SystemExit) as e:
+                print("Upload of %s failed: %s" % (options.file, e))
+                if self.failed is not None:
+                    self.failed(tag)
+                continue
+            if self.done is not None:
+                self.done(tag, id)
+
+    def submit(self, options, tag=None):
+        self.pending.put((options, tag))
+
+    def close(self):
+        """ Wait for every queued upload to finish
+        """
+        for _ in self.threads:
+            self.pending.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+def video_options(title, video_path, caption_path, keywords,
+                  description, thumbnail, public=False):
     if public:
         priv_status = "public"
     else:
         priv_status = "private"
 
-    args = argparser.parse_args([
+    return argparser.parse_args([
         "--file", video_path,
         "--caption", caption_path,
         "--title", title,
@@ -213,11 +546,28 @@ def upload_video(title, video_path, caption_path, keywords,
         "--privacyStatus", priv_status
     ])
 
+
+_uploader = None
+
+
+def default_uploader():
+    global _uploader
+    if _uploader is None:
+        _uploader = Uploader()
+    return _uploader
+
+
+def upload_video(title, video_path, caption_path, keywords,
+                 description, thumbnail, public=False, uploader=None,
+                 chunksize=None):
+    args = video_options(title, video_path, caption_path, keywords,
+                         description, thumbnail, public)
+
     if not os.path.exists(args.file):
         exit("Please specify a valid file using the --file= parameter.")
 
-    youtube = get_authenticated_service(args)
+    uploader = uploader or default_uploader()
     try:
-        initialize_upload(youtube, args)
+        uploader.upload(args, chunksize)
     except HttpError as e:
         print(("An HTTP error %d occurred:\n%s" % (e.resp.status, e.content)))
@@ -2,54 +2,302 @@
 USAGE:
   puppyjustice -h | --help
   puppyjustice --version
-  puppyjustice
-  puppyjustice <title> <case> <transcript>
+  puppyjustice [options]
+  puppyjustice [options] <title> <case> <transcript>
+  puppyjustice [options] plan <title> <case> <transcript> <output>
+  puppyjustice [options] render <plan> <audio> <output>
+  puppyjustice [options] prepare-resources
+  puppyjustice [options] upload <directory>
+  puppyjustice [options] queue
+  puppyjustice [options] batch
+  puppyjustice [options] import-handled <file>
+
+OPTIONS:
+  --max-readers=<n>  Maximum number of resource clips open at once [default: 16]
+  --backend=<name>   Render with 'moviepy' or 'ffmpeg' [default: moviepy]
+  --workers=<n>      Render segments of the video in parallel [default: 1]
+  --gop=<n>          Keyframe interval of prepared resources [default: 15]
+  --offline          Serve Oyez requests from the cache only
+  --chunk-size=<mb>  Size of each request of a resumable upload [default: 16]
+  --uploads=<n>      Number of videos to upload at once [default: 2]
+  --upload-rate=<mb> Upload bandwidth limit in MiB/s, 0 for none [default: 0]
+  --profile-frames   Log where moviepy's time per frame goes
+  --segment-cache=<gb>  Keep each rendered turn for reuse by later runs, in
+                     up to this many GiB, 0 to disable. When enabled it
+                     takes precedence: videos are rendered a turn at a time
+                     by the given number of workers and the audio is muxed
+                     in, as with --mux-audio (unless --profile-frames)
+                     [default: 0]
+  --frame-cache=<gb> Decode each resource clip once into a shared cache of
+                     raw frames of up to this many GiB, 0 to disable
+                     [default: 0]
+  --mux-audio        Render the video silent and mux the argument audio in
+                     with ffmpeg, copying it where the codec allows. Implied
+                     by --workers above 1 and by --segment-cache
+  --preview          Render quickly at reduced size and frame rate
+  --range=<range>    Render only part of the plan, as start-end in
+                     [[hours:]minutes:]seconds, e.g. 0-3:00
+  --jobs=<path>      Database of case and job state [default: jobs.sqlite]
 """
 
 import logging
 import random
 import re
 import os
-import glob
 import json
+import socket
+import tempfile
 from docopt import docopt
 
-from puppyjustice import downloader, builder, uploader
+# builder and preview load moviepy, which takes half a second, so they are
+# only imported where a video is rendered with it
+from puppyjustice import (downloader, uploader, planner, renderer, catalog,
+                          segments, segment_cache, frame_cache, mezzanine,
+                          pipeline, jobstore, thumbnail, metrics, subtitles)
 
-
-def build_video_and_upload_case(title, sub_title, case, description,
-                                media_json, resources):
-    logging.info("  Downloading audio".format(title))
-    audio = downloader.download_audio(media_json)
-    if audio is None:
+""" The list of handled case IDs kept by earlier versions, imported into a
+new job store
+"""
+HANDLED_CASES_PATH = "handled_cases.txt"
+
+
+def render_video(plan, resources, audio_path, output, backend="moviepy",
+                 workers=1, profile=False, cache=None, frames=None,
+                 mux=False, max_open=catalog.MAX_OPEN_READERS):
+    """ Render a plan a turn at a time through the segment cache if there is
+    one, otherwise in segments for several workers, otherwise in this
+    process. The first two always mux the audio in.
+    """
+    if cache is not None and not profile:
+        segments.render_cached(plan, audio_path, output, workers,
+                               backend, cache, frames, max_open)
+    elif workers > 1:
+        segments.render_segmented(plan, audio_path, output, workers,
+                                  backend, frames, max_open)
+    elif mux:
+        with tempfile.TemporaryDirectory(prefix="puppyjustice") as workdir:
+            silent = os.path.join(workdir, "silent.mp4")
+            write_video(plan, resources, None, silent, backend, profile)
+            renderer.mux_audio(["-i", silent], audio_path,
+                               plan["audio_offset"], plan["duration"], output)
+    else:
+        write_video(plan, resources, audio_path, output, backend, profile)
+
+
+def write_video(plan, resources, audio_path, output, backend="moviepy",
+                profile=False):
+    """ Render a plan in this process, silently if audio_path is None """
+    if backend == "ffmpeg":
+        renderer.render_plan(plan, audio_path, output)
+        return
+
+    from moviepy.editor import VideoFileClip
+    from puppyjustice import builder
+    audio = None if audio_path is None else VideoFileClip(audio_path)
+    try:
+        video = builder.render_plan(plan, resources, audio)
+        if not profile:
+            video.write_videofile(output, audio=audio is not None)
+            return
+
+        profiler = metrics.FrameProfiler()
+        profiler.attach(video)
+        profiler.enable()
+        try:
+            video.write_videofile(output, audio=audio is not None)
+        finally:
+            profiler.disable()
+        logging.info("Frame time for {}:".format(output))
+        profiler.report(metrics.default_metrics())
+    finally:
+        if audio is not None:
+            audio.close()
+
+
+def fetch_stage(job):
+    logging.info("  Downloading audio for {}".format(job.id))
+    with metrics.span("audio_download", job=job.id):
+        job.audio = downloader.download_audio(job.media_json)
+    if job.audio is None:
       logging.warning("  Audio download failed. Skipping")
+      job.skipped = True
       return
 
-    id = media_json["id"]
-    transcript = media_json["transcript"]
-
     logging.info("  Building subtitles")
-    subtitle_location = builder.build_subtitles(transcript, id)
+    with metrics.span("subtitles", job=job.id):
+        job.subtitles = subtitles.build_subtitles(job.media_json["transcript"],
+                                                  job.id, job.directory)
+
+
+def plan_stage(job, resources):
+    # A retried job keeps the plan of its first attempt, so that the turns
+    # it already rendered are found in the segment cache
+    path = job.path("plan.json")
+    if os.path.exists(path):
+        logging.info("  Reusing plan {}".format(path))
+        job.plan = planner.load_plan(path)
+        return
+
+    # Each job gets a seed of its own, so that its plan and thumbnail can be
+    # reproduced however the jobs running alongside it are interleaved
+    seed = random.randrange(2 ** 32)
+    logging.info("  Planning video with seed {}".format(seed))
+    with metrics.span("planning", job=job.id) as span:
+        job.plan = planner.plan_video(job.title, job.case, resources,
+                                      job.media_json["transcript"],
+                                      seed=seed)
+        span["clips"] = len(job.plan["clips"])
+    planner.save_plan(job.plan, path)
+
+
+def render_stage(job, resources, backend="moviepy", workers=1, profile=False,
+                 cache=None, frames=None, mux=False,
+                 max_open=catalog.MAX_OPEN_READERS):
+    logging.info("  Writing video to {} with {}".format(job.video, backend))
+    with metrics.span("encode", job=job.id, backend=backend) as span:
+        render_video(job.plan, resources, job.audio, job.video, backend,
+                     workers, profile, cache, frames, mux, max_open)
+    frames = job.plan["duration"] * renderer.FPS
+    metrics.gauge("encode_fps", frames / span["seconds"], backend=backend)
+    metrics.record_peak_memory(metrics.default_metrics())
+
+    with metrics.span("thumbnail", job=job.id):
+        thumbnail.write_thumbnail(job.plan, job.thumbnail)
+
+
+KEYWORDS = ["puppyjustice", "scotus", "yt:cc=on", "RealAnimalsFakePaws"]
+
+
+def upload_stage(job, chunksize=None):
+    logging.info("  Uploading video")
+    # Straight to the Uploader rather than upload_video, which only prints
+    # HTTP errors, so that a failed upload fails the stage
+    video_id = uploader.default_uploader().upload(upload_options(job),
+                                                  chunksize)
+    logging.info("  Uploading complete: {}".format(video_id))
 
-    logging.info("  Building video")
-    video = builder.build_video(title, case, resources, transcript, audio)
 
-    logging.info("  Writing video to build/{}.mp4".format(id))
-    video.write_videofile("build/{}.mp4".format(id))
+def upload_options(job):
+    return uploader.video_options("{}: {}".format(job.title, job.sub_title),
+                                  job.video, job.subtitles, KEYWORDS,
+                                  job.description, job.thumbnail)
 
-    builder.write_random_frame("build/{}.mp4".format(id),
-                               5, video.duration - 15,
-                               "build/thumbnail.png")
 
-    logging.info("  Uploading video")
-    uploader.upload_video("{}: {}".format(title, sub_title),
-                          "build/{}.mp4".format(id),
-                          subtitle_location,
-                          ["puppyjustice", "scotus", "yt:cc=on",
-                           "RealAnimalsFakePaws"],
-                          description,
-                          "build/thumbnail.png")
-    logging.info("  Uploading complete")
+def video_stages(resources, backend="moviepy", workers=1, profile=False,
+                 cache=None, frames=None, mux=False,
+                 max_open=catalog.MAX_OPEN_READERS):
+    return [
+        ("fetch", fetch_stage),
+        ("plan", lambda job: plan_stage(job, resources)),
+        ("render", lambda job: render_stage(job, resources, backend, workers,
+                                            profile, cache, frames, mux,
+                                            max_open)),
+    ]
+
+
+def build_video_and_upload_case(title, sub_title, case, description,
+                                media_json, resources, backend="moviepy",
+                                workers=1, chunksize=None, cache=None):
+    job = pipeline.Job(case, title, sub_title, description, media_json)
+    stages = video_stages(resources, backend, workers, cache=cache)
+    stages.append(("upload", lambda job: upload_stage(job, chunksize)))
+    pipeline.run_stages(job, stages)
+    job.cleanup()
+
+
+def rendered_segment_cache(arguments):
+    """ The cache of rendered turns, or None if --segment-cache is 0 """
+    gigabytes = float(arguments["--segment-cache"])
+    if gigabytes <= 0:
+        return None
+    return segment_cache.SegmentCache(
+        max_bytes=int(gigabytes * 1024 * 1024 * 1024))
+
+
+def decoded_frame_cache(arguments):
+    """ The cache of decoded resource frames, or None if --frame-cache is 0
+    """
+    gigabytes = float(arguments["--frame-cache"])
+    if gigabytes <= 0:
+        return None
+    return frame_cache.FrameCache(
+        max_bytes=int(gigabytes * 1024 * 1024 * 1024))
+
+
+def run_batch(store, resources, arguments):
+    """ Claim jobs from the store and make them one at a time, until there
+    are none left. Any number of these may share a store.
+    """
+    worker = "{}:{}".format(socket.gethostname(), os.getpid())
+    chunksize = int(arguments["--chunk-size"]) * 1024 * 1024
+    stages = video_stages(resources, arguments["--backend"],
+                          int(arguments["--workers"]),
+                          arguments["--profile-frames"],
+                          rendered_segment_cache(arguments),
+                          decoded_frame_cache(arguments),
+                          arguments["--mux-audio"],
+                          int(arguments["--max-readers"]))
+    stages.append(("upload", lambda job: upload_stage(job, chunksize)))
+
+    while True:
+        job = store.claim(worker)
+        if job is None:
+            break
+        remaining = stages
+        if job.stage == "render" and os.path.exists(job.video):
+            # Rendered by an attempt that died before uploading
+            remaining = stages[-1:]
+        try:
+            pipeline.run_stages(job, remaining, store)
+        except (Exception, SystemExit):
+            # The build directory is kept for the next attempt
+            logging.exception("Job {} failed".format(job.id))
+            continue
+        store.release(job)
+        job.cleanup()
+    logging.info("No jobs left to claim: {}".format(store.counts()))
+
+
+def open_job_store(arguments):
+    """ The job store, with the cases from handled_cases.txt imported into
+    it if it is new
+    """
+    store = jobstore.JobStore(arguments["--jobs"])
+    if store.is_empty() and os.path.exists(HANDLED_CASES_PATH):
+        count = store.import_handled(HANDLED_CASES_PATH)
+        logging.info("Imported {} handled cases from {}".format(
+            count, HANDLED_CASES_PATH))
+    return store
+
+
+def upload_queue(arguments, progress, store=None):
+    """ An UploadQueue that records each case in 'progress' as its videos
+    finish uploading, and each job in 'store'
+    """
+    rate = float(arguments["--upload-rate"]) * 1024 * 1024
+    youtube = uploader.Uploader(
+        chunksize=int(arguments["--chunk-size"]) * 1024 * 1024,
+        limiter=uploader.RateLimiter(bytes_per_second=rate or None))
+
+    def done(job, video_id):
+        logging.info("Uploaded job {} as {}".format(job.id, video_id))
+        job.stage = "upload"
+        job.save()
+        if store is not None:
+            store.finish_stage(job, "upload")
+        job.cleanup()
+        progress.finish(job)
+
+    def failed(job):
+        logging.warning("Upload of job {} failed".format(job.id))
+        job.error = "upload failed"
+        job.save()
+        if store is not None:
+            store.fail(job, "upload", job.error)
+        progress.finish(job, failed=True)
+
+    return uploader.UploadQueue(youtube, int(arguments["--uploads"]),
+                                done, failed)
 
 
 def was_argued(case):
@@ -75,26 +323,33 @@ def recent_cases(start_year=2010, end_year=2017, excluding=None):
                "&labels=true&page=0&per_page=0")
         urls.append(url)
 
-    json = []
-    for url in urls:
-        json += downloader.download_json(url)
-
-    cases = [case for case in json if was_argued(case)]
+    # Only the argued cases of each term listing are kept, as they arrive
+    cases = []
+    for term in downloader.download_all_json(urls, keep=was_argued):
+        cases += term
     cases.sort(key=lambda x: date_argued(x))
 
-    for short_case in cases:
+    # Case and media JSON for the next few cases is fetched in the
+    # background while the current one is being rendered
+    remaining = [case for case in cases if case["ID"] not in excluding]
+    sync = downloader.SyncState()
+    for fetch in downloader.prefetch_cases(remaining, sync=sync):
+        short_case = fetch.short_case
         id = short_case["ID"]
-
-        if id in excluding:
-            continue
         logging.info("Reading JSON for case {} ({})".format(id, short_case["name"]))
 
-        case_json = downloader.download_json(short_case["href"])
+        case_json = fetch.case.result()
         if case_json["oral_argument_audio"] is None:
+            sync.mark(short_case)
+            sync.save()
             continue
 
-        for i, part in enumerate(case_json["oral_argument_audio"]):
-            media_json = downloader.download_json(part["href"])
+        media = list(fetch.media_json())
+        sync.mark(short_case)
+        sync.save()
+
+        for i, (part, media_json) in enumerate(zip(case_json["oral_argument_audio"],
+                                                   media)):
             oyez_link = short_case["href"].replace("api.oyez.org", "www.oyez.org")
             title = short_case["name"]
             sub_title = part["title"]
@@ -109,7 +364,7 @@ def can_handle_case(case):
     try:
         members = case["heard_by"][0]["members"]
         for member in members:
-            if member["name"] not in builder.JUSTICE_MAPPING.keys():
+            if member["name"] not in planner.JUSTICE_MAPPING.keys():
                 return False
         return True
     except:
@@ -124,39 +379,14 @@ def sanitize_text(text):
     return text
 
 
-if __name__ == "__main__":
-    arguments = docopt(__doc__, version='scotus-dogs-automated v0.1')
-
-    # Enable Logging
-    logging.basicConfig(filename='puppyjusticeautomated.log',
-                        level=logging.DEBUG)
-
-    seed = random.random()
-    logging.info("Random seed chosen as: {}".format(seed))
-
-    # For reproducible random choices
-    random.seed(seed)
-
-    with open("handled_cases.txt", "r+") as cases_file:
-        handled_cases = [int(id) for id in cases_file.readlines()]
-    cases_file = open("handled_cases.txt", "a")
-
-    resources = builder.generate_resource_mapping("resources")
-
-    if arguments["<case>"] and arguments["<transcript>"]:
-        case = json.load(open(arguments["<case>"]))
-        transcript = json.load(open(arguments["<transcript>"]))
-        title = arguments["<title>"]
-
-        build_video_and_upload_case(title, case, "description",
-                                    transcript, resources)
-        exit(0)
-
-
+def case_jobs(store, excluding):
+    """ Yields a pipeline.Job for each part of each recent case not in
+    'excluding', recording the cases that can't be made as skipped
+    """
     for case, title, sub_title, media_json, oyez_link, finished in recent_cases(
-            excluding=handled_cases):
+            excluding=excluding):
         if not can_handle_case(case) or media_json["transcript"] is None:
-            cases_file.write(str(case["ID"]) + "\n")
+            store.mark_case(case["ID"], "skipped")
             logging.info("Skipping case {}".format(case["ID"]))
             continue
 
@@ -176,7 +406,7 @@ if __name__ == "__main__":
 
         for i, section in enumerate(media_json["transcript"]["sections"]):
             start_time = float(section["start"]) * 1000
-            time = builder.milli_to_timecode(start_time, short=True)
+            time = subtitles.milli_to_timecode(start_time, short=True)
 
             description += "Section {}: {}\n".format(i+1, time)
 
@@ -194,11 +424,153 @@ if __name__ == "__main__":
         # Max youtube description length
         assert(len(description) < 5000)
 
-        build_video_and_upload_case(title, sub_title, case, description,
-                                    media_json, resources)
+        yield pipeline.Job(case, title, sub_title, description, media_json,
+                           finished)
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__, version='scotus-dogs-automated v0.1')
+
+    # Enable Logging
+    logging.basicConfig(filename='puppyjusticeautomated.log',
+                        level=logging.DEBUG)
+
+    seed = random.random()
+    logging.info("Random seed chosen as: {}".format(seed))
+
+    # For reproducible random choices
+    random.seed(seed)
+
+    if arguments["--offline"]:
+        downloader.set_offline()
+
+    if arguments["prepare-resources"]:
+        mezzanine.prepare_resources("resources", gop=int(arguments["--gop"]))
+        exit(0)
+
+    if arguments["plan"]:
+        resources = catalog.load_resources(
+            "resources", max_open=int(arguments["--max-readers"]))
+        case = json.load(open(arguments["<case>"]))
+        transcript = json.load(open(arguments["<transcript>"]))
+        plan = planner.plan_video(arguments["<title>"], case, resources,
+                                  transcript)
+        planner.save_plan(plan, arguments["<output>"])
+        exit(0)
+
+    if arguments["render"]:
+        plan = planner.load_plan(arguments["<plan>"])
+        audio = arguments["<audio>"]
+        frames = decoded_frame_cache(arguments)
+        start, end = 0, None
+        from puppyjustice import preview
+        if arguments["--range"]:
+            start, end = preview.parse_range(arguments["--range"])
+
+        if arguments["--preview"]:
+            plan = preview.preview_plan(plan, start=start, end=end)
+            preview.render_preview(plan, audio, arguments["<output>"],
+                                   arguments["--backend"],
+                                   int(arguments["--max-readers"]), frames,
+                                   arguments["--mux-audio"])
+            exit(0)
+
+        if arguments["--range"]:
+            plan = planner.trim_plan(plan, start, end)
+        resources = catalog.load_resources(
+            "resources", max_open=int(arguments["--max-readers"]),
+            frame_cache=frames)
+        render_video(plan, resources, audio, arguments["<output>"],
+                     arguments["--backend"], int(arguments["--workers"]),
+                     arguments["--profile-frames"],
+                     rendered_segment_cache(arguments), frames,
+                     arguments["--mux-audio"],
+                     int(arguments["--max-readers"]))
+        exit(0)
+
+    if arguments["import-handled"]:
+        store = jobstore.JobStore(arguments["--jobs"])
+        count = store.import_handled(arguments["<file>"])
+        logging.info("Imported {} handled cases from {}".format(
+            count, arguments["<file>"]))
+        exit(0)
 
-        if finished:
-            cases_file.write(str(case["ID"]) + "\n")
+    store = open_job_store(arguments)
+
+    if arguments["queue"]:
+        # Cases with every part already queued are left to 'batch'
+        for job in case_jobs(store,
+                             store.handled_cases() | store.queued_cases()):
+            store.add(job)
+        logging.info("Queued jobs: {}".format(store.counts()))
+        exit(0)
+
+    frames = decoded_frame_cache(arguments)
+    resources = catalog.load_resources(
+        "resources", max_open=int(arguments["--max-readers"]),
+        frame_cache=frames)
+
+    if arguments["batch"]:
+        run_batch(store, resources, arguments)
+        exit(0)
+
+    # Cases are only recorded as handled once every part has been uploaded
+    progress = pipeline.CaseProgress(store.mark_case)
+
+    if arguments["upload"]:
+        uploads = upload_queue(arguments, progress, store)
+        for job in pipeline.pending_uploads(arguments["<directory>"]):
+            logging.info("Uploading pending job {}".format(job.id))
+            progress.add(job)
+            uploads.submit(upload_options(job), job)
+        uploads.close()
+        exit(0)
+
+    if arguments["<case>"] and arguments["<transcript>"]:
+        case = json.load(open(arguments["<case>"]))
+        transcript = json.load(open(arguments["<transcript>"]))
+        title = arguments["<title>"]
+
+        build_video_and_upload_case(title, case, "description",
+                                    transcript, resources)
+        exit(0)
+
+
+    # Rendered videos go on to be uploaded several at a time
+    uploads = upload_queue(arguments, progress, store)
+
+    def job_rendered(job):
+        if job.skipped:
+            job.cleanup()
+            progress.finish(job)
+        else:
+            uploads.submit(upload_options(job), job)
+
+    videos = pipeline.Pipeline(video_stages(resources, arguments["--backend"],
+                                            int(arguments["--workers"]),
+                                            arguments["--profile-frames"],
+                                            rendered_segment_cache(arguments),
+                                            frames, arguments["--mux-audio"],
+                                            int(arguments["--max-readers"])),
+                               done=job_rendered,
+                               failed=lambda job: progress.finish(job, True),
+                               store=store)
+
+    worker = "{}:{}".format(socket.gethostname(), os.getpid())
+    for job in case_jobs(store, store.handled_cases()):
+        progress.add(job)
+        if store.is_done(job):
+            # Uploaded by a run that died before the rest of its case
+            progress.finish(job)
+            continue
+        store.add(job)
+        if store.claim(worker, job) is None:
+            # Being made by another process, or out of attempts
+            logging.info("Job {} is claimed or failed, leaving it".format(
+                job.id))
+            progress.finish(job, failed=True)
+            continue
+        videos.submit(job)
 
-        for f in glob.glob('build/*'):
-            os.remove(f)
+    videos.close()
+    uploads.close()
@@ -0,0 +1,11 @@
+import pytest
+from puppyjustice import metrics
+
+
+@pytest.fixture(autouse=True)
+def metrics_in_tmp(tmp_path, monkeypatch):
+    """ Keep the metrics files written by the code under test out of the
+    working tree
+    """
+    monkeypatch.setattr(metrics, "_metrics", metrics.Metrics(
+        str(tmp_path / "metrics.jsonl"), str(tmp_path / "metrics.prom")))
@@ -0,0 +1,32 @@
+import os
+from puppyjustice import disk_cache
+
+
+def make_file(directory, name, size, mtime):
+    path = os.path.join(str(directory), name)
+    with open(path, "wb") as file:
+        file.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_evicts_least_recently_used_first(tmp_path):
+    oldest = make_file(tmp_path, "a.mp4", 100, 1000)
+    kept = make_file(tmp_path, "b.mp4", 100, 1001)
+    newest = make_file(tmp_path, "c.mp4", 100, 1002)
+    rendering = make_file(tmp_path, "d.tmp.mp4", 500, 900)
+
+    total = disk_cache.evict(str(tmp_path), 150, keep=kept,
+                             include=lambda name: not name.endswith(".tmp.mp4"))
+    assert total == 100
+    assert not os.path.exists(oldest)
+    assert os.path.exists(kept)
+    assert not os.path.exists(newest)
+    assert os.path.exists(rendering)
+
+
+def test_leaves_a_cache_within_budget(tmp_path):
+    paths = [make_file(tmp_path, "{}.png".format(i), 100, 1000 + i)
+             for i in range(3)]
+    assert disk_cache.evict(str(tmp_path), 300) == 300
+    assert all(os.path.exists(path) for path in paths)
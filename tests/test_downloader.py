@@ -0,0 +1,266 @@
+import gzip
+import json
+import os
+import subprocess
+import threading
+import time
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from puppyjustice import downloader
+
+""" The Oyez client against a local http.server: requests on a thread reuse
+its keep-alive connection, concurrent fetches stay within the fetcher's pool
+and come back in order, responses are cached, a cached response is
+revalidated with a conditional request, and offline mode serves from the
+cache without touching the network.
+"""
+
+
+class OyezHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the fetcher's connections are kept alive between requests
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.path, dict(self.headers)))
+        server.ports.append(self.client_address[1])
+        with server.lock:
+            server.active += 1
+            server.most_active = max(server.most_active, server.active)
+        try:
+            time.sleep(server.delays.get(self.path, 0))
+            self.respond()
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    def respond(self):
+        server = self.server
+        if self.path in server.files:
+            return self.send_file(server.files[self.path])
+        if self.path not in server.documents:
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        document, etag = server.documents[self.path]
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        body = json.dumps(document).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", etag)
+        if "gzip" in self.headers.get("Accept-encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, data):
+        start = 0
+        if "Range" in self.headers:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", "bytes */{}".format(len(data)))
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(
+                start, len(data) - 1, len(data)))
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data) - start))
+        self.end_headers()
+        self.wfile.write(data[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OyezHandler)
+    server.documents = {}
+    server.files = {}
+    server.requests = []
+    # The client port of each request, and how many were answered at once
+    server.ports = []
+    server.delays = {}
+    server.lock = threading.Lock()
+    server.active = 0
+    server.most_active = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url(server, path):
+    return "http://127.0.0.1:{}{}".format(server.server_address[1], path)
+
+
+def validators(server):
+    """ The ETag each request was conditional on, if any """
+    return [headers.get("If-None-Match") for _, headers in server.requests]
+
+
+def test_requests_on_a_thread_share_a_connection(server):
+    for i in range(3):
+        server.documents["/cases/{}".format(i)] = ({"ID": i}, '"v1"')
+    fetcher = downloader.Fetcher()
+
+    for i in range(3):
+        assert fetcher.fetch_json(url(server, "/cases/{}".format(i))) == \
+            {"ID": i}
+    assert len(set(server.ports)) == 1
+
+    # Each pool thread keeps a connection of its own
+    server.ports.clear()
+    downloader.download_all_json(
+        [url(server, "/cases/{}".format(i % 3)) for i in range(12)], fetcher)
+    assert len(set(server.ports)) <= downloader.MAX_CONCURRENT_REQUESTS
+
+
+def test_fetches_within_the_pool_in_order(server):
+    urls = []
+    for i in range(8):
+        path = "/cases/{}".format(i)
+        server.documents[path] = ({"ID": i}, '"v1"')
+        # The earlier the case, the later its response
+        server.delays[path] = 0.02 * (8 - i)
+        urls.append(url(server, path))
+    fetcher = downloader.Fetcher(max_workers=3)
+
+    assert downloader.download_all_json(urls, fetcher) == \
+        [{"ID": i} for i in range(8)]
+    assert 1 < server.most_active <= 3
+
+
+def test_prefetches_cases_ahead_in_order(server):
+    short_cases = []
+    for i in range(6):
+        case_path, media_path = "/cases/{}".format(i), "/media/{}".format(i)
+        server.documents[case_path] = (
+            {"ID": i, "oral_argument_audio": [{"href": url(server,
+                                                           media_path)}]},
+            '"v1"')
+        server.documents[media_path] = ({"id": i}, '"v1"')
+        server.delays[case_path] = 0.02 * (6 - i)
+        short_cases.append({"ID": i, "href": url(server, case_path)})
+    fetcher = downloader.Fetcher(max_workers=2)
+
+    fetches = downloader.prefetch_cases(short_cases, fetcher, lookahead=2)
+    first = next(fetches)
+    assert first.case.result()["ID"] == 0
+    assert list(first.media_json()) == [{"id": 0}]
+    # Only the next two cases have been started
+    assert {path for path, _ in server.requests if path.startswith("/cases")} \
+        <= {"/cases/0", "/cases/1", "/cases/2"}
+
+    rest = [(fetch.case.result()["ID"], list(fetch.media_json()))
+            for fetch in fetches]
+    assert rest == [(i, [{"id": i}]) for i in range(1, 6)]
+    assert 1 < server.most_active <= 2
+
+
+def test_cache_hit_without_revalidating(server, tmp_path):
+    server.documents["/cases/1"] = ({"ID": 1, "name": "First"}, '"v1"')
+    fetcher = downloader.Fetcher(cache=downloader.HTTPCache(str(tmp_path)))
+
+    assert fetcher.fetch_json(url(server, "/cases/1")) == \
+        {"ID": 1, "name": "First"}
+    assert fetcher.fetch_json(url(server, "/cases/1"), revalidate=False) == \
+        {"ID": 1, "name": "First"}
+    assert len(server.requests) == 1
+
+
+def test_revalidates_with_etag(server, tmp_path):
+    server.documents["/cases"] = ([{"ID": 1}, {"ID": 2}], '"v1"')
+    fetcher = downloader.Fetcher(cache=downloader.HTTPCache(str(tmp_path)))
+
+    assert fetcher.fetch_json(url(server, "/cases")) == [{"ID": 1}, {"ID": 2}]
+    # Unchanged: a 304, answered from the cache
+    assert list(fetcher.stream_json(url(server, "/cases"))) == \
+        [{"ID": 1}, {"ID": 2}]
+    assert validators(server) == [None, '"v1"']
+
+    # Changed: downloaded and cached again
+    server.documents["/cases"] = ([{"ID": 3}], '"v2"')
+    assert fetcher.fetch_json(url(server, "/cases")) == [{"ID": 3}]
+    assert fetcher.fetch_json(url(server, "/cases")) == [{"ID": 3}]
+    assert validators(server) == [None, '"v1"', '"v1"', '"v2"']
+
+
+def test_offline_uses_the_cache(server, tmp_path):
+    server.documents["/cases/1"] = ({"ID": 1}, '"v1"')
+    cache = downloader.HTTPCache(str(tmp_path))
+    downloader.Fetcher(cache=cache).fetch_json(url(server, "/cases/1"))
+    server.requests.clear()
+
+    offline = downloader.Fetcher(cache=cache, offline=True)
+    assert offline.fetch_json(url(server, "/cases/1")) == {"ID": 1}
+    with pytest.raises(downloader.NotCached):
+        offline.fetch_json(url(server, "/cases/2"))
+    assert server.requests == []
+
+
+def test_http_errors_are_not_cached(server, tmp_path):
+    cache = downloader.HTTPCache(str(tmp_path))
+    fetcher = downloader.Fetcher(cache=cache)
+    with pytest.raises(urllib.error.HTTPError):
+        fetcher.fetch_json(url(server, "/missing"))
+    assert cache.lookup(url(server, "/missing")) is None
+
+
+@pytest.fixture
+def argument(server, tmp_path, monkeypatch):
+    """ A short argument recording served at /argument.mp3, and its media
+    JSON
+    """
+    monkeypatch.setattr(downloader, "_fetcher", downloader.Fetcher())
+    path = str(tmp_path / "argument.mp3")
+    subprocess.check_call(["ffmpeg", "-v", "error", "-f", "lavfi",
+                           "-i", "sine=duration=1", path])
+    with open(path, "rb") as file:
+        server.files["/argument.mp3"] = file.read()
+    return {"id": 5, "media_file": [{"href": url(server, "/argument.mp3")}]}
+
+
+def test_finishes_a_complete_part_file(server, argument, tmp_path):
+    directory = str(tmp_path / "audio")
+    os.makedirs(directory)
+    data = server.files["/argument.mp3"]
+    with open(os.path.join(directory, "5.mp3.part"), "wb") as file:
+        file.write(data)
+
+    # The range request for the rest is refused with a 416
+    path = downloader.fetch_audio(argument, directory)
+    assert path == os.path.join(directory, "5.mp3")
+    with open(path, "rb") as file:
+        assert file.read() == data
+    assert [headers.get("Range") for _, headers in server.requests] == \
+        ["bytes={}-".format(len(data))]
+
+
+def test_audio_cache_is_kept_within_budget(server, argument, tmp_path):
+    directory = str(tmp_path / "audio")
+    os.makedirs(directory)
+    old = os.path.join(directory, "4.mp3")
+    with open(old, "wb") as file:
+        file.write(b"x" * 1000)
+    os.utime(old, (1000, 1000))
+
+    size = len(server.files["/argument.mp3"])
+    path = downloader.fetch_audio(argument, directory, max_bytes=size + 500)
+    assert os.path.exists(path)
+    assert not os.path.exists(old)
@@ -0,0 +1,54 @@
+import json
+import multiprocessing
+import os
+from puppyjustice import metrics
+
+
+def read_records(path):
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line) for line in file]
+
+
+def count_in_worker(recorder):
+    recorder.count("bytes_total", 1000, direction="download")
+    recorder.flush()
+
+
+def test_counters_are_written_when_flushed(tmp_path):
+    recorder = metrics.Metrics(str(tmp_path / "metrics.jsonl"),
+                               str(tmp_path / "metrics.prom"))
+    for _ in range(1000):
+        recorder.count("bytes_total", 65536, direction="download")
+    # Not written for every chunk
+    assert not os.path.exists(tmp_path / "metrics.prom")
+
+    with recorder.span("fetch"):
+        pass
+    counters = {record["name"]: record
+                for record in read_records(tmp_path / "metrics.jsonl")
+                if record["type"] == "counter"}
+    assert counters["bytes_total"]["value"] == 65536000
+    assert counters["bytes_total"]["labels"] == {"direction": "download"}
+    assert counters["stage_total"]["labels"] == {"stage": "fetch"}
+    with open(tmp_path / "metrics.prom", encoding='utf-8') as file:
+        assert 'puppyjustice_bytes_total{direction="download"} 65536000\n' \
+            in file.read()
+
+
+def test_worker_processes_write_no_totals(tmp_path):
+    recorder = metrics.Metrics(str(tmp_path / "metrics.jsonl"),
+                               str(tmp_path / "metrics.prom"))
+    recorder.count("bytes_total", 5, direction="download")
+    recorder.flush()
+
+    worker = multiprocessing.get_context("fork").Process(
+        target=count_in_worker, args=(recorder,))
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    with open(tmp_path / "metrics.prom", encoding='utf-8') as file:
+        assert 'puppyjustice_bytes_total{direction="download"} 5\n' \
+            in file.read()
+    assert [record["value"] for record in
+            read_records(tmp_path / "metrics.jsonl")] == [5]
@@ -0,0 +1,43 @@
+import threading
+from PIL import Image
+from puppyjustice import overlays
+
+""" Cards drawn into the overlay cache by several threads at once, as by the
+render workers of several runs
+"""
+
+
+def draw():
+    return Image.new("RGBA", (320, 180), "white")
+
+
+def test_concurrent_draws_of_a_card(tmp_path, monkeypatch):
+    monkeypatch.setattr(overlays, "CACHE_DIR", str(tmp_path))
+    path = str(tmp_path / "ab" / "card.png")
+    errors = []
+
+    def draw_card():
+        try:
+            for _ in range(20):
+                assert overlays.cached_image(path, draw) == path
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=draw_card) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert [p.name for p in (tmp_path / "ab").iterdir()] == ["card.png"]
+
+
+def test_evicts_at_most_once_an_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(overlays, "CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(overlays, "_last_evicted", None)
+    evictions = []
+    monkeypatch.setattr(overlays, "evict", lambda: evictions.append(1))
+
+    for i in range(10):
+        overlays.cached_image(str(tmp_path / "ab" / "{}.png".format(i)), draw)
+    assert len(evictions) == 1
@@ -0,0 +1,50 @@
+import math
+import random
+from puppyjustice import planner
+
+""" Turns planned from small clip libraries, where the scheduler runs out of
+clips it would rather use
+"""
+
+
+class Clip(object):
+    def __init__(self, path, duration):
+        self.path = path
+        self.duration = duration
+
+
+def scheduler(misc):
+    resources = {
+        "kennedy": [Clip("kennedy/a.mp4", 2.5), Clip("kennedy/b.mp4", 2.6)],
+        planner.MISC: misc,
+    }
+    return planner.ClipScheduler(resources, random.Random(0))
+
+
+def covered(entries):
+    return sum(planner.entry_duration(entry) for entry in entries)
+
+
+def plan_turns(clips, duration):
+    for seed in range(20):
+        clips.random.seed(seed)
+        entries, remaining = clips.plan_turn("kennedy", duration)
+        assert math.isclose(covered(entries) + remaining, duration)
+        assert remaining <= planner.MIN_CLIP_DURATION
+
+
+def test_one_short_misc_clip():
+    # The cutaway just used is all there is, and too short to trim
+    plan_turns(scheduler([Clip("misc/a.mp4", 3.0)]), 30)
+
+
+def test_one_long_misc_clip():
+    plan_turns(scheduler([Clip("misc/a.mp4", 10.0)]), 30)
+
+
+def test_turn_of_the_shortest_clip_is_carried():
+    clips = scheduler([Clip("misc/a.mp4", 3.0)])
+    entries, remaining = clips.plan_turn("kennedy",
+                                         planner.MIN_CLIP_DURATION)
+    assert entries is None
+    assert remaining == planner.MIN_CLIP_DURATION
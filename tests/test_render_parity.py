@@ -0,0 +1,145 @@
+import os
+import subprocess
+import numpy as np
+import pytest
+from moviepy.editor import VideoFileClip
+from puppyjustice import builder, catalog, renderer
+
+""" The moviepy and ffmpeg backends render the same plan to the same frames
+and put the argument audio at the same place. The resource clips are tiny
+synthetic videos whose red level rises a step with every frame, so a clip cut
+a frame early or late shows up in the mean colour of the output frames.
+The backends may pick neighbouring source frames, so frames are compared to
+within two source frames, and the frame on each cut is left out as moviepy
+cuts on the frame after the planned start while ffmpeg cuts on the nearest.
+"""
+
+SIZE = (160, 90)
+FPS = 30
+SOURCE_FPS = 25
+STEP = 2
+BEEP = 2.0
+AUDIO_OFFSET = 5.0
+SAMPLE_RATE = 8000
+
+
+def ffmpeg(*args):
+    subprocess.check_call(["ffmpeg", "-y", "-v", "error"] + list(args))
+
+
+def make_source(path, base):
+    ffmpeg("-f", "lavfi", "-i", "color=c=black:s={}x{}:r={}:d=4".format(
+               SIZE[0], SIZE[1], SOURCE_FPS),
+           "-vf", "format=rgb24,geq=r='{}+N*{}':g=128:b=64".format(base, STEP),
+           "-c:v", "libx264", "-g", "50", "-pix_fmt", "yuv420p", path)
+
+
+def make_argument(path):
+    """ A silent video with a short beep BEEP seconds in """
+    ffmpeg("-f", "lavfi", "-i", "color=c=black:s=64x36:r=25:d=6",
+           "-f", "lavfi", "-i",
+           "sine=frequency=1000:duration=0.2,adelay={}:all=1,apad=whole_dur=6"
+           .format(int(BEEP * 1000)),
+           "-c:v", "libx264", "-c:a", "aac", "-shortest", path)
+
+
+@pytest.fixture
+def setup(tmp_path):
+    base = tmp_path / "resources"
+    os.makedirs(base / "kennedy")
+    first = str(base / "kennedy" / "first.mp4")
+    second = str(base / "kennedy" / "second.mp4")
+    make_source(first, 0)
+    make_source(second, 40)
+    argument = str(tmp_path / "argument.mp4")
+    make_argument(argument)
+
+    resources = catalog.load_resources(
+        str(base), str(tmp_path / "catalog.json"),
+        mezzanine_dir=str(tmp_path / "mezzanine"), size=SIZE)
+    plan = {
+        "title": "Parity",
+        "size": list(SIZE),
+        "fps": FPS,
+        "intro": None,
+        # In points between source frames, and clip lengths that aren't a
+        # whole number of frames at either rate
+        "clips": [
+            {"source": first, "in": 0.53, "out": 3.05, "overlays": [],
+             "start": 0, "turn": 0},
+            {"source": second, "in": 1.21, "out": 3.9, "overlays": [],
+             "start": 2.52, "turn": 1},
+            {"source": first, "in": 0.1, "out": 3.3, "overlays": [],
+             "start": 5.21, "turn": 2},
+        ],
+        "ending": None,
+        "audio_offset": AUDIO_OFFSET,
+        "duration": 8.41,
+    }
+    return tmp_path, plan, resources, argument
+
+
+def render_moviepy(plan, resources, argument, output):
+    audio = VideoFileClip(argument)
+    try:
+        video = builder.render_plan(plan, resources, audio)
+        video.write_videofile(output, fps=FPS, audio_codec="aac",
+                              temp_audiofile=output + ".m4a", logger=None)
+    finally:
+        audio.close()
+
+
+def red_levels(path):
+    """ The mean red level of every frame """
+    data = subprocess.check_output(["ffmpeg", "-v", "error", "-i", path,
+                                    "-f", "rawvideo", "-pix_fmt", "rgb24",
+                                    "-"])
+    frames = np.frombuffer(data, np.uint8).reshape(-1, SIZE[1], SIZE[0], 3)
+    return frames[..., 0].mean(axis=(1, 2))
+
+
+def beep_time(path):
+    """ When the audio first gets loud, in seconds from the start """
+    data = subprocess.check_output(["ffmpeg", "-v", "error", "-i", path,
+                                    "-af", "aresample=async=1:first_pts=0",
+                                    "-f", "s16le", "-ac", "1",
+                                    "-ar", str(SAMPLE_RATE), "-"])
+    samples = np.abs(np.frombuffer(data, np.int16).astype(np.int32))
+    assert samples.max() > 1000, "no beep in {}".format(path)
+    return np.argmax(samples > samples.max() // 2) / SAMPLE_RATE
+
+
+def test_backends_render_the_same_frames(setup):
+    directory, plan, resources, argument = setup
+    moviepy_output = str(directory / "moviepy.mp4")
+    ffmpeg_output = str(directory / "ffmpeg.mp4")
+    render_moviepy(plan, resources, argument, moviepy_output)
+    renderer.render_plan(plan, argument, ffmpeg_output)
+
+    frames = round(plan["duration"] * FPS)
+    assert renderer.frame_count(ffmpeg_output) == frames
+    moviepy_levels = red_levels(moviepy_output)
+    ffmpeg_levels = red_levels(ffmpeg_output)
+    assert len(ffmpeg_levels) == frames
+    # moviepy's write_videofile may add a frame at the very end
+    assert len(moviepy_levels) in (frames, frames + 1)
+
+    cuts = [round(entry["start"] * FPS) for entry in plan["clips"][1:]]
+    compared = np.ones(frames, bool)
+    compared[cuts] = False
+    difference = np.abs(moviepy_levels[:frames] - ffmpeg_levels)
+    difference[~compared] = 0
+    assert difference.max() <= 2 * STEP + 1, \
+        "frames differ from frame {}".format(np.argmax(difference > 2 * STEP + 1))
+
+
+def test_backends_place_the_audio_the_same(setup):
+    directory, plan, resources, argument = setup
+    moviepy_output = str(directory / "moviepy.mp4")
+    ffmpeg_output = str(directory / "ffmpeg.mp4")
+    render_moviepy(plan, resources, argument, moviepy_output)
+    renderer.render_plan(plan, argument, ffmpeg_output)
+
+    expected = BEEP + AUDIO_OFFSET
+    assert beep_time(ffmpeg_output) == pytest.approx(expected, abs=0.05)
+    assert beep_time(moviepy_output) == pytest.approx(expected, abs=0.05)
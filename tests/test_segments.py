@@ -0,0 +1,96 @@
+import logging
+import threading
+import pytest
+from puppyjustice import segments
+
+""" Plans are cut into segments on frame boundaries, and the worker
+processes rendering them start from a fork server rather than as forks of
+the runner, whose pipeline and upload threads may hold locks at the time.
+"""
+
+# Held by the test while the pool starts, as a pipeline thread might
+LOCK = threading.Lock()
+
+
+def clips_plan():
+    # Turns that end between frames at 30 fps
+    return {
+        "intro": {"start": 0},
+        "clips": [
+            {"in": 0.53, "out": 3.05, "start": 0, "turn": 0},
+            {"in": 1.21, "out": 3.9, "start": 2.52, "turn": 1},
+            {"in": 0.1, "out": 3.3, "start": 5.21, "turn": 2},
+            {"in": 0.4, "out": 2.0, "start": 8.41, "turn": 3},
+        ],
+        "ending": {"start": 10.01},
+        "duration": 13.37,
+    }
+
+
+@pytest.mark.parametrize("count", [1, 2, 3, 4])
+def test_split_plan_keeps_every_frame(count):
+    plan = clips_plan()
+    plans = segments.split_plan(plan, count)
+    assert len(plans) == count
+
+    frames = [plan["duration"] * segments.FPS for plan in plans]
+    assert frames == pytest.approx([round(f) for f in frames])
+    assert sum(round(f) for f in frames) == \
+        round(plan["duration"] * segments.FPS)
+    assert [entry["turn"] for part in plans for entry in part["clips"]] == \
+        [0, 1, 2, 3]
+    assert plans[0]["intro"] is not None and plans[-1]["ending"] is not None
+
+
+def take_lock():
+    logging.info("Worker took the lock")
+    return LOCK.acquire(timeout=5)
+
+
+def test_workers_do_not_inherit_held_locks(tmp_path):
+    root = logging.getLogger()
+    handler = logging.FileHandler(str(tmp_path / "log.txt"))
+    root.addHandler(handler)
+    level = root.level
+    root.setLevel(logging.INFO)
+    try:
+        with LOCK:
+            with segments.worker_pool(1) as pool:
+                assert pool.submit(take_lock).result()
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(level)
+        handler.close()
+
+    # And they log to the same file
+    with open(tmp_path / "log.txt", encoding='utf-8') as file:
+        assert "Worker took the lock" in file.read()
+
+
+class FakeVideo(object):
+    def set_duration(self, duration):
+        return self
+
+    def write_videofile(self, output, **options):
+        pass
+
+
+def test_workers_load_resources_for_the_pool(monkeypatch):
+    from puppyjustice import builder
+    loaded = []
+    monkeypatch.setattr(builder, "generate_resource_mapping",
+                        lambda base, **options: loaded.append(options) or {})
+    monkeypatch.setattr(builder, "render_plan",
+                        lambda plan, resources: FakeVideo())
+    monkeypatch.setattr(segments, "frame_count", lambda path: 30)
+    monkeypatch.setattr(segments, "_worker_resources", None)
+    monkeypatch.setattr(segments, "_worker_max_open", None)
+
+    segments.init_worker([], logging.INFO, 3)
+    plan = dict(clips_plan(), size=[320, 180], duration=1.0)
+    for _ in range(2):
+        segments.render_segment(plan, "segment.mp4")
+    # A preview at another size loads them again
+    segments.render_segment(dict(plan, size=[160, 90]), "segment.mp4")
+    assert [(options["max_open"], options["size"]) for options in loaded] == \
+        [(3, (320, 180)), (3, (160, 90))]
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, MediaFileUpload, build_http
+from puppyjustice import uploader
+
+""" Resuming an upload against a fake endpoint speaking the resumable upload
+protocol: a POST opens a session, each PUT appends a chunk and is answered
+with a 308 and the range received, and an empty PUT asks for that range.
+"""
+
+CHUNK = 256 * 1024
+SIZE = 5 * CHUNK + 1000
+
+
+class ResumableHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        path = "/session/{}".format(len(self.server.sessions))
+        self.server.sessions[path] = bytearray()
+        self.reply(200, Location="http://127.0.0.1:{}{}".format(
+            self.server.server_address[1], path))
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_range = self.headers["Content-Range"]
+        self.server.requests.append(content_range)
+        if self.path not in self.server.sessions:
+            return self.reply(404)
+        data = self.server.sessions[self.path]
+
+        if not content_range.startswith("bytes */"):
+            first = int(content_range.split()[1].split("-")[0])
+            assert first == len(data), "chunk doesn't follow on"
+            data.extend(body)
+        if len(data) == SIZE:
+            return self.reply(201, body=json.dumps({"id": "video1"}).encode())
+        if data:
+            return self.reply(308, Range="bytes=0-{}".format(len(data) - 1))
+        self.reply(308)
+
+    def reply(self, status, body=b"", **headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ResumableHandler)
+    server.sessions = {}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / "video.mp4")
+    with open(path, "wb") as file:
+        file.write(os.urandom(SIZE))
+    return path
+
+
+def insert_request(server, path):
+    """ A request like the one videos().insert builds """
+    media = MediaFileUpload(path, mimetype="video/mp4", chunksize=CHUNK,
+                            resumable=True)
+    return HttpRequest(build_http(),
+                       lambda response, content: json.loads(content),
+                       "http://127.0.0.1:{}/upload?uploadType=resumable".format(
+                           server.server_address[1]),
+                       method="POST", body="{}",
+                       headers={"content-type": "application/json"},
+                       resumable=media)
+
+
+def received(server):
+    [data] = server.sessions.values()
+    return bytes(data)
+
+
+def test_resumes_from_what_the_server_has(server, video, tmp_path):
+    session = uploader.UploadSession(video, str(tmp_path / "state"))
+    request = insert_request(server, video)
+    for _ in range(2):
+        request.next_chunk()
+        session.save_progress(request)
+    # Sent but never saved, as if the process died before it could
+    request.next_chunk()
+
+    request = insert_request(server, video)
+    assert session.restore(request, request.http) is None
+    assert request.resumable_progress == 3 * CHUNK
+    assert uploader.resumable_upload(request, session) == {"id": "video1"}
+
+    with open(video, "rb") as file:
+        assert received(server) == file.read()
+    # One status query, and no chunk sent twice
+    assert server.requests.count("bytes */{}".format(SIZE)) == 1
+    assert len(server.requests) == 7
+
+
+def test_restores_a_finished_upload(server, video, tmp_path):
+    session = uploader.UploadSession(video, str(tmp_path / "state"))
+    request = insert_request(server, video)
+    request.next_chunk()
+    session.save_progress(request)
+    uploader.resumable_upload(request)
+
+    request = insert_request(server, video)
+    assert session.restore(request, request.http) == {"id": "video1"}
+
+
+def test_starts_again_when_the_session_is_gone(server, video, tmp_path):
+    session = uploader.UploadSession(video, str(tmp_path / "state"))
+    request = insert_request(server, video)
+    request.next_chunk()
+    session.save_progress(request)
+    server.sessions.clear()
+
+    request = insert_request(server, video)
+    assert session.restore(request, request.http) is None
+    assert request.resumable_uri is None
+    assert session.get("uri") is None
+    assert uploader.resumable_upload(request, session) == {"id": "video1"}
+    with open(video, "rb") as file:
+        assert received(server) == file.read()
+
+
+class FailingRequest(object):
+    """ An insert request whose every chunk fails with a 503, while another
+    upload sharing the backoff succeeds in between
+    """
+
+    def __init__(self, backoff):
+        self.backoff = backoff
+        self.resumable = MediaFileUpload(__file__, chunksize=CHUNK,
+                                         resumable=True)
+        self.resumable_progress = 0
+        self.attempts = 0
+
+    def next_chunk(self, http=None):
+        self.attempts += 1
+        self.backoff.success()
+        response = httplib2.Response({"status": 503})
+        raise HttpError(response, b"Backend Error")
+
+
+def test_gives_up_while_other_uploads_succeed(monkeypatch):
+    monkeypatch.setattr(uploader.time, "sleep", lambda seconds: None)
+    backoff = uploader.Backoff(max_retries=3)
+    request = FailingRequest(backoff)
+    with pytest.raises(SystemExit):
+        uploader.resumable_upload(request, backoff=backoff)
+    assert request.attempts == 4